@@ -2,170 +2,139 @@
 
 
 # bynav_GNSS.py
-import machine, usocket, uselect, ubinascii, time
+import machine, time
 import uasyncio as asyncio
-from config import TX_PIN, RX_PIN, UART_BAUD_RATE
+from config import (TX_PIN, RX_PIN, UART_BAUD_RATE, UART_RX_BUF,
+                    UART_TX_BUF, WIRE_FORMAT, CAPTURE_ENABLED)
 from password import NTRIP_CONFIG
 from data_queue import gnss_queue
+from nmea import NmeaFramer, RMC, VTG
+from ntrip import NtripClient
+from rtcm import Rtcm3Framer
+from metrics import metrics
+from lagmon import lag
+import wire
+if CAPTURE_ENABLED:
+    from capture import capture, SRC_UART, SRC_RTCM
+
+_BINARY = WIRE_FORMAT == "binary"
+
+# module-level so the NMEA/RTCM counters outlive the task
+framer = NmeaFramer()
+rtcm = None
+metrics.nmea = framer
+
+_SEC_NMEA = lag.section("gnss.nmea")
+_SEC_RTCM = lag.section("gnss.rtcm")      # framing + blocking uart.write
 
 async def gnss_setup():
     """Quick, non-blocking UART init. NTRIP is connected later in gnss_task."""
     print("Initializing GNSS (UART) quick setup...")
     uart = machine.UART(1, baudrate=UART_BAUD_RATE,
-                        tx=machine.Pin(TX_PIN), rx=machine.Pin(RX_PIN))
+                        tx=machine.Pin(TX_PIN), rx=machine.Pin(RX_PIN),
+                        rxbuf=UART_RX_BUF, txbuf=UART_TX_BUF)
     return None, uart, None
 
-def _parse_gpgga(s: str):
-    if not s.startswith("$GPGGA"):
-        return None
-    p = s.strip().split(',')
-    if len(p) < 15:
+def _ntrip_client():
+    if not NTRIP_CONFIG.get("enabled", True):
         return None
-    try:
-        fixq = int(p[6] or 0)
-        if fixq < 1:                 # accept any valid fix during testing
-            return None
-        lat_raw, lat_dir = p[2], p[3]
-        lon_raw, lon_dir = p[4], p[5]
-        if not lat_raw or not lon_raw:
-            return None
-        lat = int(lat_raw[:2]) + float(lat_raw[2:]) / 60.0
-        lon = int(lon_raw[:3]) + float(lon_raw[3:]) / 60.0
-        if lat_dir == 'S': lat = -lat
-        if lon_dir == 'W': lon = -lon
-        return {"lat": lat, "lon": lon, "fixq": fixq}
-    except:
-        return None
-
-async def _connect_ntrip_with_gga(gga_str: str):
-    auth = ubinascii.b2a_base64(
-        ("%s:%s" % (NTRIP_CONFIG['username_ntrip'], NTRIP_CONFIG['password_ntrip'])).encode()
-    ).decode().strip()
-    req = (
-        "GET /%s HTTP/1.1\r\n"
-        "Host: %s\r\n"
-        "Ntrip-Version: Ntrip/2.0\r\n"
-        "User-Agent: MicroPython NTRIP Client\r\n"
-        "Authorization: Basic %s\r\n"
-        "Ntrip-GGA: %s\r\n"
-        "\r\n"
-    ) % (NTRIP_CONFIG['mountpoint'], NTRIP_CONFIG['host'], auth, gga_str)
-
-    addr = usocket.getaddrinfo(NTRIP_CONFIG['host'], NTRIP_CONFIG['port'])[0][-1]
-    sock = usocket.socket()
-    sock.connect(addr)
-    sock.send(req.encode())
+    return NtripClient(NTRIP_CONFIG['host'], NTRIP_CONFIG['port'],
+                       NTRIP_CONFIG['mountpoint'],
+                       NTRIP_CONFIG['username_ntrip'],
+                       NTRIP_CONFIG['password_ntrip'],
+                       NTRIP_CONFIG.get("version", 2))
+
+class Link:
+    """Latest navigation state from the UART reader."""
+    def __init__(self):
+        self.latest_fix_gga = None      # bytes, without CRLF
+        self.speed_kmh = None
+        self.course_deg = None
+
+def _enqueue_fix(pico_id, fixq, lat, lon, utc=None):
+    if utc is None:
+        utc = time.time()
+    if _BINARY:
+        gnss_queue.enqueue(wire.encode_gnss(lat, lon, fixq,
+                                            utc, time.ticks_ms()))
+    else:
+        gnss_queue.enqueue({
+            "Pico_ID": pico_id,
+            "Timestamp_UTC": utc,
+            "Latitude": lat,
+            "Longitude": lon,
+            "FixQ": fixq,
+        })
+
+def handle_nmea(pico_id, link, ntrip=None, utc=None):
+    """Consume complete sentences in the framer; enqueue fixes."""
     while True:
-        line = sock.readline()
-        if not line or line == b'\r\n':
-            break
-    print("NTRIP connected; streaming RTCM.")
-    return sock
-
-async def gnss_task(sock, uart, pico_id):
-    """Wait for first valid GGA, then connect NTRIP; pump RTCM <-> UART; enqueue points."""
-    print("[GNSS] Task started.")
-    poller = None
-    last_gga_ms = time.ticks_ms()
-    latest_fix_gga = None
-    connected = False
-
+        kind = framer.next()
+        if not kind:
+            return
+        if kind == RMC:
+            valid, _, _, knots, course = framer.rmc()
+            if valid and knots is not None:
+                link.speed_kmh = knots * 1.852
+                link.course_deg = course
+            continue
+        if kind == VTG:
+            course, kmh = framer.vtg()
+            if kmh is not None:
+                link.speed_kmh = kmh
+                link.course_deg = course
+            continue
+        fixq, lat, lon, _, _, _ = framer.gga()
+        if fixq < 1 or lat is None or lon is None:  # any valid fix
+            continue
+        _enqueue_fix(pico_id, fixq, lat, lon, utc)
+        if ntrip:
+            # the client sends it on its own GGA schedule
+            link.latest_fix_gga = framer.sentence()
+            ntrip.set_gga(link.latest_fix_gga)
+
+async def _uart_reader(uart, pico_id, link, ntrip):
+    """Read UART bytes into the NMEA framer; enqueue fixes, hand GGA to NTRIP."""
+    reader = asyncio.StreamReader(uart)
     while True:
-        try:
-            # Read UART for GGA
-            if uart.any():
-                line = uart.readline()
-                if line and line.startswith(b"$GPGGA"):
-                    s = None
-                    try:
-                        s = line.decode().strip()
-                    except:
-                        s = None
-
-                    if s:
-                        parsed = _parse_gpgga(s)
-                        if parsed:
-                            latest_fix_gga = s
-                            gnss_queue.enqueue({
-                                "Pico_ID": pico_id,
-                                "Timestamp_UTC": time.time(),
-                                "Latitude": parsed["lat"],
-                                "Longitude": parsed["lon"],
-                                "FixQ": parsed["fixq"],
-                            })
-
-                        now = time.ticks_ms()
-                        if connected and time.ticks_diff(now, last_gga_ms) > 1000:
-                            try:
-                                sock.send(line)
-                            except Exception:
-                                # Suppressed NTRIP send errors
-                                connected = False
-                                poller = None
-                                sock = None
-                            last_gga_ms = now
-
-            # Connect NTRIP once we have a fix GGA
-            if (not connected) and latest_fix_gga:
-                try:
-                    sock = await _connect_ntrip_with_gga(latest_fix_gga)
-                    poller = uselect.poll()
-                    poller.register(sock, uselect.POLLIN)
-                    connected = True
-                except Exception:
-                    # Suppressed NTRIP connect errors
-                    await asyncio.sleep_ms(1000)
-
-            # Pump RTCM -> UART (non-blocking)
-            if connected and poller:
-                try:
-                    for _, ev in poller.poll(5):
-                        if ev & uselect.POLLIN:
-                            rtcm = sock.recv(512)
-                            if rtcm:
-                                uart.write(rtcm)
-                except Exception:
-                    # Suppressed RTCM errors
-                    connected = False
-                    poller = None
-                    sock = None
-
-        except Exception as e:
-            print("[GNSS] loop error:", e)
-
-        await asyncio.sleep_ms(20)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        space = framer.space()
+        n = await reader.readinto(space)
+        if not n:
+            continue
+        if CAPTURE_ENABLED:
+            capture.log(SRC_UART, space[:n])
+        framer.commit(n)
+        tok = lag.enter(_SEC_NMEA)
+        handle_nmea(pico_id, link, ntrip)
+        lag.exit(tok)
+
+def _rtcm_sink(mv):
+    if CAPTURE_ENABLED:
+        capture.log(SRC_RTCM, mv)
+    tok = lag.enter(_SEC_RTCM)
+    rtcm.feed(mv)
+    lag.exit(tok)
 
+async def gnss_task(sock, uart, pico_id):
+    """Enqueue GNSS fixes from the UART; stream NTRIP RTCM back into it.
 
+    NTRIP connects once the first fix GGA exists and runs as its own task,
+    so a slow caster never holds up the UART reader (or BLE/MQTT).
+    """
+    global rtcm
+    print("[GNSS] Task started.")
+    link = Link()
+    ntrip = _ntrip_client()
+    pump = None
+    if ntrip:
+        # only complete, CRC-valid (and allowed) RTCM frames reach the UART
+        rtcm = Rtcm3Framer(uart.write)
+        metrics.ntrip = ntrip
+        metrics.rtcm = rtcm
+        pump = asyncio.create_task(
+            ntrip.run(_rtcm_sink))
+    try:
+        await _uart_reader(uart, pico_id, link, ntrip)
+    finally:
+        if pump:
+            pump.cancel()
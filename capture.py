@@ -0,0 +1,102 @@
+# capture.py -- raw input log for reproducing a session with replay.py.
+#
+#   file header  <4sBII   magic b"5GCP", version, UTC and ticks_ms at open
+#   record       <BxHI    source, payload length, receive ticks_ms; payload
+#
+# Sources are SRC_BLE (GSP notification), SRC_CMD (GSP command written to the
+# sensor), SRC_UART (GNSS receiver bytes) and SRC_RTCM (NTRIP stream). Records
+# are collected in RAM and written a block at a time, like the spool; a torn
+# final record is simply ignored on replay.
+import os, time
+from struct import pack_into
+from config import (CAPTURE_DIR, CAPTURE_MAX_BYTES, CAPTURE_BLOCK_BYTES,
+                    CAPTURE_FLUSH_MS)
+
+MAGIC = b"5GCP"
+VERSION = 1
+FILE_HDR = "<4sBII"
+FILE_HDR_SIZE = 13
+REC_HDR = "<BxHI"
+REC_HDR_SIZE = 8
+
+SRC_BLE = 1
+SRC_CMD = 2
+SRC_UART = 3
+SRC_RTCM = 4
+
+class Capture:
+    def __init__(self, root=CAPTURE_DIR, max_bytes=CAPTURE_MAX_BYTES,
+                 block_bytes=CAPTURE_BLOCK_BYTES, flush_ms=CAPTURE_FLUSH_MS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.flush_ms = flush_ms
+        self._ram = bytearray(block_bytes)
+        self._mv = memoryview(self._ram)
+        self._len = 0
+        self._t0 = 0
+        self.path = None
+        self.size = 0
+        self.records = 0
+        self.dropped = 0
+
+    def log(self, src, data, tick=None):
+        """Append one chunk; `data` is copied immediately."""
+        if tick is None:
+            tick = time.ticks_ms()
+        if self.path is None:
+            self._open()
+        n = REC_HDR_SIZE + len(data)
+        if self.size + self._len + n > self.max_bytes or n > len(self._ram):
+            self.dropped += 1
+            return
+        if self._len + n > len(self._ram):
+            self.flush()
+        if not self._len:
+            self._t0 = tick
+        i = self._len
+        pack_into(REC_HDR, self._ram, i, src, len(data), tick)
+        i += REC_HDR_SIZE
+        self._mv[i:i + len(data)] = data
+        self._len = i + len(data)
+        self.records += 1
+        if time.ticks_diff(tick, self._t0) >= self.flush_ms:
+            self.flush()
+
+    def flush(self):
+        if not self._len:
+            return
+        try:
+            with open(self.path, "ab") as f:
+                f.write(self._mv[:self._len])
+            self.size += self._len
+        except OSError as e:
+            print("[CAPTURE] write error:", e)
+            self.dropped += 1
+        self._len = 0
+
+    def stats(self):
+        return (self.records, self.dropped, self.size + self._len)
+
+    def _open(self):
+        try:
+            os.mkdir(self.root)
+        except OSError:
+            pass
+        seq = -1
+        for name in os.listdir(self.root):
+            if name.startswith("cap") and name.endswith(".bin"):
+                try:
+                    seq = max(seq, int(name[3:-4]))
+                except ValueError:
+                    pass
+        path = "%s/cap%04d.bin" % (self.root, seq + 1)
+        hdr = bytearray(FILE_HDR_SIZE)
+        pack_into(FILE_HDR, hdr, 0, MAGIC, VERSION, int(time.time()),
+                  time.ticks_ms())
+        with open(path, "wb") as f:
+            f.write(hdr)
+        self.path = path
+        self.size = FILE_HDR_SIZE
+        print("[CAPTURE] Logging raw input to", self.path)
+
+capture = Capture()
@@ -25,8 +25,158 @@ UART_BAUD_RATE = 115200
 TX_PIN = 4          # Pico TX -> GNSS RX
 RX_PIN = 5          # Pico RX -> GNSS TX
 UART_BAUD_RATE = 115200
+UART_RX_BUF = 2048  # driver RX buffer; absorbs 10-20 Hz NMEA between reads
+UART_TX_BUF = 1024  # lets RTCM bursts be written without blocking
+NMEA_BUF_BYTES = 512  # nmea.py framer receive buffer
+NTRIP_GGA_INTERVAL_MS = 5000    # position updates sent to the NTRIP caster
+# RTCM3 frames forwarded to the receiver: None = all CRC-valid frames, or a
+# tuple of message types, e.g. (1005, 1074, 1084, 1094, 1124, 1230)
+RTCM_ALLOW = None
+RTCM_BUF_BYTES = 2048
 
 # --- Movesense ---
 MOVESENSE_SERIES = "174630000192"   # change to your unit if needed
+# Every unit this Pico serves (one shared scan, one connection each). JSON
+# records carry Movesense_series; binary packets are sent per unit.
+MOVESENSE_SERIES_LIST = (MOVESENSE_SERIES,)
+BLE_MAX_CONNECTIONS = 3     # concurrent Movesense connections
+BLE_ADDR_CACHE = "ble_addr.json"    # last known addresses, reused after boot
+BLE_DIRECT_CONNECT_MS = 3000        # reconnect by address first...
+BLE_FAST_SCAN_MS = 2000             # ...then a short scan, then a full one
+# Subscription rate levels (IMU Hz, ECG Hz), nominal first; ECG 0 means
+# unsubscribed. Under sustained uplink pressure ratectl.py steps down one
+# level at a time, and back up once the link has been healthy for a while.
+RATE_LEVELS = ((26, 125), (13, 125), (13, 0))
+RATE_CTL_ENABLED = True
+RATE_CHECK_MS = 1000
+RATE_DOWN_MS = 3000         # pressure this long -> one level down
+RATE_UP_MS = 30000          # healthy this long -> one level up
+RATE_FILL_HIGH = 75         # % of queue capacity
+RATE_FILL_LOW = 25
+RATE_LATENCY_HIGH_MS = 2000 # batch age when handed to the client
+RATE_LATENCY_LOW_MS = 800
+# On-device IMU features (features.py): one summary per FEATURES_WINDOW_MS
+# on sensors/feat. IMU_RAW: "always" keeps the raw IMU stream, "events" sends
+# it only for FEATURES_EVENT_MS after an acc spike, "off" never.
+FEATURES_ENABLED = False
+FEATURES_WINDOW_MS = 2000
+IMU_RAW = "always"
+FEATURES_EVENT_ACC = 8.0    # m/s^2 of |acc| above its baseline
+FEATURES_EVENT_MS = 3000
+STEP_THRESHOLD = 1.5        # m/s^2 of |acc| above its baseline
+STEP_MIN_MS = 250
+# Rolling HRV from the HR stream's RR intervals (hrv.py): one record per
+# HRV_PUBLISH_MS on sensors/hrv over the last HRV_WINDOW intervals. HR_RAW:
+# "always" keeps the HR/RR records, "off" sends HRV only.
+HRV_ENABLED = False
+HRV_WINDOW = 120            # RR intervals
+HRV_PUBLISH_MS = 10000
+HR_RAW = "always"
+HRV_RR_MIN_MS = 300
+HRV_RR_MAX_MS = 2000
+HRV_ARTIFACT_PCT = 20       # max deviation from the running RR average
+HRV_NOISY_PCT = 5           # artifacts above this set FLAG_NOISY
 
 # (No LEDs / buttons in the minimal build)
+
+# --- MQTT publishing ---
+# Batching drains several records per queue into one JSON array payload per
+# topic. A batch is flushed once it holds MQTT_BATCH_MAX_RECORDS records,
+# reaches MQTT_BATCH_MAX_BYTES, or its oldest record is MQTT_BATCH_MAX_AGE_MS old.
+MQTT_BATCH = True
+MQTT_BATCH_MAX_RECORDS = 10
+MQTT_BATCH_MAX_BYTES = 4096
+MQTT_BATCH_MAX_AGE_MS = 500
+MQTT_BATCH_MAX_AGE_SLOW_MS = 0      # HR and GNSS: publish as soon as they arrive
+
+# --- Publish scheduler (scheduler.py) ---
+# Per stream (priority, weight, rate B/s, burst B): lower priorities are sent
+# first each cycle, weight caps the payloads per batch and cycle, rate 0 means
+# no per-stream limit. SCHED_BUDGET_BPS caps all streams together (0 = none).
+# JSON on MQTT_CTL_TOPIC changes them at runtime, e.g.
+# {"budget": 20000, "imu": {"rate": 8000}}.
+SCHED_ENABLED = True
+SCHED_BUDGET_BPS = 0
+SCHED_STREAMS = {
+    "hr":   (0, 4, 0, 4096),
+    "gnss": (0, 4, 0, 4096),
+    "hrv":  (0, 4, 0, 4096),
+    "feat": (1, 4, 0, 4096),
+    "ecg":  (2, 4, 0, 8192),
+    "imu":  (3, 4, 0, 8192),
+}
+MQTT_CTL_TOPIC = b"sensors/ctl/sched"   # None: no runtime control
+
+# --- Wire format ---
+# "json"   : one JSON object per record on sensors/<stream>
+# "binary" : wire.py packets (fixed-point frames) on sensors/<stream>/bin
+WIRE_FORMAT = "json"
+# Outgoing MQTT buffer; while the broker is unreachable the oldest packets
+# are dropped once this many bytes are pending.
+MQTT_OUT_BUF_BYTES = 16384
+# qos=1 (at-least-once) for the low-rate streams; qos=1 messages are pipelined
+# with up to MQTT_INFLIGHT_WINDOW (and MQTT_INFLIGHT_BYTES) awaiting PUBACK.
+MQTT_QOS_HR = 1
+MQTT_QOS_GNSS = 1
+MQTT_INFLIGHT_WINDOW = 8
+MQTT_INFLIGHT_BYTES = 8192
+
+# --- Store-and-forward spool (flash) ---
+# While MQTT is disconnected, outgoing payloads are written to rotating
+# segment files and replayed at SPOOL_REPLAY_BPS once the link is back.
+SPOOL_ENABLED = True
+SPOOL_DIR = "spool"
+SPOOL_SEGMENT_BYTES = 64 * 1024
+SPOOL_MAX_SEGMENTS = 8              # oldest segment is deleted beyond this
+SPOOL_BLOCK_BYTES = 4096            # RAM buffer written to flash in one go
+SPOOL_WRITE_BPS = 16384             # flash write budget for partial blocks
+SPOOL_FLUSH_MAX_MS = 10000          # flush a partly filled block after this
+SPOOL_REPLAY_BPS = 8192
+
+# --- BLE notification handling ---
+# Deferred decoding: the BLE task only copies raw notifications (+ receive
+# tick) into a RAW_QUEUE_BYTES arena; a worker task decodes them in batches
+# of up to DECODE_BATCH frames.
+BLE_DEFER_DECODE = False
+RAW_QUEUE_BYTES = 8192
+DECODE_BATCH = 16
+
+# --- Publisher wake-up ---
+# A sensor queue wakes the publisher once it holds QUEUE_WAKE_* records;
+# anything below that is still flushed within PUBLISH_MAX_LATENCY_MS. With
+# nothing pending the publisher sleeps until data arrives or the next
+# heartbeat is due.
+QUEUE_WAKE_IMU = 5
+QUEUE_WAKE_ECG = 5
+QUEUE_WAKE_HR = 1
+QUEUE_WAKE_GNSS = 1
+QUEUE_WAKE_FEAT = 1
+QUEUE_WAKE_HRV = 1
+PUBLISH_MAX_LATENCY_MS = 250
+HEARTBEAT_MS = 5000                 # metrics snapshot (heartbeat) period
+
+# --- Capture (raw input log for replay) ---
+# Appends raw BLE notifications, GSP commands, GNSS UART bytes and NTRIP RTCM
+# chunks with their receive ticks to <CAPTURE_DIR>/cap<n>.bin (a new file per
+# boot). replay.py feeds such a log back through the decoders and publisher.
+CAPTURE_ENABLED = False
+CAPTURE_DIR = "capture"
+CAPTURE_MAX_BYTES = 1024 * 1024     # per file; later input is counted as dropped
+CAPTURE_BLOCK_BYTES = 4096          # RAM buffer written to flash in one go
+CAPTURE_FLUSH_MS = 5000             # flush a partly filled block after this
+
+# --- Event-loop lag monitor ---
+# A task that wakes every LAGMON_PERIOD_MS and records how late it was; a
+# wake-up LAGMON_STALL_MS or more late is blamed on the longest marked
+# section (lagmon.enter/exit) that ran in between, or on "unmarked" code.
+LAGMON_ENABLED = True
+LAGMON_PERIOD_MS = 20
+LAGMON_STALL_MS = 50
+LAGMON_REPORT_MS = 60000            # print the worst offenders this often
+
+# --- Time base (timebase.py) ---
+NTP_HOST = "pool.ntp.org"
+NTP_SYNC_MS = 3600000       # RTC re-sync period once synced
+NTP_RETRY_MS = 30000
+TIMEBASE_ALPHA = 0.02       # weight of each packet in the sensor clock fit
+TIMEBASE_REBASE_MS = 600000 # move the fit's reference point this often
@@ -1,28 +1,219 @@
+import uasyncio as asyncio
+from config import (QUEUE_WAKE_IMU, QUEUE_WAKE_ECG, QUEUE_WAKE_HR,
+                    QUEUE_WAKE_GNSS, QUEUE_WAKE_FEAT, QUEUE_WAKE_HRV,
+                    MOVESENSE_SERIES_LIST)
 
+# Set by the sensor queues once they reach their wake threshold; the
+# publisher awaits it instead of polling on a timer.
+data_event = asyncio.Event()
 
-
-# Lightweight FIFO with bounded size to protect heap
+# Fixed-capacity FIFO ring buffer; slots are preallocated so enqueue/dequeue
+# are O(1) and never grow or shift the heap.
 class SimpleQueue:
-    def __init__(self, max_len=50):
-        self._buf = []
+    def __init__(self, max_len=50, wake_at=1, event=None):
         self._max = max_len
+        self.wake_at = wake_at
+        self.event = event
+        self._buf = [None] * max_len
+        self._head = 0          # next slot to read
+        self._tail = 0          # next slot to write
+        self._len = 0
+        # counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+
     def enqueue(self, x):
-        self._buf.append(x)
-        if len(self._buf) > self._max:
+        if self._len == self._max:
             # drop oldest to prevent RAM growth
-            self._buf.pop(0)
+            self._head = (self._head + 1) % self._max
+            self._len -= 1
+            self.dropped += 1
+        self._buf[self._tail] = x
+        self._tail = (self._tail + 1) % self._max
+        self._len += 1
+        self.enqueued += 1
+        if self._len > self.high_water:
+            self.high_water = self._len
+        if self.event is not None and self._len >= self.wake_at:
+            self.event.set()
+
     def dequeue(self):
-        return self._buf.pop(0) if self._buf else None
+        if not self._len:
+            return None
+        x = self._buf[self._head]
+        self._buf[self._head] = None    # release reference for GC
+        self._head = (self._head + 1) % self._max
+        self._len -= 1
+        return x
+
+    def peek(self, i=0):
+        """Return the i-th oldest item without removing it (None if absent)."""
+        if i < 0 or i >= self._len:
+            return None
+        return self._buf[(self._head + i) % self._max]
+
+    def drain(self, n=None, out=None):
+        """Dequeue up to n items (all if None) into list `out`; returns `out`."""
+        if out is None:
+            out = []
+        if n is None or n > self._len:
+            n = self._len
+        for _ in range(n):
+            out.append(self.dequeue())
+        return out
+
+    def clear(self):
+        while self._len:
+            self.dequeue()
+
+    def reset_stats(self):
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = self._len
+
+    def stats(self):
+        return (self.enqueued, self.dropped, self.high_water)
+
+    def is_empty(self):
+        return not self._len
+
+    def is_full(self):
+        return self._len == self._max
+
+    @property
+    def capacity(self):
+        return self._max
+
+    def __len__(self):
+        return self._len
+
+# FIFO of raw byte frames (e.g. BLE notifications) copied into one
+# preallocated arena, bounded by bytes rather than entries. Each entry is
+# <len:u16><tick:u32><data>; entries never straddle the end of the arena (a
+# zero length, or less than a header of space left, sends the reader back to
+# offset 0). When full, the oldest frames are dropped.
+class RawFrameQueue:
+    _HDR = 6
+
+    def __init__(self, max_bytes=8192):
+        self._size = max_bytes
+        self._buf = bytearray(max_bytes)
+        self._mv = memoryview(self._buf)
+        self._head = 0
+        self._tail = 0
+        self._len = 0
+        self._bytes = 0
+        # counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0     # bytes
+        self.event = asyncio.Event()    # set on every put
+
+    def put(self, data, tick):
+        """Copy one frame in; returns False if it can never fit."""
+        n = len(data)
+        need = self._HDR + n
+        if not n or need > self._size or n > 0xFFFF:
+            self.dropped += 1
+            return False
+        while True:
+            if not self._len:
+                self._head = self._tail = 0
+            h, t = self._head, self._tail
+            if self._len and t <= h:
+                # writer has wrapped behind the reader: one gap [t, h)
+                if h - t >= need:
+                    break
+            else:
+                if self._size - t >= need:
+                    break
+                if h >= need:
+                    if self._size - t >= 2:
+                        self._buf[t] = 0
+                        self._buf[t + 1] = 0
+                    self._tail = 0
+                    continue
+            self._pop()
+            self.dropped += 1
+        t = self._tail
+        b = self._buf
+        b[t] = n & 0xFF
+        b[t + 1] = n >> 8
+        b[t + 2] = tick & 0xFF
+        b[t + 3] = (tick >> 8) & 0xFF
+        b[t + 4] = (tick >> 16) & 0xFF
+        b[t + 5] = (tick >> 24) & 0xFF
+        b[t + 6:t + need] = data
+        self._tail = t + need
+        self._len += 1
+        self._bytes += n
+        self.enqueued += 1
+        if self._bytes > self.high_water:
+            self.high_water = self._bytes
+        self.event.set()
+        return True
+
+    def get(self):
+        """Oldest frame as (memoryview, tick), or None.
+
+        The view points into the arena: consume it before the next put().
+        """
+        if not self._len:
+            return None
+        return self._pop()
+
+    def _pop(self):
+        h = self._head
+        b = self._buf
+        if self._size - h < self._HDR or not (b[h] | b[h + 1]):
+            h = 0
+        n = b[h] | b[h + 1] << 8
+        tick = b[h + 2] | b[h + 3] << 8 | b[h + 4] << 16 | b[h + 5] << 24
+        self._head = h + self._HDR + n
+        self._len -= 1
+        self._bytes -= n
+        return self._mv[h + self._HDR:h + self._HDR + n], tick
+
+    def clear(self):
+        self._head = self._tail = self._len = self._bytes = 0
+
     def is_empty(self):
-        return not self._buf
+        return not self._len
+
+    def nbytes(self):
+        return self._bytes
+
     def __len__(self):
-        return len(self._buf)
+        return self._len
 
 # Smaller queues = lower memory pressure
-imu_queue  = SimpleQueue(20)
-ecg_queue  = SimpleQueue(20)
-hr_queue   = SimpleQueue(10)
-gnss_queue = SimpleQueue(10)
+imu_queue  = SimpleQueue(20, QUEUE_WAKE_IMU,  data_event)
+ecg_queue  = SimpleQueue(20, QUEUE_WAKE_ECG,  data_event)
+hr_queue   = SimpleQueue(10, QUEUE_WAKE_HR,   data_event)
+gnss_queue = SimpleQueue(10, QUEUE_WAKE_GNSS, data_event)
+feat_queue = SimpleQueue(10, QUEUE_WAKE_FEAT, data_event)
+hrv_queue  = SimpleQueue(5,  QUEUE_WAKE_HRV,  data_event)
+
+# (series, imu, ecg, hr, feat, hrv) per Movesense unit in
+# MOVESENSE_SERIES_LIST order, so one unit's burst cannot evict another's
+# records. The first unit uses the queues above.
+ms_queues = [(MOVESENSE_SERIES_LIST[0], imu_queue, ecg_queue, hr_queue,
+              feat_queue, hrv_queue)]
+for _s in MOVESENSE_SERIES_LIST[1:]:
+    ms_queues.append((_s, SimpleQueue(20, QUEUE_WAKE_IMU, data_event),
+                      SimpleQueue(20, QUEUE_WAKE_ECG, data_event),
+                      SimpleQueue(10, QUEUE_WAKE_HR, data_event),
+                      SimpleQueue(10, QUEUE_WAKE_FEAT, data_event),
+                      SimpleQueue(5,  QUEUE_WAKE_HRV,  data_event)))
+
+def queues_for(series):
+    """(imu, ecg, hr, feat, hrv) queues of a unit; unknown serials share the
+    first."""
+    for q in ms_queues:
+        if q[0] == series:
+            return q[1:]
+    return ms_queues[0][1:]
 
 class State:
     def __init__(self):
@@ -31,6 +222,9 @@ class State:
         self.trigger_connecting_network = False
         self.movesense_detect = False
         self.trigger_ble_scan = True
+        # worst batch age (ms) at hand-off to the MQTT client since ratectl.py
+        # last looked
+        self.publish_latency_ms = 0
 
 state = State()
 
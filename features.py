@@ -0,0 +1,198 @@
+# features.py -- windowed IMU summaries computed on the Pico.
+#
+# ImuFeatures is fed every decoded IMU packet and keeps running sums over a
+# tumbling window of FEATURES_WINDOW_MS worth of samples (the sample count
+# follows the measured rate, so it adapts when ratectl.py changes level).
+# Each sample costs a fixed handful of float operations; nothing is buffered.
+# When a window closes, one summary record goes to the unit's feature queue:
+#
+#   AccRms    RMS per axis of the acceleration (m/s^2)
+#   AccMag    mean, std, min, max of |acc| (m/s^2)
+#   GyroRms   RMS per axis of the angular rate (deg/s)
+#   Jerk      RMS and max of |d acc / dt| (m/s^3)
+#   Steps     steps detected in the window; Cadence in steps/min
+#   Events    acc spikes (FEATURES_EVENT_ACC over the baseline)
+#
+# Steps are peaks of |acc| above a slow baseline by STEP_THRESHOLD, at least
+# STEP_MIN_MS apart; the detector re-arms once |acc| falls back below the
+# baseline. Cadence follows the smoothed step interval and reads 0 after two
+# seconds without a step.
+#
+# With IMU_RAW = "events", add() tells the caller to send the raw packet only
+# while an event is recent (FEATURES_EVENT_MS).
+from math import sqrt
+import wire
+from config import (FEATURES_WINDOW_MS, FEATURES_EVENT_ACC, FEATURES_EVENT_MS,
+                    STEP_THRESHOLD, STEP_MIN_MS, IMU_RAW, WIRE_FORMAT)
+
+_BINARY = WIRE_FORMAT == "binary"
+
+_BASE_K = 1 / 32            # baseline smoothing per sample
+_CADENCE_HOLD_US = 2000000
+
+def _r(v):
+    return int(v * 1000 + 0.5) / 1000
+
+class ImuFeatures:
+    def __init__(self, series, pico_id, queue, window_ms=FEATURES_WINDOW_MS):
+        self.series = series
+        self.pico_id = pico_id
+        self.queue = queue
+        self.window_ms = window_ms
+        self.windows = 0
+        self.base = None        # slow |acc| baseline (gravity)
+        self.prev = None        # previous acc sample, for jerk
+        self.t_us = 0           # sample clock within the stream
+        self.armed = True
+        self.last_step = None
+        self.step_us = 0        # smoothed step interval
+        self.raw_until = None
+        self._start(0, 0)
+
+    def _start(self, utc_ms, period_us):
+        self.utc_ms = utc_ms
+        self.period_us = period_us
+        self.size = (self.window_ms * 1000 // period_us) if period_us else 0
+        self.n = 0
+        self.ax = self.ay = self.az = 0.0        # sums of squares
+        self.gx = self.gy = self.gz = 0.0
+        self.m1 = self.m2 = 0.0                  # |acc| sum, sum of squares
+        self.mmin = self.mmax = 0.0
+        self.j2 = self.jmax = 0.0
+        self.steps = 0
+        self.events = 0
+
+    def add(self, vals, n, st):
+        """Fold in one packet: n samples in Movesense order, st is its
+        timebase stamp (utc_ms, period_us, missing). Returns True if the raw
+        packet should be sent as well."""
+        utc_ms, period_us, missing = st
+        if not period_us:
+            return IMU_RAW != "off"
+        if missing:
+            # no jerk across a gap
+            self.prev = None
+            self.t_us += missing * period_us
+        if not self.n:
+            self._start(utc_ms, period_us)
+        dt = period_us / 1000000
+        g = n * 3
+        event = False
+        for i in range(n):
+            k = i * 3
+            x = vals[k]
+            y = vals[k + 1]
+            z = vals[k + 2]
+            self.ax += x * x
+            self.ay += y * y
+            self.az += z * z
+            m = sqrt(x * x + y * y + z * z)
+            self.m1 += m
+            self.m2 += m * m
+            if not self.n or m < self.mmin:
+                self.mmin = m
+            if not self.n or m > self.mmax:
+                self.mmax = m
+            gx = vals[g + k]
+            gy = vals[g + k + 1]
+            gz = vals[g + k + 2]
+            self.gx += gx * gx
+            self.gy += gy * gy
+            self.gz += gz * gz
+            p = self.prev
+            if p is not None:
+                dx = x - p[0]
+                dy = y - p[1]
+                dz = z - p[2]
+                j = sqrt(dx * dx + dy * dy + dz * dz) / dt
+                self.j2 += j * j
+                if j > self.jmax:
+                    self.jmax = j
+                p[0] = x
+                p[1] = y
+                p[2] = z
+            else:
+                self.prev = [x, y, z]
+            # steps and events against the slow baseline
+            if self.base is None:
+                self.base = m
+            d = m - self.base
+            self.base += d * _BASE_K
+            if d > STEP_THRESHOLD:
+                if self.armed and (self.last_step is None or
+                                   self.t_us - self.last_step
+                                   >= STEP_MIN_MS * 1000):
+                    iv = (self.t_us - self.last_step
+                          if self.last_step is not None else 0)
+                    if 0 < iv < _CADENCE_HOLD_US:
+                        if self.step_us:
+                            self.step_us += (iv - self.step_us) // 4
+                        else:
+                            self.step_us = iv
+                    self.last_step = self.t_us
+                    self.steps += 1
+                    self.armed = False
+            elif d < 0:
+                self.armed = True
+            if d > FEATURES_EVENT_ACC or d < -FEATURES_EVENT_ACC:
+                self.events += 1
+                event = True
+            self.t_us += period_us
+            self.n += 1
+            if self.n >= self.size:
+                self._emit()
+                self._start(utc_ms + (i + 1) * period_us // 1000, period_us)
+        if IMU_RAW == "always":
+            return True
+        if IMU_RAW == "off":
+            return False
+        if event:
+            self.raw_until = self.t_us + FEATURES_EVENT_MS * 1000
+        return self.raw_until is not None and self.t_us <= self.raw_until
+
+    def cadence(self):
+        """Steps per minute from the smoothed interval, 0 when idle."""
+        if (not self.step_us or self.last_step is None
+                or self.t_us - self.last_step > _CADENCE_HOLD_US):
+            return 0.0
+        return 60000000 / self.step_us
+
+    def summary(self):
+        """Features of the current window as a flat tuple: AccRms x3,
+        AccMag x4, GyroRms x3, Jerk x2, Steps, Cadence, Events."""
+        n = self.n
+        mean = self.m1 / n
+        var = self.m2 / n - mean * mean
+        nj = n - 1 if n > 1 else 1
+        return (sqrt(self.ax / n), sqrt(self.ay / n), sqrt(self.az / n),
+                mean, sqrt(var) if var > 0 else 0.0, self.mmin, self.mmax,
+                sqrt(self.gx / n), sqrt(self.gy / n), sqrt(self.gz / n),
+                sqrt(self.j2 / nj), self.jmax,
+                self.steps, self.cadence(), self.events)
+
+    def record(self):
+        """Summary of the current window as a dict (JSON stream)."""
+        v = self.summary()
+        return {
+            "Pico_ID": self.pico_id,
+            "Movesense_series": self.series,
+            "Timestamp_UTC": self.utc_ms // 1000,
+            "Timestamp_UTC_ms": self.utc_ms,
+            "Window_ms": self.n * self.period_us // 1000,
+            "Samples": self.n,
+            "AccRms": [_r(v[0]), _r(v[1]), _r(v[2])],
+            "AccMag": [_r(v[3]), _r(v[4]), _r(v[5]), _r(v[6])],
+            "GyroRms": [_r(v[7]), _r(v[8]), _r(v[9])],
+            "Jerk": [_r(v[10]), _r(v[11])],
+            "Steps": v[12],
+            "Cadence": _r(v[13]),
+            "Events": v[14],
+        }
+
+    def _emit(self):
+        self.windows += 1
+        if _BINARY:
+            self.queue.enqueue(wire.encode_features(
+                self.summary(), self.n, (self.utc_ms, self.period_us, 0)))
+        else:
+            self.queue.enqueue(self.record())
@@ -0,0 +1,45 @@
+# Patches CPython's time/gc/sys with the MicroPython extras the firmware
+# calls (ticks_*, sleep_ms/us, gc.mem_free, sys.print_exception). Must run
+# before any firmware module is imported; run.py does this first thing.
+import gc
+import sys
+import time
+import traceback
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+_t0 = time.monotonic_ns()
+
+
+def ticks_ms():
+    return ((time.monotonic_ns() - _t0) // 1000000) & _TICKS_MAX
+
+
+def ticks_us():
+    return ((time.monotonic_ns() - _t0) // 1000) & _TICKS_MAX
+
+
+def ticks_add(t, delta):
+    return (t + delta) & _TICKS_MAX
+
+
+def ticks_diff(a, b):
+    d = (a - b) & _TICKS_MAX
+    return d - _TICKS_PERIOD if d >= _TICKS_HALF else d
+
+
+def install(heap_bytes=192 * 1024):
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_cpu = ticks_us
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    # no real heap to report; a fixed figure keeps gc-based logic sane
+    gc.mem_free = lambda: heap_bytes
+    gc.mem_alloc = lambda: 0
+    gc.threshold = lambda *a: -1
+    sys.print_exception = lambda e, f=sys.stdout: traceback.print_exception(
+        type(e), e, e.__traceback__, file=f)
@@ -0,0 +1,235 @@
+# aioble client-side stand-in backed by simulated peripherals.
+#
+# Peripherals register in `devices` (run.py adds a movesense_sim.FakeMovesense
+# per entry in config.MOVESENSE_SERIES_LIST). As in aioble, the central side
+# is a Device(addr_type, addr): scan results carry one, and one built from a
+# stored address connects directly to the peripheral with that address. Like aioble, a subscribed characteristic keeps
+# only `notify_queue_len` unread notifications (default 1); older ones are
+# overwritten and counted in `lost`, which is what happens on the Pico when
+# the notify loop falls behind.
+import asyncio
+from collections import deque
+
+devices = []
+notify_queue_len = 1
+
+
+class GattError(Exception):
+    pass
+
+
+class DeviceDisconnectedError(Exception):
+    pass
+
+
+class ScanResult:
+    def __init__(self, peer):
+        self.device = Device(peer.addr_type, peer.addr)
+        self.rssi = peer.rssi
+        self.connectable = True
+        self._peer = peer
+
+    def name(self):
+        return self._peer.name
+
+    def services(self):
+        return iter(self._peer.services)
+
+    def manufacturer(self, filter=None):
+        return iter(())
+
+
+class _Scanner:
+    def __init__(self, duration_ms):
+        self._duration_ms = duration_ms
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self._results()
+
+    async def _results(self):
+        loop = asyncio.get_running_loop()
+        end = loop.time() + self._duration_ms / 1000 if self._duration_ms else None
+        for peer in list(devices):
+            if not peer.advertising:
+                continue
+            await asyncio.sleep(peer.adv_interval_ms / 1000)
+            if end is not None and loop.time() > end:
+                return
+            yield ScanResult(peer)
+        if end is not None:
+            await asyncio.sleep(max(0, end - loop.time()))
+
+
+def scan(duration_ms, interval_us=None, window_us=None, active=False):
+    return _Scanner(duration_ms)
+
+
+class Device:
+    """Central-side handle for a peripheral address."""
+    ADDR_PUBLIC = 0
+    ADDR_RANDOM = 1
+
+    def __init__(self, addr_type, addr):
+        self.addr_type = addr_type
+        self.addr = addr.lower()
+
+    def __repr__(self):
+        return "Device(%s, %s)" % (
+            "ADDR_PUBLIC" if self.addr_type == Device.ADDR_PUBLIC
+            else "ADDR_RANDOM", self.addr)
+
+    def addr_hex(self):
+        return self.addr
+
+    async def connect(self, timeout_ms=10000):
+        # like a direct connect: waits for the peripheral to advertise
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout_ms / 1000
+        while True:
+            for peer in devices:
+                if peer.addr == self.addr and peer.advertising:
+                    await asyncio.sleep(peer.connect_ms / 1000)
+                    peer.connection = DeviceConnection(self, peer)
+                    peer.on_connect(peer.connection)
+                    return peer.connection
+            if loop.time() >= end:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(0.02)
+
+
+class Peripheral:
+    """A simulated peripheral; subclasses implement on_write()."""
+
+    def __init__(self, name, addr, services=(), rssi=-60):
+        self.name = name
+        self.addr = addr.lower()
+        self.addr_type = Device.ADDR_PUBLIC
+        self.services = list(services)
+        self.rssi = rssi
+        self.adv_interval_ms = 100
+        self.connect_ms = 50
+        self.connection = None
+        self.off = False            # powered down / out of range
+
+    @property
+    def advertising(self):
+        # a peripheral stops advertising while connected
+        return self.connection is None and not self.off
+
+    # ---- peripheral behaviour ----
+
+    def on_connect(self, conn):
+        pass
+
+    def on_disconnect(self, conn):
+        pass
+
+    def on_write(self, uuid, data):
+        pass
+
+    def notify(self, uuid, data):
+        """Deliver a notification to the connected central (if subscribed)."""
+        conn = self.connection
+        if conn is not None and conn.is_connected():
+            ch = conn._chars.get(uuid)
+            if ch is not None and ch._subscribed:
+                ch._push(bytes(data))
+
+    def drop(self):
+        """Simulate the link going away (out of range, power off)."""
+        if self.connection:
+            self.connection._lost()
+
+
+class DeviceConnection:
+    def __init__(self, device, peer):
+        self.device = device
+        self._peer = peer
+        self._connected = True
+        self._chars = {}
+
+    def is_connected(self):
+        return self._connected
+
+    async def service(self, uuid, timeout_ms=2000):
+        self._check()
+        return ClientService(self, uuid) if uuid in self._peer.services else None
+
+    async def disconnect(self, timeout_ms=2000):
+        if self._connected:
+            self._lost()
+
+    def _lost(self):
+        self._connected = False
+        for ch in self._chars.values():
+            ch._wake()
+        if self._peer.connection is self:
+            self._peer.connection = None
+        self._peer.on_disconnect(self)
+
+    def _check(self):
+        if not self._connected:
+            raise DeviceDisconnectedError
+
+
+class ClientService:
+    def __init__(self, connection, uuid):
+        self.connection = connection
+        self.uuid = uuid
+
+    async def characteristic(self, uuid, timeout_ms=2000):
+        self.connection._check()
+        ch = self.connection._chars.get(uuid)
+        if ch is None:
+            ch = self.connection._chars[uuid] = ClientCharacteristic(self, uuid)
+        return ch
+
+
+class ClientCharacteristic:
+    def __init__(self, service, uuid):
+        self.service = service
+        self.uuid = uuid
+        self._conn = service.connection
+        self._subscribed = False
+        self._q = deque((), notify_queue_len)
+        self._ev = asyncio.Event()
+        self.received = 0
+        self.lost = 0
+
+    async def write(self, data, response=False, timeout_ms=1000):
+        self._conn._check()
+        self._conn._peer.on_write(self.uuid, bytes(data))
+
+    async def read(self, timeout_ms=1000):
+        self._conn._check()
+        return b""
+
+    async def subscribe(self, notify=True, indicate=False):
+        self._conn._check()
+        self._subscribed = bool(notify or indicate)
+
+    async def notified(self, timeout_ms=None):
+        while not self._q:
+            self._conn._check()
+            self._ev.clear()
+            if timeout_ms is None:
+                await self._ev.wait()
+            else:
+                await asyncio.wait_for(self._ev.wait(), timeout_ms / 1000)
+        return self._q.popleft()
+
+    def _push(self, data):
+        if len(self._q) == self._q.maxlen:
+            self.lost += 1
+        self._q.append(data)
+        self.received += 1
+        self._ev.set()
+
+    def _wake(self):
+        self._ev.set()
@@ -0,0 +1,312 @@
+# Micro-benchmarks for the per-packet hot paths, on CPython or the
+# MicroPython unix port:
+#
+#   python host/bench.py [--json out.json] [--compare base.json] [--filter imu]
+#   micropython host/bench.py --json out.json
+#
+# Fixtures are fixed synthetic GSP notifications (IMU6/IMU9 at every
+# Movesense rate, ECG 125-500 Hz, HR with 0-4 RR intervals) and NMEA epochs,
+# so numbers are comparable between commits. For each case the report gives
+# ops/s, us/op, bytes allocated per op and the size of the produced payload.
+# Allocation is exact on MicroPython (gc.mem_alloc delta with the GC off);
+# on CPython it is tracemalloc's peak above baseline, a lower bound.
+import os
+import sys
+
+_MPY = sys.implementation.name == "micropython"
+HOST_DIR = __file__.rpartition("/")[0] or "."
+if not HOST_DIR.startswith("/"):
+    HOST_DIR = os.getcwd() + "/" + HOST_DIR
+ROOT = HOST_DIR.rpartition("/")[0]
+if _MPY:
+    # native modules win; stand-ins only fill gaps (bluetooth, aioble, ...)
+    sys.path = [p for p in sys.path if p != HOST_DIR]
+    sys.path.append(HOST_DIR)
+else:
+    if HOST_DIR not in sys.path:
+        sys.path.insert(0, HOST_DIR)
+    import _hostenv
+    _hostenv.install()
+if ROOT not in sys.path:
+    sys.path.insert(1, ROOT)
+
+import gc
+import json
+import struct
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+IMU_RATES = (13, 26, 52, 104, 208, 416, 833, 1666)
+ECG_RATES = (125, 250, 500)
+ECG_PER_PACKET = 16
+TARGET_US = 100000          # per timed run
+REPEAT = 3                  # timed runs per case; the fastest is reported
+
+
+def _imu_packet(imu9, rate, ref=99):
+    # samples per notification as movesense_sim packs them, capped at 8 so a
+    # packet stays within one BLE notification
+    n = min(8, max(1, rate // 13))
+    blocks = 3 if imu9 else 2
+    vals = [0.01 * ((i * 37) % 200 - 100) for i in range(n * 3 * blocks)]
+    return bytes((2, ref)) + struct.pack("<I%df" % len(vals), 123456, *vals)
+
+
+def _ecg_packet(ref=97):
+    vals = [((i * 97) % 3000) - 1500 for i in range(ECG_PER_PACKET)]
+    return bytes((2, ref)) + struct.pack("<I%di" % ECG_PER_PACKET, 123456, *vals)
+
+
+def _hr_packet(rr_count, ref=98):
+    rr = [820 + 10 * i for i in range(rr_count)]
+    return bytes((2, ref)) + struct.pack("<f%dH" % rr_count, 72.5, *rr)
+
+
+def _ck(body):
+    c = 0
+    for b in body:
+        c ^= b
+    return b"$" + body + b"*" + (b"%02X" % c) + b"\r\n"
+
+
+GGA = _ck(b"GNGGA,123519.00,6503.5580,N,02527.9780,E,4,14,0.7,12.3,M,18.1,M,1.0,0000")
+RMC = _ck(b"GNRMC,123519.00,A,6503.5580,N,02527.9780,E,6.480,45.0,181026,,,D")
+VTG = _ck(b"GNVTG,45.0,T,,M,6.480,N,12.000,K,D")
+
+
+def _last_size(q):
+    # size of the newest queued record as it would be published
+    rec = q.peek(len(q) - 1)
+    if isinstance(rec, (bytes, bytearray)):
+        return len(rec)
+    return len(json.dumps(rec, separators=(",", ":")))
+
+
+class _NullSock:
+    def write(self, buf, n=None):
+        return len(buf) if n is None else n
+
+
+def _measure(fn):
+    fn()                                    # warm-up (templates, buffers)
+    n = 1
+    while True:
+        t0 = time.ticks_us()
+        for _ in range(n):
+            fn()
+        dt = time.ticks_diff(time.ticks_us(), t0)
+        if dt >= TARGET_US // 4 or n >= 1 << 20:
+            break
+        n *= 4
+    n = max(1, n * TARGET_US // max(dt, 1))
+    best = None
+    for _ in range(REPEAT):
+        gc.collect()
+        t0 = time.ticks_us()
+        for _ in range(n):
+            fn()
+        dt = max(time.ticks_diff(time.ticks_us(), t0), 1)
+        if best is None or dt < best:
+            best = dt
+    return n, best
+
+
+def _alloc(fn):
+    gc.collect()
+    if _MPY:
+        gc.disable()
+        a0 = gc.mem_alloc()
+        fn()
+        a = gc.mem_alloc() - a0
+        gc.enable()
+        return a
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - base
+
+
+def _cases(only=None):
+    """(name, fn, payload_bytes) for every case whose modules import."""
+    out = []
+
+    def add(name, fn, size=None):
+        if only is None or only in name:
+            out.append((name, fn, size))
+
+    import movesense_device as md
+    from data_queue import imu_queue, ecg_queue, hr_queue
+
+    def dev(sensor="IMU9"):
+        d = md.MovesenseDevice("174630000192", "e66141040323452a")
+        d.imu_sensor = sensor
+        return d
+
+    for fmt in ("json", "binary"):
+        binary = fmt == "binary"
+        for imu9 in (False, True):
+            sensor = "IMU9" if imu9 else "IMU6"
+            for rate in IMU_RATES:
+                d = dev(sensor)
+                pkt = _imu_packet(imu9, rate)
+
+                def f(d=d, pkt=pkt, binary=binary):
+                    md._BINARY = binary
+                    d._process_imu_data(pkt)
+                add("%s/%s/%d" % (fmt, sensor.lower(), rate), f,
+                    lambda f=f: (f(), _last_size(imu_queue))[1])
+        for rate in ECG_RATES:
+            d = dev()
+            pkt = _ecg_packet()
+
+            def f(d=d, pkt=pkt, binary=binary):
+                md._BINARY = binary
+                d._process_ecg_data(pkt)
+            add("%s/ecg/%d" % (fmt, rate), f,
+                lambda f=f: (f(), _last_size(ecg_queue))[1])
+        for rr in range(5):
+            d = dev()
+            pkt = _hr_packet(rr)
+
+            def f(d=d, pkt=pkt, binary=binary):
+                md._BINARY = binary
+                d._process_hr_data(pkt)
+            add("%s/hr/rr%d" % (fmt, rr), f,
+                lambda f=f: (f(), _last_size(hr_queue))[1])
+    md._BINARY = False
+
+    from nmea import NmeaFramer
+    fr = NmeaFramer()
+    epoch = GGA + RMC + VTG
+
+    def feed(data):
+        space = fr.space()
+        space[:len(data)] = data
+        fr.commit(len(data))
+        while fr.next():
+            pass
+
+    def parse_gga():
+        feed(GGA)
+        fr.gga()
+    add("nmea/gga", parse_gga, len(GGA))
+    add("nmea/epoch", lambda: feed(epoch), len(epoch))
+
+    from rtcm import crc24q
+    frame = bytes(range(256)) * 2
+    add("rtcm/crc24q/512", lambda: crc24q(frame, 0, len(frame)), len(frame))
+
+    try:
+        import mqtt
+    except Exception as e:      # e.g. no machine.unique_id on the unix port
+        print("# skipping mqtt cases:", repr(e))
+    else:
+        hr = {"Pico_ID": "e66141040323452a", "Movesense_series": "174630000192",
+              "Timestamp_UTC": 1760000000, "Timestamp_ms": 123456,
+              "Average_BPM": 72.5, "rrData": [820, 830]}
+        gnss = {"Pico_ID": "e66141040323452a", "Timestamp_UTC": 1760000000,
+                "Latitude": 65.05930123, "Longitude": 25.46630456, "FixQ": 4}
+        add("json/hr_dict", lambda: mqtt._json_bytes(hr), len(mqtt._json_bytes(hr)))
+        add("json/gnss_dict", lambda: mqtt._json_bytes(gnss),
+            len(mqtt._json_bytes(gnss)))
+
+    from umqtt import simple
+    cli = simple.MQTTClient(b"bench", "localhost")
+    cli.sock = _NullSock()
+    topic = b"sensors/imu"
+    for size in (64, 1024, 4096):
+        msg = bytes(size)
+        add("mqtt/publish/qos0/%d" % size,
+            lambda msg=msg: cli.publish(topic, msg),
+            simple.publish_size(topic, msg))
+    buf = bytearray(8192)
+    msg = bytes(1024)
+    add("mqtt/encode_publish/1024",
+        lambda: simple.encode_publish(buf, 0, topic, msg, False, 1, 7),
+        simple.publish_size(topic, msg, 1))
+    return out
+
+
+def run(only=None):
+    results = []
+    for name, fn, size in _cases(only):
+        n, dt = _measure(fn)
+        if callable(size):
+            size = size()
+        r = {"name": name, "ops_s": round(n * 1000000 / dt, 1),
+             "us_op": round(dt / n, 3), "alloc_bytes": _alloc(fn),
+             "out_bytes": size}
+        results.append(r)
+        print("%-28s %10.1f ops/s %9.2f us %8s B alloc %6s B out" % (
+            name, r["ops_s"], r["us_op"], r["alloc_bytes"], size))
+    return {"impl": sys.implementation.name,
+            "version": ".".join(str(v) for v in sys.implementation.version[:3]),
+            "commit": _commit(), "results": results}
+
+
+def _commit():
+    try:
+        with open(ROOT + "/.git/HEAD") as f:
+            head = f.read().strip()
+        if head.startswith("ref: "):
+            with open(ROOT + "/.git/" + head[5:]) as f:
+                head = f.read().strip()
+        return head[:12]
+    except OSError:
+        return None
+
+
+def compare(base, cur):
+    old = {r["name"]: r for r in base["results"]}
+    print("\n%-28s %10s %10s %8s" % ("case", "base us", "us", "change"))
+    for r in cur["results"]:
+        o = old.get(r["name"])
+        if o:
+            ch = (r["us_op"] - o["us_op"]) * 100 / o["us_op"]
+            print("%-28s %10.2f %10.2f %+7.1f%%" % (r["name"], o["us_op"],
+                                                    r["us_op"], ch))
+
+
+def main(argv):
+    opts = {}
+    i = 0
+    while i < len(argv):
+        if argv[i] in ("--json", "--compare", "--filter") and i + 1 < len(argv):
+            opts[argv[i][2:]] = argv[i + 1]
+            i += 2
+        else:
+            print("usage: bench.py [--json OUT] [--compare BASE] [--filter STR]")
+            return
+    json_out = opts.get("json")
+    base = None
+    if "compare" in opts:
+        with open(opts["compare"]) as f:
+            base = json.load(f)
+    # the spool creates its directory on import; keep it out of the tree
+    tmp = "/tmp/5gsport-bench"
+    try:
+        os.mkdir(tmp)
+    except OSError:
+        pass
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    try:
+        res = run(opts.get("filter"))
+    finally:
+        os.chdir(cwd)
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(res, f)
+    if base:
+        compare(base, res)
+
+
+main(sys.argv[1:])
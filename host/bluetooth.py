@@ -0,0 +1,13 @@
+# Only what the firmware touches: UUIDs as comparable keys.
+class UUID:
+    def __init__(self, value):
+        self.value = value.lower() if isinstance(value, str) else value
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return "UUID(%r)" % (self.value,)
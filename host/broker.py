@@ -0,0 +1,197 @@
+# Minimal MQTT 3.1.1 broker to run the firmware against on a dev box.
+#
+# Accepts any CONNECT, acks qos=1 PUBLISH (optionally after `puback_delay_ms`
+# to mimic a WAN round trip), routes publishes to matching subscribers
+# (+ and # wildcards), and answers PINGREQ. Per-topic message/byte counts are
+# kept in `topics`; `on_publish(topic, payload, qos)` sees every message.
+#
+#   python host/broker.py [--port 1883]
+import asyncio
+import struct
+
+
+def _topic_match(flt, topic):
+    f = flt.split("/")
+    t = topic.split("/")
+    for i, p in enumerate(f):
+        if p == "#":
+            return True
+        if i >= len(t) or (p != "+" and p != t[i]):
+            return False
+    return len(f) == len(t)
+
+
+class _Client:
+    def __init__(self, r, w):
+        self.r = r
+        self.w = w
+        self.id = None
+        self.subs = {}
+
+    async def packet(self):
+        hdr = await self.r.readexactly(1)
+        n = 0
+        shift = 0
+        while True:
+            b = (await self.r.readexactly(1))[0]
+            n |= (b & 0x7F) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+        return hdr[0], await self.r.readexactly(n)
+
+    def send(self, pkt):
+        self.w.write(pkt)
+
+
+def _remaining_len(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+class Broker:
+    def __init__(self, host="127.0.0.1", port=1883, puback_delay_ms=0,
+                 on_publish=None):
+        self.host = host
+        self.port = port
+        self.puback_delay_ms = puback_delay_ms
+        self.on_publish = on_publish
+        self._server = None
+        self._clients = set()
+        self.topics = {}            # topic -> [messages, payload bytes]
+        self.connects = 0
+        self.messages = 0
+        self.bytes = 0
+        self.dups = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def close(self):
+        if self._server:
+            self._server.close()
+        self.kick()
+
+    async def aclose(self):
+        """close() and give the client handlers a moment to wind down."""
+        self.close()
+        await asyncio.sleep(0.05)
+
+    def kick(self):
+        """Drop every client connection (simulates a broker restart)."""
+        for c in list(self._clients):
+            c.w.close()
+
+    def stats(self):
+        return {"connects": self.connects, "messages": self.messages,
+                "bytes": self.bytes, "dups": self.dups,
+                "topics": {t: {"messages": v[0], "bytes": v[1]}
+                           for t, v in sorted(self.topics.items())}}
+
+    async def _serve(self, r, w):
+        c = _Client(r, w)
+        self._clients.add(c)
+        try:
+            while True:
+                hdr, body = await c.packet()
+                op = hdr & 0xF0
+                if op == 0x10:
+                    self._connect(c, body)
+                elif op == 0x30:
+                    await self._publish(c, hdr, body)
+                elif op == 0x80:
+                    self._subscribe(c, body)
+                elif op == 0xA0:
+                    c.send(b"\xb0\x02" + body[:2])
+                elif op == 0xC0:
+                    c.send(b"\xd0\x00")
+                elif op == 0xE0:
+                    break
+                await w.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(c)
+            w.close()
+
+    def _connect(self, c, body):
+        # protocol name, level, flags, keepalive, then the client id
+        i = 2 + struct.unpack_from("!H", body)[0] + 4
+        ln = struct.unpack_from("!H", body, i)[0]
+        c.id = body[i + 2:i + 2 + ln].decode(errors="replace")
+        self.connects += 1
+        c.send(b"\x20\x02\x00\x00")
+
+    async def _publish(self, c, hdr, body):
+        qos = (hdr >> 1) & 3
+        ln = struct.unpack_from("!H", body)[0]
+        topic = body[2:2 + ln].decode(errors="replace")
+        i = 2 + ln
+        pid = None
+        if qos:
+            pid = body[i:i + 2]
+            i += 2
+        payload = body[i:]
+        if hdr & 0x08:
+            self.dups += 1
+        self.messages += 1
+        self.bytes += len(payload)
+        st = self.topics.setdefault(topic, [0, 0])
+        st[0] += 1
+        st[1] += len(payload)
+        if self.on_publish:
+            self.on_publish(topic, payload, qos)
+        for other in list(self._clients):
+            if any(_topic_match(f, topic) for f in other.subs):
+                t = topic.encode()
+                vh = struct.pack("!H", len(t)) + t
+                other.send(bytes((0x30,)) + _remaining_len(len(vh) + len(payload))
+                           + vh + payload)
+        if qos:
+            if self.puback_delay_ms:
+                asyncio.get_running_loop().call_later(
+                    self.puback_delay_ms / 1000, self._puback, c, pid)
+            else:
+                self._puback(c, pid)
+
+    def _puback(self, c, pid):
+        if c in self._clients:
+            c.send(b"\x40\x02" + pid)
+
+    def _subscribe(self, c, body):
+        pid = body[:2]
+        i = 2
+        granted = bytearray()
+        while i < len(body):
+            ln = struct.unpack_from("!H", body, i)[0]
+            flt = body[i + 2:i + 2 + ln].decode(errors="replace")
+            qos = min(body[i + 2 + ln], 1)
+            c.subs[flt] = qos
+            granted.append(qos)
+            i += 3 + ln
+        c.send(b"\x90" + _remaining_len(2 + len(granted)) + pid + granted)
+
+
+async def _main(port):
+    b = await Broker("0.0.0.0", port).start()
+    print("[BROKER] listening on port %d" % b.port)
+    try:
+        while True:
+            await asyncio.sleep(5)
+            print("[BROKER]", b.stats())
+    finally:
+        b.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Local MQTT stand-in broker")
+    ap.add_argument("--port", type=int, default=1883)
+    asyncio.run(_main(ap.parse_args().port))
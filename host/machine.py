@@ -0,0 +1,205 @@
+# machine stand-ins: unique_id, Pin/PWM no-ops, and a UART whose RX side is
+# fed from a byte source (see sources.py) at the configured baud rate.
+import asyncio
+import hashlib
+import os
+import socket
+
+_UID = hashlib.sha1(socket.gethostname().encode()).digest()[:8]
+
+# UART id -> callable(uart) returning an async iterator of byte chunks;
+# run.py installs these before the firmware opens the UART
+sources = {}
+uarts = {}
+
+
+def unique_id():
+    return _UID
+
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+def soft_reset():
+    reset()
+
+
+def freq(hz=None):
+    return 133000000
+
+
+def idle():
+    pass
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._v = value or 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._v
+        self._v = 1 if v else 0
+
+    def on(self):
+        self._v = 1
+
+    def off(self):
+        self._v = 0
+
+    def toggle(self):
+        self._v ^= 1
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+
+class PWM:
+    def __init__(self, pin, freq=0, duty_u16=0):
+        self._freq = freq
+        self._duty = duty_u16
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        pass
+
+
+class RTC:
+    # the host clock is already NTP-disciplined by the OS; setting is a no-op
+    def datetime(self, dt=None):
+        if dt is None:
+            import time
+            t = time.gmtime()
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+
+
+class UART:
+    """Non-blocking UART like the RP2 driver: RX bytes land in a bounded
+    buffer (`rxbuf`, overflow discards new bytes and counts `overruns`);
+    TX bytes are counted and handed to `tx_sink` if one is set."""
+
+    def __init__(self, id, baudrate=9600, bits=8, parity=None, stop=1,
+                 tx=None, rx=None, rxbuf=256, txbuf=256, timeout=0, **kw):
+        self.id = id
+        self.baudrate = baudrate
+        self._rx = bytearray()
+        self._rxbuf = rxbuf
+        self._ev = asyncio.Event()
+        self._feeder = None
+        self.overruns = 0
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.tx_sink = None
+        uarts[id] = self
+
+    def init(self, baudrate=None, **kw):
+        if baudrate:
+            self.baudrate = baudrate
+
+    def deinit(self):
+        if self._feeder:
+            self._feeder.cancel()
+            self._feeder = None
+
+    # ---- host side ----
+
+    def feed(self, data):
+        room = self._rxbuf - len(self._rx)
+        if len(data) > room:
+            self.overruns += len(data) - room
+            data = data[:room]
+        self._rx += data
+        self.rx_bytes += len(data)
+        if self._rx:
+            self._ev.set()
+
+    async def _pump(self, src):
+        async for chunk in src(self):
+            self.feed(chunk)
+
+    def start(self):
+        src = sources.get(self.id)
+        if src and self._feeder is None:
+            self._feeder = asyncio.get_running_loop().create_task(self._pump(src))
+
+    async def _readable(self):
+        self.start()
+        while not self._rx:
+            self._ev.clear()
+            await self._ev.wait()
+
+    # ---- firmware side ----
+
+    def any(self):
+        if _loop_running():
+            self.start()
+        return len(self._rx)
+
+    def read(self, n=-1):
+        if not self._rx:
+            return None
+        if n is None or n < 0:
+            n = len(self._rx)
+        d = bytes(self._rx[:n])
+        del self._rx[:n]
+        return d
+
+    def readinto(self, buf, nbytes=None):
+        if not self._rx:
+            return None
+        n = min(len(buf) if nbytes is None else nbytes, len(self._rx))
+        buf[:n] = self._rx[:n]
+        del self._rx[:n]
+        return n
+
+    def readline(self):
+        if not self._rx:
+            return None
+        i = self._rx.find(b"\n")
+        return self.read(len(self._rx) if i < 0 else i + 1)
+
+    def write(self, buf):
+        n = len(buf)
+        self.tx_bytes += n
+        if self.tx_sink:
+            self.tx_sink(bytes(buf))
+        return n
+
+    def flush(self):
+        pass
+
+    def txdone(self):
+        return True
+
+
+def _loop_running():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _env_uid():
+    # MACHINE_UID=<16 hex digits> pins the id, e.g. to match a real board
+    v = os.environ.get("MACHINE_UID")
+    return bytes.fromhex(v) if v else None
+
+
+_UID = _env_uid() or _UID
@@ -0,0 +1,136 @@
+# Simulated Movesense sensor speaking the GSP protocol movesense_device.py
+# uses: commands [cmd, ref, path...] on the write characteristic, data
+# notifications [2, ref, ...] on the notify characteristic.
+#
+#   IMU6/IMU9  [2, ref, ts u32, n*acc xyz, n*gyro xyz, (n*magn xyz)] float32
+#   ECG        [2, ref, ts u32, n*int32]
+#   HR         [2, ref, avg bpm float32, rr u16 ms...]
+#
+# Samples per notification follow the sensor's usual packing (IMU: rate/13,
+# ECG: 16); override with imu_per_packet / ecg_per_packet.
+import asyncio
+import math
+import struct
+import time
+
+import aioble
+import bluetooth
+
+GSP_SERVICE = bluetooth.UUID("34802252-7185-4d5d-b431-630e7050e8f0")
+GSP_WRITE = bluetooth.UUID("34800001-7185-4d5d-b431-630e7050e8f0")
+GSP_NOTIFY = bluetooth.UUID("34800002-7185-4d5d-b431-630e7050e8f0")
+
+_CMD_HELLO = 0
+_CMD_SUBSCRIBE = 1
+_CMD_UNSUBSCRIBE = 2
+_DATA = 2
+
+
+class FakeMovesense(aioble.Peripheral):
+    def __init__(self, series, addr="0c:8c:dc:00:00:01", imu_per_packet=None,
+                 ecg_per_packet=16, bpm=72.0):
+        super().__init__("Movesense %s" % series, addr, (GSP_SERVICE,))
+        self.series = series
+        self.imu_per_packet = imu_per_packet
+        self.ecg_per_packet = ecg_per_packet
+        self.bpm = bpm
+        self._streams = {}          # ref -> task
+        self._t0 = time.monotonic()
+        self.sent = 0
+        self.sent_bytes = 0
+
+    # ---- aioble.Peripheral hooks ----
+
+    def on_write(self, uuid, data):
+        if uuid != GSP_WRITE or len(data) < 2:
+            return
+        cmd, ref = data[0], data[1]
+        if cmd == _CMD_SUBSCRIBE:
+            self._stop(ref)
+            gen = self._stream_for(data[2:].decode())
+            if gen is not None:
+                self._streams[ref] = asyncio.get_running_loop().create_task(
+                    self._run(ref, gen))
+        elif cmd == _CMD_UNSUBSCRIBE:
+            self._stop(ref)
+
+    def on_disconnect(self, conn):
+        for ref in list(self._streams):
+            self._stop(ref)
+
+    # ---- streams ----
+
+    def _stop(self, ref):
+        t = self._streams.pop(ref, None)
+        if t:
+            t.cancel()
+
+    def _ts(self):
+        return int((time.monotonic() - self._t0) * 1000) & 0xFFFFFFFF
+
+    def _stream_for(self, path):
+        parts = path.split("/")
+        if len(parts) == 3 and parts[1] in ("IMU6", "IMU9"):
+            return self._imu(parts[1] == "IMU9", int(parts[2]))
+        if len(parts) == 3 and parts[1] == "ECG":
+            return self._ecg(int(parts[2]))
+        if path == "Meas/HR":
+            return self._hr()
+        return None
+
+    async def _run(self, ref, gen):
+        head = bytes((_DATA, ref))
+        async for body in gen:
+            pkt = head + body
+            self.sent += 1
+            self.sent_bytes += len(pkt)
+            self.notify(GSP_NOTIFY, pkt)
+
+    async def _paced(self, period_s):
+        # absolute schedule so packet timing doesn't drift under load
+        loop = asyncio.get_running_loop()
+        t = loop.time()
+        while True:
+            t += period_s
+            await asyncio.sleep(max(0, t - loop.time()))
+            yield
+
+    async def _imu(self, imu9, rate):
+        n = self.imu_per_packet or max(1, rate // 13)
+        blocks = 3 if imu9 else 2
+        fmt = "<I%df" % (n * 3 * blocks)
+        k = 0
+        async for _ in self._paced(n / rate):
+            vals = []
+            for b in range(blocks):
+                for j in range(n):
+                    ph = 2 * math.pi * (k + j) / rate
+                    if b == 0:      # acc, m/s^2: gravity plus a 1 Hz sway
+                        vals += (0.3 * math.sin(ph), 0.2 * math.cos(ph), 9.81)
+                    elif b == 1:    # gyro, deg/s
+                        vals += (10 * math.sin(ph), 5 * math.cos(ph), 1.0)
+                    else:           # magn, uT
+                        vals += (20.0, -5.0, 40.0)
+            k += n
+            yield struct.pack(fmt, self._ts(), *vals)
+
+    async def _ecg(self, rate):
+        n = self.ecg_per_packet
+        fmt = "<I%di" % n
+        beat = 60.0 / self.bpm
+        k = 0
+        async for _ in self._paced(n / rate):
+            samples = []
+            for j in range(n):
+                t = ((k + j) / rate) % beat
+                # narrow QRS spike on a small baseline wander
+                v = 1500 * math.exp(-((t - 0.2) / 0.012) ** 2)
+                v += 80 * math.sin(2 * math.pi * (k + j) / rate * 0.3)
+                samples.append(int(v))
+            k += n
+            yield struct.pack(fmt, self._ts(), *samples)
+
+    async def _hr(self):
+        rr = int(60000 / self.bpm)
+        async for _ in self._paced(rr / 1000):
+            yield struct.pack("<fH", self.bpm, rr)
@@ -0,0 +1,67 @@
+# network.WLAN stand-in. The link comes up `join_ms` after connect(); tests
+# and run.py can drop/restore it with set_link() to exercise reconnects.
+import time
+
+STA_IF = 0
+AP_IF = 1
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+
+join_ms = 200
+_link_ok = True
+_ifaces = {}
+
+
+def set_link(up):
+    """Simulate the AP going away (False) or coming back (True)."""
+    global _link_ok
+    _link_ok = up
+    for w in _ifaces.values():
+        if not up:
+            w._joined_at = None
+
+
+class WLAN:
+    def __new__(cls, interface_id=STA_IF):
+        w = _ifaces.get(interface_id)
+        if w is None:
+            w = _ifaces[interface_id] = super().__new__(cls)
+            w._active = False
+            w._joined_at = None
+            w._ssid = None
+        return w
+
+    def __init__(self, interface_id=STA_IF):
+        pass
+
+    def active(self, v=None):
+        if v is None:
+            return self._active
+        self._active = bool(v)
+
+    def connect(self, ssid=None, key=None, **kw):
+        self._ssid = ssid
+        self._joined_at = time.monotonic() + join_ms / 1000
+
+    def disconnect(self):
+        self._joined_at = None
+
+    def isconnected(self):
+        return (self._active and _link_ok and self._joined_at is not None
+                and time.monotonic() >= self._joined_at)
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -55
+        if self.isconnected():
+            return STAT_GOT_IP
+        return STAT_CONNECTING if self._joined_at else STAT_IDLE
+
+    def ifconfig(self, cfg=None):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def config(self, *a, **kw):
+        if a == ("mac",):
+            return b"\x28\xcd\xc1\x00\x00\x01"
+        return None
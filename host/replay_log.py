@@ -0,0 +1,73 @@
+# Replay a capture.py log through the firmware's decoders and publisher on
+# the host, against the local broker.
+#
+#   python host/replay_log.py cap0000.bin            # recorded timing
+#   python host/replay_log.py cap0000.bin --speed 0  # as fast as possible
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import run  # sets up sys.path and the MicroPython stand-ins  # noqa: F401
+from broker import Broker
+
+
+async def _replay(args):
+    import password
+    broker = await Broker(port=0).start()
+    cfg = password.MQTT_CONFIG
+    cfg.update(server="127.0.0.1", port=broker.port, ssl=False, ssl_params={},
+               username=b"replay", password=b"")
+    import bynav_GNSS
+    import machine
+    import mqtt
+    from config import MOVESENSE_SERIES
+    from data_queue import imu_queue, ecg_queue, hr_queue, gnss_queue
+    from replay import Replayer
+
+    cli = await mqtt.connect_mqtt()
+    pub = asyncio.create_task(mqtt.publish_to_mqtt(cli))
+    r = Replayer(args.log, MOVESENSE_SERIES,
+                 machine.unique_id().hex(), args.speed)
+    t0 = time.perf_counter()
+    n = await r.run()
+    queues = (imu_queue, ecg_queue, hr_queue, gnss_queue)
+    # let the publisher drain what the replay produced
+    while any(len(q) for q in queues) or cli.pending_bytes() or cli.inflight():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(mqtt.MQTT_BATCH_MAX_AGE_MS / 1000 + 0.05)
+    wall = time.perf_counter() - t0
+    pub.cancel()
+    await cli.disconnect()
+    await broker.aclose()
+    replay_s = r.elapsed_ms / 1000
+    return {"records": n, "bytes": r.nbytes, "replay_s": replay_s,
+            "records_per_s": round(n / replay_s, 1) if replay_s else None,
+            "wall_s": round(wall, 3),
+            "by_source": {str(k): v for k, v in r.counts.items()},
+            "rtcm": r.rtcm.stats(), "nmea": bynav_GNSS.framer.stats(),
+            "broker": broker.stats()}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a capture log")
+    ap.add_argument("log")
+    ap.add_argument("--speed", type=float, default=1.0,
+                    help="1 = recorded timing, 0 = as fast as possible")
+    ap.add_argument("--json", help="write the stats here")
+    args = ap.parse_args()
+    args.log = os.path.abspath(args.log)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    os.chdir(tempfile.mkdtemp(prefix="5gsport-replay-"))
+    stats = asyncio.run(_replay(args))
+    print(json.dumps(stats, indent=1))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(stats, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
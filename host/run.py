@@ -0,0 +1,179 @@
+# Run the unmodified firmware (main.py) under CPython.
+#
+# This directory shadows the MicroPython modules (machine, network, aioble,
+# uasyncio, ...) with host stand-ins: the GNSS UART is fed synthetic NMEA (or
+# a capture file), a simulated Movesense streams GSP notifications, Wi-Fi
+# joins immediately, and MQTT goes to an in-process broker (broker.py).
+#
+#   python host/run.py --duration 30
+#   python host/run.py --uart-file gnss_capture.bin --json stats.json
+#
+# --sensors N simulates N Movesense units (serials MOVESENSE_SERIES + i);
+# --ble-drop S cuts their links every S seconds to exercise reconnects.
+# NTRIP stays disabled unless --ntrip is given (it then uses password.py).
+# --capture records a capture.py log that host/replay_log.py can play back.
+# The spool and other files the firmware writes go to --workdir (a temporary
+# directory by default), never into the source tree.
+import argparse
+import asyncio
+import json
+import os
+import runpy
+import sys
+import tempfile
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HOST_DIR)
+if HOST_DIR not in sys.path:
+    sys.path.insert(0, HOST_DIR)
+if ROOT not in sys.path:
+    sys.path.insert(1, ROOT)
+
+import _hostenv  # noqa: E402
+_hostenv.install()
+
+import aioble  # noqa: E402
+import machine  # noqa: E402
+import sources  # noqa: E402
+from broker import Broker  # noqa: E402
+from movesense_sim import FakeMovesense  # noqa: E402
+
+
+def _args(argv=None):
+    ap = argparse.ArgumentParser(description="Run main.py on the host")
+    ap.add_argument("--duration", type=float, default=0,
+                    help="stop after this many seconds (default: run forever)")
+    ap.add_argument("--broker-port", type=int, default=0,
+                    help="port for the local broker (default: any free port)")
+    ap.add_argument("--puback-delay-ms", type=int, default=0)
+    ap.add_argument("--nmea-rate", type=float, default=10,
+                    help="synthetic GNSS epochs per second")
+    ap.add_argument("--uart-file", help="replay this capture on the GNSS UART")
+    ap.add_argument("--no-movesense", action="store_true")
+    ap.add_argument("--sensors", type=int, default=1,
+                    help="number of simulated Movesense units")
+    ap.add_argument("--ble-drop", type=float, default=0,
+                    help="drop every Movesense link this often (seconds)")
+    ap.add_argument("--ntrip", action="store_true",
+                    help="connect to the NTRIP caster in password.py")
+    ap.add_argument("--capture", action="store_true",
+                    help="enable capture.py (log lands in <workdir>/capture)")
+    ap.add_argument("--features", choices=("always", "events", "off"),
+                    help="enable features.py; the value is IMU_RAW")
+    ap.add_argument("--hrv", action="store_true", help="enable hrv.py")
+    ap.add_argument("--budget", type=int, default=0,
+                    help="scheduler byte budget per second (0: unlimited)")
+    ap.add_argument("--workdir", help="working directory (spool etc.)")
+    ap.add_argument("--json", help="write the end-of-run stats here")
+    return ap.parse_args(argv)
+
+
+def setup(args, loop):
+    """Install stand-ins and start the broker; returns the shared objects."""
+    import config
+    import password
+
+    # before main.py imports the modules that read it
+    config.CAPTURE_ENABLED = args.capture
+    config.HRV_ENABLED = args.hrv
+    config.SCHED_BUDGET_BPS = args.budget
+    config.FEATURES_ENABLED = bool(args.features)
+    if args.features:
+        config.IMU_RAW = args.features
+    base = int(config.MOVESENSE_SERIES)
+    config.MOVESENSE_SERIES_LIST = tuple(str(base + i)
+                                         for i in range(max(1, args.sensors)))
+
+    broker = loop.run_until_complete(
+        Broker(port=args.broker_port,
+               puback_delay_ms=args.puback_delay_ms).start())
+    cfg = password.MQTT_CONFIG
+    cfg.update(server="127.0.0.1", port=broker.port, ssl=False, ssl_params={})
+    # MicroPython strs expose the buffer protocol and umqtt copies them into
+    # packets as-is; CPython needs bytes
+    for k in ("username", "password"):
+        if isinstance(cfg.get(k), str):
+            cfg[k] = cfg[k].encode()
+    password.NTRIP_CONFIG["enabled"] = bool(args.ntrip)
+
+    if args.uart_file:
+        machine.sources[1] = sources.file_source(os.path.abspath(args.uart_file))
+    else:
+        machine.sources[1] = sources.nmea_source(args.nmea_rate)
+
+    sensors = []
+    if not args.no_movesense:
+        for i, series in enumerate(config.MOVESENSE_SERIES_LIST):
+            sensors.append(FakeMovesense(series,
+                                         addr="0c:8c:dc:00:00:%02x" % (i + 1)))
+        aioble.devices.extend(sensors)
+    if args.ble_drop:
+        def drop():
+            for sensor in sensors:
+                sensor.drop()
+            loop.call_later(args.ble_drop, drop)
+        loop.call_later(args.ble_drop, drop)
+    return broker, sensors
+
+
+def report(broker, sensors):
+    from data_queue import ms_queues, gnss_queue
+    out = {"broker": broker.stats()}
+    if sensors:
+        out["movesense"] = {}
+        for sensor in sensors:
+            st = {"sent": sensor.sent, "bytes": sensor.sent_bytes}
+            conn = sensor.connection
+            if conn:
+                st["ble_lost"] = sum(c.lost for c in conn._chars.values())
+            out["movesense"][sensor.series] = st
+    uart = machine.uarts.get(1)
+    if uart:
+        out["uart"] = {"rx_bytes": uart.rx_bytes, "tx_bytes": uart.tx_bytes,
+                       "overruns": uart.overruns}
+    import config
+    if config.CAPTURE_ENABLED:
+        from capture import capture
+        capture.flush()
+        out["capture"] = {"path": os.path.abspath(capture.path or ""),
+                          "stats": capture.stats()}
+    from lagmon import lag
+    out["lag"] = {"hist": lag.hist, "stalls": lag.stalls,
+                  "worst": lag.worst(5)}
+    out["queues"] = {"gnss": gnss_queue.stats()}
+    for series, imu, ecg, hr, feat, hrv in ms_queues:
+        out["queues"][series] = {"imu": imu.stats(), "ecg": ecg.stats(),
+                                 "hr": hr.stats(), "feat": feat.stats(),
+                                 "hrv": hrv.stats()}
+    return out
+
+
+def main(argv=None):
+    args = _args(argv)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    broker, sensors = setup(args, loop)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="5gsport-"))
+    if args.duration:
+        loop.call_later(args.duration, loop.stop)
+    try:
+        # main.py ends in loop.run_forever(), which returns on loop.stop()
+        runpy.run_path(os.path.join(ROOT, "main.py"), run_name="__main__")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = report(broker, sensors)
+        broker.close()
+        print(json.dumps(stats, indent=1))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(stats, f, indent=1)
+    return stats
+
+
+if __name__ == "__main__":
+    main()
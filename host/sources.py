@@ -0,0 +1,73 @@
+# Byte sources for machine.UART: each is a callable(uart) returning an async
+# iterator of chunks, paced at the UART's baud rate (10 bits per byte).
+import asyncio
+import time
+
+
+def _ck(body):
+    c = 0
+    for b in body:
+        c ^= b
+    return b"$%s*%02X\r\n" % (body, c)
+
+
+def _ddmm(v, deg_digits):
+    v = abs(v)
+    d = int(v)
+    return b"%0*d%07.4f" % (deg_digits, d, (v - d) * 60)
+
+
+def nmea_epoch(lat, lon, fixq=4, speed_kmh=0.0, course=0.0, t=None):
+    """One epoch of GNGGA + GNRMC + GNVTG sentences."""
+    t = time.gmtime(t)
+    hms = b"%02d%02d%02d.00" % (t.tm_hour, t.tm_min, t.tm_sec)
+    lat_s, ns = _ddmm(lat, 2), b"N" if lat >= 0 else b"S"
+    lon_s, ew = _ddmm(lon, 3), b"E" if lon >= 0 else b"W"
+    knots = speed_kmh / 1.852
+    out = _ck(b"GNGGA,%s,%s,%s,%s,%s,%d,14,0.7,12.3,M,18.1,M,1.0,0000"
+              % (hms, lat_s, ns, lon_s, ew, fixq))
+    out += _ck(b"GNRMC,%s,A,%s,%s,%s,%s,%.3f,%.1f,%02d%02d%02d,,,D"
+               % (hms, lat_s, ns, lon_s, ew, knots, course,
+                  t.tm_mday, t.tm_mon, t.tm_year % 100))
+    out += _ck(b"GNVTG,%.1f,T,,M,%.3f,N,%.3f,K,D" % (course, knots, speed_kmh))
+    return out
+
+
+def nmea_source(rate_hz=10, lat=65.0593, lon=25.4663, speed_kmh=12.0):
+    """Receiver output: one epoch every 1/rate_hz s, moving north-east."""
+    async def gen(uart):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        k = 0
+        while True:
+            k += 1
+            await asyncio.sleep(max(0, start + k / rate_hz - loop.time()))
+            d = speed_kmh / 3600 / 111.0 * k / rate_hz
+            epoch = nmea_epoch(lat + d, lon + d, speed_kmh=speed_kmh, course=45.0)
+            async for chunk in _paced(epoch, uart.baudrate):
+                yield chunk
+    return gen
+
+
+def file_source(path, loop_forever=True, chunk=64):
+    """Replay a raw capture of the receiver's output."""
+    async def gen(uart):
+        with open(path, "rb") as f:
+            data = f.read()
+        while True:
+            async for c in _paced(data, uart.baudrate, chunk):
+                yield c
+            if not loop_forever:
+                return
+    return gen
+
+
+async def _paced(data, baud, chunk=64):
+    bps = baud / 10
+    loop = asyncio.get_running_loop()
+    t = loop.time()
+    for i in range(0, len(data), chunk):
+        c = data[i:i + chunk]
+        t += len(c) / bps
+        await asyncio.sleep(max(0, t - loop.time()))
+        yield c
@@ -0,0 +1,147 @@
+# uasyncio on CPython: asyncio plus the MicroPython-only names the firmware
+# uses (sleep_ms, wait_for_ms, Stream/StreamReader over devices, readinto).
+import asyncio as _a
+from asyncio import *   # noqa: F401,F403
+
+TimeoutError = _a.TimeoutError
+CancelledError = _a.CancelledError
+
+
+async def sleep_ms(ms):
+    await _a.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, ms):
+    return await _a.wait_for(aw, ms / 1000)
+
+
+class Stream:
+    """MicroPython-style stream over a host device.
+
+    The device (e.g. machine.UART) provides non-blocking read/readinto/
+    readline/write plus `async _readable()` that returns once data is
+    available, like the poll() MicroPython's Stream waits on.
+    """
+
+    def __init__(self, s, e={}):
+        self.s = s
+        self.e = e
+
+    def get_extra_info(self, v):
+        return self.e.get(v)
+
+    async def read(self, n=-1):
+        await self.s._readable()
+        return self.s.read(n)
+
+    async def readinto(self, buf):
+        await self.s._readable()
+        return self.s.readinto(buf)
+
+    async def readexactly(self, n):
+        r = b""
+        while n:
+            await self.s._readable()
+            d = self.s.read(n)
+            if not d:
+                raise EOFError
+            r += d
+            n -= len(d)
+        return r
+
+    async def readline(self):
+        line = b""
+        while True:
+            await self.s._readable()
+            part = self.s.readline()
+            if not part:
+                return line
+            line += part
+            if line.endswith(b"\n"):
+                return line
+
+    def write(self, buf):
+        self.s.write(buf)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        close = getattr(self.s, "close", None)
+        if close:
+            close()
+
+    async def wait_closed(self):
+        pass
+
+
+StreamReader = Stream
+StreamWriter = Stream
+
+
+class _NetStream:
+    """open_connection() result with the MicroPython Stream API (readinto,
+    write without await, drain) on top of asyncio's reader/writer."""
+
+    def __init__(self, r, w):
+        self._r = r
+        self._w = w
+
+    def get_extra_info(self, v):
+        return self._w.get_extra_info(v)
+
+    async def read(self, n=-1):
+        return await self._r.read(n)
+
+    async def readinto(self, buf):
+        d = await self._r.read(len(buf))
+        buf[:len(d)] = d
+        return len(d)
+
+    async def readexactly(self, n):
+        try:
+            return await self._r.readexactly(n)
+        except _a.IncompleteReadError:
+            raise EOFError
+
+    async def readline(self):
+        return await self._r.readline()
+
+    def write(self, buf):
+        self._w.write(bytes(buf))
+
+    async def drain(self):
+        await self._w.drain()
+
+    def close(self):
+        self._w.close()
+
+    async def wait_closed(self):
+        try:
+            await self._w.wait_closed()
+        except OSError:
+            pass
+
+
+async def open_connection(host, port, ssl=None):
+    if ssl is True:
+        import ssl as _ssl
+        ssl = _ssl.create_default_context()
+    r, w = await _a.open_connection(host, port, ssl=ssl or None)
+    s = _NetStream(r, w)
+    return s, s
+
+
+def get_event_loop():
+    # main.py calls this at module level, before any loop is running
+    try:
+        return _a.get_running_loop()
+    except RuntimeError:
+        pass
+    policy = _a.get_event_loop_policy()
+    try:
+        return policy.get_event_loop()
+    except RuntimeError:
+        loop = _a.new_event_loop()
+        _a.set_event_loop(loop)
+        return loop
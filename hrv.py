@@ -0,0 +1,166 @@
+# hrv.py -- rolling heart-rate variability from the HR stream's RR intervals.
+#
+# Hrv keeps the last HRV_WINDOW accepted RR intervals in a ring and, next to
+# it, running integer sums: RR and RR^2 (for the mean and SDNN), squared
+# successive differences (RMSSD) and differences over 50 ms (pNN50). A new
+# interval adds its terms and the evicted one subtracts its own, so each
+# interval costs O(1) whatever the window length. RR values are stored
+# relative to the first accepted interval, which keeps the sums small ints
+# (exact, no float cancellation on the Pico's float32).
+#
+# An interval is rejected as an artifact if it is outside
+# HRV_RR_MIN_MS..HRV_RR_MAX_MS or differs from the running RR average by more
+# than HRV_ARTIFACT_PCT; the interval after a rejected one starts no
+# successive difference. Every HRV_PUBLISH_MS one record goes to the unit's
+# HRV queue with the window's metrics, the artifacts since the last record
+# and flags: FLAG_WARMUP while the window is not yet full, FLAG_NOISY when
+# more than HRV_NOISY_PCT of the intervals since the last record were
+# rejected.
+import time
+from array import array
+from math import sqrt
+import wire
+from config import (HRV_WINDOW, HRV_PUBLISH_MS, HRV_RR_MIN_MS, HRV_RR_MAX_MS,
+                    HRV_ARTIFACT_PCT, HRV_NOISY_PCT, WIRE_FORMAT)
+
+_BINARY = WIRE_FORMAT == "binary"
+
+FLAG_WARMUP = 0x01
+FLAG_NOISY = 0x02
+
+_NONE = -32768              # no successive difference for this slot
+
+class Hrv:
+    def __init__(self, series, pico_id, queue, window=HRV_WINDOW):
+        self.series = series
+        self.pico_id = pico_id
+        self.queue = queue
+        self.size = window
+        self._rr = array("h", bytes(2 * window))      # RR - ref
+        self._dd = array("h", bytes(2 * window))      # diff to previous
+        self._head = 0
+        self.n = 0
+        self.ref = None
+        self._prev = None       # last accepted RR (ms) if contiguous
+        self._avg = 0           # running RR average (ms) for rejection
+        self.s1 = self.s2 = 0   # sum, sum of squares of RR - ref
+        self.d2 = 0             # sum of squared successive differences
+        self.nd = 0             # successive differences in the window
+        self.n50 = 0            # ... of which over 50 ms
+        self.accepted = 0       # since the last record
+        self.rejected = 0
+        self.records = 0
+        self._last = None       # tick of the last record
+
+    def add(self, rr):
+        """Fold in one RR interval (ms); returns False if rejected."""
+        avg = self._avg
+        if (rr < HRV_RR_MIN_MS or rr > HRV_RR_MAX_MS or
+                (avg and abs(rr - avg) * 100 > avg * HRV_ARTIFACT_PCT)):
+            self.rejected += 1
+            self._prev = None
+            # track a genuine rate change instead of rejecting it forever
+            if avg and HRV_RR_MIN_MS <= rr <= HRV_RR_MAX_MS:
+                self._avg += (rr - avg) >> 3
+            return False
+        self.accepted += 1
+        self._avg = rr if not avg else avg + ((rr - avg) >> 3)
+        if self.ref is None:
+            self.ref = rr
+        i = self._head
+        if self.n == self.size:
+            self._evict(i)
+        else:
+            self.n += 1
+        x = rr - self.ref
+        self._rr[i] = x
+        self.s1 += x
+        self.s2 += x * x
+        if self._prev is not None:
+            d = rr - self._prev
+            self._dd[i] = d
+            self.d2 += d * d
+            self.nd += 1
+            if d > 50 or d < -50:
+                self.n50 += 1
+        else:
+            self._dd[i] = _NONE
+        self._prev = rr
+        self._head = (i + 1) % self.size
+        return True
+
+    def _evict(self, i):
+        x = self._rr[i]
+        self.s1 -= x
+        self.s2 -= x * x
+        d = self._dd[i]
+        if d != _NONE:
+            self.d2 -= d * d
+            self.nd -= 1
+            if d > 50 or d < -50:
+                self.n50 -= 1
+        # the new oldest interval has no predecessor left in the window
+        j = (i + 1) % self.size
+        d = self._dd[j]
+        if d != _NONE:
+            self.d2 -= d * d
+            self.nd -= 1
+            if d > 50 or d < -50:
+                self.n50 -= 1
+            self._dd[j] = _NONE
+
+    def metrics(self):
+        """(mean RR ms, RMSSD ms, SDNN ms, pNN50 %) of the window."""
+        n = self.n
+        if not n:
+            return (0.0, 0.0, 0.0, 0.0)
+        mean = self.s1 / n
+        var = (self.s2 - self.s1 * mean) / (n - 1) if n > 1 else 0.0
+        nd = self.nd
+        return (self.ref + mean,
+                sqrt(self.d2 / nd) if nd else 0.0,
+                sqrt(var) if var > 0 else 0.0,
+                100 * self.n50 / nd if nd else 0.0)
+
+    def flags(self):
+        f = FLAG_WARMUP if self.n < self.size else 0
+        seen = self.accepted + self.rejected
+        if seen and self.rejected * 100 > seen * HRV_NOISY_PCT:
+            f |= FLAG_NOISY
+        return f
+
+    def feed(self, rr_list, utc_ms, tick):
+        """Add one HR notification's intervals; emits a record when due."""
+        for rr in rr_list:
+            self.add(rr)
+        if self._last is None:
+            self._last = tick
+        elif time.ticks_diff(tick, self._last) >= HRV_PUBLISH_MS:
+            self._last = tick
+            if self.n:
+                self._emit(utc_ms)
+
+    def record(self, utc_ms):
+        mean, rmssd, sdnn, pnn50 = self.metrics()
+        return {
+            "Pico_ID": self.pico_id,
+            "Movesense_series": self.series,
+            "Timestamp_UTC": utc_ms // 1000,
+            "Timestamp_UTC_ms": utc_ms,
+            "Beats": self.n,
+            "Mean_RR": round(mean, 1),
+            "RMSSD": round(rmssd, 1),
+            "SDNN": round(sdnn, 1),
+            "pNN50": round(pnn50, 1),
+            "Artifacts": self.rejected,
+            "Flags": self.flags(),
+        }
+
+    def _emit(self, utc_ms):
+        self.records += 1
+        if _BINARY:
+            self.queue.enqueue(wire.encode_hrv(
+                self.metrics(), self.n, self.rejected, self.flags(), utc_ms))
+        else:
+            self.queue.enqueue(self.record(utc_ms))
+        self.accepted = self.rejected = 0
@@ -0,0 +1,119 @@
+# lagmon.py -- event-loop lag monitor with section markers.
+#
+# run() sleeps LAGMON_PERIOD_MS at a time and measures how late each wake-up
+# is: that is the time some task held the loop without yielding. Lags go into
+# a histogram (bucket upper bounds in _BUCKETS_MS, plus an overflow bucket).
+#
+# Code that may block marks itself:
+#
+#     _SEC_FLUSH = lag.section("spool.flush")      # once, at import
+#     tok = lag.enter(_SEC_FLUSH)
+#     spool.flush()                               # no await in between
+#     lag.exit(tok)
+#
+# exit() records the section's duration (count, max, stalls over
+# LAGMON_STALL_MS). Because the monitor can only run between sections, a late
+# wake-up is blamed on the longest section that finished since the previous
+# tick, or on "unmarked" if none did.
+import time
+import uasyncio as asyncio
+from config import LAGMON_PERIOD_MS, LAGMON_STALL_MS, LAGMON_REPORT_MS
+
+_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class LagMonitor:
+    def __init__(self, period_ms=LAGMON_PERIOD_MS, stall_ms=LAGMON_STALL_MS):
+        self.period_ms = period_ms
+        self.stall_us = stall_ms * 1000
+        self.hist = [0] * (len(_BUCKETS_MS) + 1)
+        self.max_lag_ms = 0
+        self.stalls = 0
+        # per section: name, runs, max us, stalls (own), blamed wake-ups,
+        # worst blamed lag ms
+        self.names = ["unmarked"]
+        self.runs = [0]
+        self.max_us = [0]
+        self.own_stalls = [0]
+        self.blamed = [0]
+        self.blamed_ms = [0]
+        self._cur = 0
+        self._t = 0
+        self._tick_sid = 0
+        self._tick_us = 0
+
+    def section(self, name):
+        """Register a section name; returns its id for enter()."""
+        self.names.append(name)
+        for l in (self.runs, self.max_us, self.own_stalls, self.blamed,
+                  self.blamed_ms):
+            l.append(0)
+        return len(self.names) - 1
+
+    def enter(self, sid):
+        tok = (self._cur, self._t)
+        self._cur = sid
+        self._t = time.ticks_us()
+        return tok
+
+    def exit(self, tok):
+        sid = self._cur
+        dt = time.ticks_diff(time.ticks_us(), self._t)
+        self.runs[sid] += 1
+        if dt > self.max_us[sid]:
+            self.max_us[sid] = dt
+        if dt >= self.stall_us:
+            self.own_stalls[sid] += 1
+        if dt > self._tick_us:
+            self._tick_us = dt
+            self._tick_sid = sid
+        self._cur, self._t = tok
+
+    async def run(self):
+        period = self.period_ms
+        last_report = time.ticks_ms()
+        while True:
+            t0 = time.ticks_ms()
+            self._tick_sid = 0
+            self._tick_us = 0
+            await asyncio.sleep_ms(period)
+            now = time.ticks_ms()
+            lag = time.ticks_diff(now, t0) - period
+            self._record(lag)
+            if time.ticks_diff(now, last_report) >= LAGMON_REPORT_MS:
+                last_report = now
+                if self.stalls:
+                    self.report()
+
+    def worst(self, n=3):
+        """Up to n (name, blamed stalls, worst lag ms, max section ms)."""
+        order = sorted(range(len(self.names)),
+                       key=lambda i: (self.blamed[i], self.blamed_ms[i]),
+                       reverse=True)
+        return [(self.names[i], self.blamed[i], self.blamed_ms[i],
+                 self.max_us[i] // 1000) for i in order[:n] if self.blamed[i]]
+
+    def report(self):
+        print("[LAG] max %d ms, %d stalls >= %d ms; worst:" % (
+            self.max_lag_ms, self.stalls, self.stall_us // 1000),
+            ", ".join("%s x%d (%d ms)" % w[:3] for w in self.worst()))
+
+    def stats(self):
+        return (self.max_lag_ms, self.stalls)
+
+    def _record(self, lag):
+        if lag < 0:
+            lag = 0
+        i = 0
+        while i < len(_BUCKETS_MS) and lag > _BUCKETS_MS[i]:
+            i += 1
+        self.hist[i] += 1
+        if lag > self.max_lag_ms:
+            self.max_lag_ms = lag
+        if lag * 1000 >= self.stall_us:
+            self.stalls += 1
+            sid = self._tick_sid
+            self.blamed[sid] += 1
+            if lag > self.blamed_ms[sid]:
+                self.blamed_ms[sid] = lag
+
+lag = LagMonitor()
@@ -4,10 +4,13 @@
 # main.py
 import uasyncio as asyncio
 import machine, sys
-from wifi_connection import connect_wifi
+from wifi_connection import connect_wifi, wifi_watchdog
 from mqtt import connect_mqtt, publish_to_mqtt
 from movesense_controller import movesense_task
 from bynav_GNSS import gnss_setup, gnss_task
+from config import LAGMON_ENABLED
+from lagmon import lag
+import timebase
 
 async def supervise(name, fn, *args):
     while True:
@@ -23,8 +26,7 @@ async def main():
     print("=== PicoW ID:", pico, "===")
 
     if not await connect_wifi():
-        print("[MAIN] No Wi-Fi; stopping.")
-        return
+        print("[MAIN] No Wi-Fi; sensors keep running, data is spooled.")
 
     sock, uart, _ = await gnss_setup()      # returns immediately
 
@@ -32,11 +34,14 @@ async def main():
     if not cli:
         print("[MAIN] MQTT connect failed; running sensors without publish.")
 
-    tasks = []
+    tasks = [asyncio.create_task(supervise("WIFI", wifi_watchdog))]
     if cli:
         tasks.append(asyncio.create_task(supervise("MQTT", publish_to_mqtt, cli)))
     tasks.append(asyncio.create_task(supervise("MOVE", movesense_task, pico)))
     tasks.append(asyncio.create_task(supervise("GNSS", gnss_task, sock, uart, pico)))
+    tasks.append(asyncio.create_task(supervise("TIME", timebase.run)))
+    if LAGMON_ENABLED:
+        tasks.append(asyncio.create_task(supervise("LAG", lag.run)))
 
     print("[MAIN] Started: Movesense + GNSS + MQTT")
     await asyncio.gather(*tasks)
@@ -0,0 +1,135 @@
+# metrics.py -- pipeline counters published as one compact JSON snapshot.
+#
+# Everything here is a fixed set of integers updated in place; the snapshot
+# is rendered from a single template every HEARTBEAT_MS and replaces the bare
+# {"hb":1} heartbeat on sensors/hb (the "hb" key is kept). Per stream
+# (summed over Movesense units) it reports [produced, dropped on queue overflow, queue high-water mark since
+# the last snapshot, records published, payload bytes published]. Interval
+# maxima (BLE gap and outage, loop time, event-loop lag) restart after each snapshot;
+# the rest count from boot. "lag" is [max lag ms, stalls] from lagmon.py,
+# "rate" is [level, IMU Hz, ECG Hz] from ratectl.py, "sched" is [budget B/s,
+# held batches, then achieved B/s since the last snapshot for imu, ecg, hr,
+# gnss, feat, hrv] from scheduler.py, "spool" is [spooled, replayed, dropped,
+# segments on flash, segments lost to the size cap] from spool.py, "ble" is
+# [notifications, longest gap ms, connected units, reconnects, longest
+# disconnect-to-first-sample ms].
+import gc, time
+from lagmon import lag
+
+_TEMPLATE = (
+    '{"hb":1,"seq":%d,"up":%d,"mem":%d,"mem_min":%d,'
+    '"loop":[%d,%d,%d],"lag":[%d,%d],"ble":[%d,%d,%d,%d,%d],"rate":[%d,%d,%d],'
+    '"sched":[%d,%d,%d,%d,%d,%d,%d,%d],'
+    '"mqtt":[%d,%d,%d,%d],"spool":[%d,%d,%d,%d,%d],'
+    '"ntrip":[%d,%d,%d,%d],"nmea":[%d,%d,%d],'
+    '"imu":[%d,%d,%d,%d,%d],"ecg":[%d,%d,%d,%d,%d],'
+    '"hr":[%d,%d,%d,%d,%d],"gnss":[%d,%d,%d,%d,%d],'
+    '"feat":[%d,%d,%d,%d,%d],"hrv":[%d,%d,%d,%d,%d]}')
+
+class Metrics:
+    def __init__(self):
+        self.t0 = time.ticks_ms()
+        self.seq = 0
+        self.mem_min = gc.mem_free()
+        # publisher loop: iterations, total and max work time (us)
+        self.loop_n = 0
+        self.loop_us = 0
+        self.loop_max_us = 0
+        # BLE notifications and the longest gap between two of them (ms)
+        self.ble_notes = 0
+        self.ble_last = None
+        self.ble_gap_max = 0
+        self.ble_links = 0          # connected Movesense units
+        # reconnects, and the longest disconnect -> first sample time (ms)
+        self.ble_reconnects = 0
+        self.ble_outage_max = 0
+        # optional sources, registered by their owners
+        self.ntrip = None
+        self.rtcm = None
+        self.nmea = None
+        self.spool = None
+        self.rate = None
+        self.sched = None
+
+    def ble_notification(self):
+        now = time.ticks_ms()
+        if self.ble_last is not None:
+            gap = time.ticks_diff(now, self.ble_last)
+            if gap > self.ble_gap_max:
+                self.ble_gap_max = gap
+        self.ble_last = now
+        self.ble_notes += 1
+
+    def ble_reconnected(self, outage_ms):
+        self.ble_reconnects += 1
+        if outage_ms > self.ble_outage_max:
+            self.ble_outage_max = outage_ms
+
+    def ble_reset(self):
+        # a reconnect is not a gap
+        self.ble_last = None
+
+    def loop_time(self, us):
+        self.loop_n += 1
+        self.loop_us += us
+        if us > self.loop_max_us:
+            self.loop_max_us = us
+        m = gc.mem_free()
+        if m < self.mem_min:
+            self.mem_min = m
+
+    def snapshot(self, batches, cli=None):
+        """Render the snapshot; `batches` are mqtt._Batch objects carrying
+        queue and published counters, grouped by their `stream` index
+        (imu, ecg, hr, gnss, feat, hrv)."""
+        self.seq += 1
+        n = self.loop_n
+        v = [self.seq, time.ticks_diff(time.ticks_ms(), self.t0) // 1000,
+             gc.mem_free(), self.mem_min,
+             n, self.loop_us // n if n else 0, self.loop_max_us,
+             lag.max_lag_ms, lag.stalls,
+             self.ble_notes, self.ble_gap_max, self.ble_links,
+             self.ble_reconnects, self.ble_outage_max]
+        if self.rate:
+            v += (self.rate.level,) + tuple(self.rate.rates())
+        else:
+            v += (0, 0, 0)
+        if self.sched:
+            v += [self.sched.budget.rate, self.sched.held()]
+            v += self.sched.rates()
+        else:
+            v += (0,) * 8
+        if cli:
+            v += (cli.dropped, cli.reconnects, cli.retransmits, cli.pending_bytes())
+        else:
+            v += (0, 0, 0, 0)
+        v += self.spool.stats() if self.spool else (0, 0, 0, 0, 0)
+        if self.ntrip:
+            age = self.rtcm.age_ms() if self.rtcm else None
+            v += (self.ntrip.rx_bytes,
+                  self.rtcm.frames if self.rtcm else 0,
+                  self.rtcm.bad_crc if self.rtcm else 0,
+                  -1 if age is None else age)
+        else:
+            v += (0, 0, 0, -1)
+        v += self.nmea.stats()[:3] if self.nmea else (0, 0, 0)
+        # per stream, summed over the Movesense units
+        agg = [[0, 0, 0, 0, 0] for _ in range(6)]
+        for b in batches:
+            q = b.queue
+            a = agg[b.stream]
+            a[0] += q.enqueued
+            a[1] += q.dropped
+            if q.high_water > a[2]:
+                a[2] = q.high_water
+            a[3] += b.sent
+            a[4] += b.sent_bytes
+            q.high_water = len(q)
+        for a in agg:
+            v += a
+        self.loop_n = self.loop_us = self.loop_max_us = 0
+        self.ble_gap_max = self.ble_outage_max = 0
+        lag.max_lag_ms = 0
+        return (_TEMPLATE % tuple(v)).encode()
+
+metrics = Metrics()
@@ -1,88 +1,232 @@
-
-
 import uasyncio as asyncio
-import aioble
+import aioble, time, ujson
 from data_queue import state
 from movesense_device import MovesenseDevice
-from config import MOVESENSE_SERIES
+from metrics import metrics
+from ratectl import rate_ctl
+from config import (MOVESENSE_SERIES_LIST, BLE_MAX_CONNECTIONS,
+                    BLE_ADDR_CACHE, BLE_DIRECT_CONNECT_MS, BLE_FAST_SCAN_MS,
+                    RATE_CTL_ENABLED)
 
 SCAN_MS = 8000
 RESCAN_DELAY_MS = 1200
-IMU_RATE = 26
-ECG_RATE = 125
 
-async def _find(ms_series):
-    print(f"[MS] Scanning for Movesense {ms_series} ...")
+# Scans and connection setup share the radio one at a time; established
+# links keep streaming meanwhile.
+_radio = asyncio.Lock()
+_rescan = asyncio.Event()
+
+class _Unit:
+    """One configured Movesense and the device to connect to.
+
+    `device` comes from a scan or from the cached address; `direct` marks
+    the latter, which gets a short connect attempt before falling back to a
+    scan. `down_since` is the tick the last link went down.
+    """
+    def __init__(self, series):
+        self.series = series
+        self.name = "Movesense %s" % series
+        self.device = None
+        self.direct = False
+        self.addr = None            # (addr_type, addr_hex), also on flash
+        self.down_since = None
+        self.found = asyncio.Event()
+
+    def use(self, device, direct):
+        self.device = device
+        self.direct = direct
+        self.found.set()
+
+    def lost(self):
+        # forget the device but keep the address for a filtered scan
+        self.device = None
+        self.found.clear()
+        _rescan.set()
+
+def _load_addrs(units):
+    try:
+        with open(BLE_ADDR_CACHE) as f:
+            cache = ujson.load(f)
+    except (OSError, ValueError):
+        return
+    for u in units:
+        a = cache.get(u.series)
+        if a:
+            u.addr = (a[0], a[1])
+            u.use(aioble.Device(a[0], a[1]), True)
+
+def _save_addrs(units):
+    cache = {u.series: list(u.addr) for u in units if u.addr}
     try:
-        async with aioble.scan(duration_ms=SCAN_MS, interval_us=30000,
+        with open(BLE_ADDR_CACHE, "w") as f:
+            ujson.dump(cache, f)
+    except OSError as e:
+        print("[MS] address cache write error:", e)
+
+class _Slots:
+    """Caps concurrent BLE connections at BLE_MAX_CONNECTIONS."""
+    def __init__(self, n):
+        self.free = n
+        self.used = 0
+        self._ev = asyncio.Event()
+
+    async def acquire(self):
+        while not self.free:
+            self._ev.clear()
+            await self._ev.wait()
+        self.free -= 1
+        self.used += 1
+
+    def release(self):
+        self.free += 1
+        self.used -= 1
+        self._ev.set()
+
+async def _scan(units, duration_ms):
+    # one pass for every unit still missing; known addresses are matched
+    # before names, and the scan stops once all units are found
+    by_addr = {u.addr[1]: u for u in units if u.addr}
+    by_name = {u.name: u for u in units}
+    print("[MS] Scanning %d ms for" % duration_ms, ", ".join(by_name))
+    try:
+        async with aioble.scan(duration_ms=duration_ms, interval_us=30000,
                                window_us=30000, active=True) as scanner:
             async for res in scanner:
-                if (res.name() or "").strip() == f"Movesense {ms_series}":
-                    print("[MS] Found:", res.device)
-                    state.movesense_detect = True
-                    return res.device
+                u = by_addr.get(res.device.addr_hex())
+                if u is None:
+                    u = by_name.get((res.name() or "").strip())
+                if u is None or u.device is not None:
+                    continue
+                print("[MS] Found:", u.series, res.device)
+                u.use(res.device, False)
+                by_name.pop(u.name)
+                state.movesense_detect = True
+                if not by_name:
+                    return
     except Exception as e:
         print("[MS] scan error:", e)
-    print("[MS] Not found")
-    state.movesense_detect = False
-    return None
+    if by_name:
+        print("[MS] Not found:", ", ".join(by_name))
 
-async def movesense_task(pico_id, ms_series=MOVESENSE_SERIES):
-    dev = None
-    ms = None
-    connected = False
+async def _scanner(units):
+    fast = True
     while True:
-        if dev is None:
-            dev = await _find(ms_series)
-            if dev is None:
+        _rescan.clear()
+        missing = [u for u in units if u.device is None]
+        if missing:
+            # a short scan is enough to pick up a unit we have seen before
+            # (it advertises right after a disconnect); if that misses, the
+            # next pass is a full one
+            short = fast and all(u.addr for u in missing)
+            async with _radio:
+                await _scan(missing, BLE_FAST_SCAN_MS if short else SCAN_MS)
+            state.movesense_detect = any(u.device is not None for u in units)
+            if any(u.device is None for u in units):
+                fast = False
                 await asyncio.sleep_ms(RESCAN_DELAY_MS)
                 continue
-        if state.running_state and not connected:
+            fast = True
+        await _rescan.wait()
+
+def _stop_worker(ms, worker):
+    # cancel the deferred-decode worker, decoding whatever is still queued
+    if worker:
+        worker.cancel()
+        while ms.decode_pending():
+            pass
+    return None
+
+async def _session(unit, pico_id, units):
+    """Connect, subscribe and stream one unit until it drops or pauses."""
+    ms = MovesenseDevice(unit.series, pico_id)
+    async with _radio:
+        print(f"[MS] Connecting to {unit.series}%s ..."
+              % (" (cached address)" if unit.direct else ""))
+        await ms.connect_ble(unit.device,
+                             BLE_DIRECT_CONNECT_MS if unit.direct else 10000)
+        try:
+            if not ms.write_char:
+                raise OSError("no GSP link")
+            await ms.subscribe_many(rate_ctl.streams(ms) + [("HR", None)])
+        except Exception:
+            # don't leave a half-set-up link holding a connection slot
             try:
-                print(f"[MS] Connecting to {ms_series} ...")
-                ms = MovesenseDevice(ms_series, pico_id)
-                await ms.connect_ble(dev)
-                await ms.subscribe_sensor("IMU9", IMU_RATE)
-                await ms.subscribe_sensor("HR")
-                await ms.subscribe_sensor("ECG", ECG_RATE)
-                connected = True
-                print("[MS] Connected & subscribed.")
+                await ms.disconnect_ble()
             except Exception as e:
-                print("[MS] connect/sub error:", e)
-                dev = None
-                connected = False
-                await asyncio.sleep_ms(600)
-                continue
-        if connected and not state.running_state:
-            print("[MS] Paused -> disconnecting...")
+                print("[MS] disconnect error:", e)
+            raise
+    addr = (unit.device.addr_type, unit.device.addr_hex())
+    if addr != unit.addr:
+        unit.addr = addr
+        _save_addrs(units)
+    unit.direct = True          # reconnect straight to this address
+    ms.down_since = unit.down_since
+    unit.down_since = None
+    worker = None
+    if ms.raw is not None:
+        worker = asyncio.create_task(ms.decode_worker())
+    rate_ctl.attach(ms)
+    metrics.ble_links += 1
+    print(f"[MS] {unit.series} connected & subscribed.")
+    paused = False
+    try:
+        try:
+            while state.running_state and ms.connection.is_connected():
+                await ms.process_notification()  # should have small timeouts internally
+        except Exception as e:
+            # aioble raises DeviceDisconnectedError when the link drops
+            print(f"[MS] {unit.series} notif error:", repr(e))
+        if ms.connection.is_connected() and not state.running_state:
+            print(f"[MS] Paused -> disconnecting {unit.series}...")
+            paused = True
             try:
                 await ms.disconnect_ble()
             except Exception as e:
                 print("[MS] disconnect error:", e)
-            connected = False
+            return
+        print(f"[MS] {unit.series} link lost; reconnecting.")
+    finally:
+        if not paused:
+            # an outage lasts from the first disconnect to the first sample
+            unit.down_since = (ms.down_since if ms.down_since is not None
+                               else time.ticks_ms())
+        metrics.ble_links -= 1
+        rate_ctl.detach(ms)
+        _stop_worker(ms, worker)
+
+async def _unit_task(unit, pico_id, slots, units):
+    # independent per unit: a reconnect here never holds up the others
+    while True:
+        if unit.device is None:
+            _rescan.set()
+            await unit.found.wait()
+        if not state.running_state:
             await asyncio.sleep_ms(200)
             continue
-        if connected:
-            try:
-                await ms.process_notification()  # should have small timeouts internally
-            except Exception as e:
-                print("[MS] notif error:", e)
-                connected = False
-                dev = None
-                await asyncio.sleep_ms(300)
-        else:
-            await asyncio.sleep_ms(200)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        await slots.acquire()
+        try:
+            await _session(unit, pico_id, units)
+            if not state.running_state:
+                await asyncio.sleep_ms(200)
+        except Exception as e:
+            print(f"[MS] {unit.series} connect/sub error:", e)
+            unit.lost()
+            if not unit.addr:
+                await asyncio.sleep_ms(600)
+        finally:
+            slots.release()
+
+async def movesense_task(pico_id, series_list=MOVESENSE_SERIES_LIST):
+    units = [_Unit(s) for s in series_list]
+    _load_addrs(units)
+    slots = _Slots(BLE_MAX_CONNECTIONS)
+    tasks = [asyncio.create_task(_scanner(units))]
+    tasks += [asyncio.create_task(_unit_task(u, pico_id, slots, units))
+              for u in units]
+    if RATE_CTL_ENABLED:
+        tasks.append(asyncio.create_task(rate_ctl.run()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
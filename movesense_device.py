@@ -4,8 +4,26 @@ import time
 import bluetooth
 import uasyncio as asyncio
 from micropython import const
-from struct import unpack
-from data_queue import ecg_queue, imu_queue, hr_queue, state
+from struct import unpack, unpack_from
+from array import array
+from data_queue import queues_for, state, RawFrameQueue
+from metrics import metrics
+from lagmon import lag
+from timebase import sensor_clock
+from config import (WIRE_FORMAT, BLE_DEFER_DECODE, RAW_QUEUE_BYTES,
+                    DECODE_BATCH, CAPTURE_ENABLED, FEATURES_ENABLED,
+                    HRV_ENABLED, HR_RAW)
+import wire
+if CAPTURE_ENABLED:
+    from capture import capture, SRC_BLE, SRC_CMD
+if FEATURES_ENABLED:
+    from features import ImuFeatures
+if HRV_ENABLED:
+    from hrv import Hrv
+
+_BINARY = WIRE_FORMAT == "binary"
+
+_SEC_DECODE = lag.section("ble.decode")
 
 # --------- Debug control (keep False in production) ----------
 DEBUG = False
@@ -18,6 +36,17 @@ _GSP_SERVICE_UUID = bluetooth.UUID("34802252-7185-4d5d-b431-630e7050e8f0")
 _GSP_WRITE_UUID   = bluetooth.UUID("34800001-7185-4d5d-b431-630e7050e8f0")
 _GSP_NOTIFY_UUID  = bluetooth.UUID("34800002-7185-4d5d-b431-630e7050e8f0")
 
+# Writable byte view aliasing an array's storage, so a notification payload
+# can be copied straight into array('f')/array('i') slots (both sides are
+# little-endian) without unpacking value by value.
+try:
+    import uctypes
+    def _byte_view(arr, nbytes):
+        return uctypes.bytearray_at(uctypes.addressof(arr), nbytes)
+except ImportError:
+    def _byte_view(arr, nbytes):
+        return memoryview(arr).cast("B")
+
 # Command IDs
 _CMD_HELLO       = const(0)
 _CMD_SUBSCRIBE   = const(1)
@@ -32,19 +61,41 @@ class MovesenseDevice:
         self.imu_ref   = imu_ref
         self.hr_ref    = hr_ref
         self.ecg_ref   = ecg_ref
+        (self.imu_q, self.ecg_q, self.hr_q,
+         feat_q, hrv_q) = queues_for(self.ms_series)
+        # windowed IMU summaries; may hold back the raw IMU records
+        self.features = (ImuFeatures(self.ms_series, self.picoW_id, feat_q)
+                         if FEATURES_ENABLED else None)
+        self.hrv = (Hrv(self.ms_series, self.picoW_id, hrv_q)
+                    if HRV_ENABLED else None)
+        self.clock = sensor_clock(self.ms_series)
         self.connection = None
         self.sensor_service = None
         self.write_char = None
         self.notify_char = None
         self.imu_sensor = "IMU9"
+        # reusable decode buffers, resized only when the sample count changes
+        self._imu_vals = None
+        self._imu_bytes = None
+        self._imu_tmpl = None
+        self._imu_key = None
+        self._ecg_vals = None
+        self._ecg_bytes = None
+        self._ecg_tmpl = None
+        self.bad_frames = 0     # malformed data frames, skipped
+        # tick the previous link to this unit went down; cleared (and the
+        # outage reported) on the first notification
+        self.down_since = None
+        # deferred decoding: raw notifications wait here for decode_worker()
+        self.raw = RawFrameQueue(RAW_QUEUE_BYTES) if BLE_DEFER_DECODE else None
 
     def log(self, msg):
         _dprint("[Movesense %s]: %s" % (self.ms_series, msg))
 
-    async def connect_ble(self, device):
+    async def connect_ble(self, device, timeout_ms=10000):
         try:
             self.log("Connecting to %s..." % device)
-            self.connection = await device.connect(timeout_ms=10000)
+            self.connection = await device.connect(timeout_ms=timeout_ms)
         except asyncio.TimeoutError:
             self.log("Connection timeout")
             return
@@ -63,8 +114,9 @@ class MovesenseDevice:
             return
 
         await self.notify_char.subscribe(notify=True)
+        metrics.ble_reset()
 
-    async def subscribe_sensor(self, sensor_type, sensor_rate=None):
+    def _subscribe_cmd(self, sensor_type, sensor_rate=None):
         if sensor_type == "IMU9":
             cmd = bytearray([_CMD_SUBSCRIBE, self.imu_ref]) + bytearray("Meas/IMU9/%d" % sensor_rate, "utf-8")
             self.imu_sensor = "IMU9"
@@ -77,9 +129,47 @@ class MovesenseDevice:
             cmd = bytearray([_CMD_SUBSCRIBE, self.ecg_ref]) + bytearray("Meas/ECG/%d" % sensor_rate, "utf-8")
         else:
             self.log("Invalid sensor type")
-            return
+            return None
+        if sensor_rate:
+            self.clock.stream("ecg" if sensor_type == "ECG" else "imu",
+                              sensor_rate)
 
         self.log("Subscribing %s" % sensor_type)
+        if CAPTURE_ENABLED:
+            capture.log(SRC_CMD, cmd)
+        return cmd
+
+    async def subscribe_sensor(self, sensor_type, sensor_rate=None):
+        cmd = self._subscribe_cmd(sensor_type, sensor_rate)
+        if cmd:
+            await self.write_char.write(cmd)
+
+    async def subscribe_many(self, subs):
+        """Subscribe a list of (sensor_type, rate) in one burst.
+
+        GSP commands are writes without response, so all of them are queued
+        back to back instead of one per round trip.
+        """
+        cmds = [self._subscribe_cmd(t, r) for t, r in subs]
+        for cmd in cmds:
+            if cmd:
+                await self.write_char.write(cmd)
+
+    async def unsubscribe_sensor(self, sensor_type):
+        if sensor_type in ("IMU9", "IMU6"):
+            ref = self.imu_ref
+        elif sensor_type == "HR":
+            ref = self.hr_ref
+        elif sensor_type == "ECG":
+            ref = self.ecg_ref
+        else:
+            self.log("Invalid sensor type")
+            return
+
+        self.log("Unsubscribing %s" % sensor_type)
+        cmd = bytearray([_CMD_UNSUBSCRIBE, ref])
+        if CAPTURE_ENABLED:
+            capture.log(SRC_CMD, cmd)
         await self.write_char.write(cmd)
 
     async def process_notification(self):
@@ -90,74 +180,176 @@ class MovesenseDevice:
                 data = await self.notify_char.notified(timeout_ms=300)
                 if not data:
                     continue
-                ref_code = data[1]
-                if ref_code == self.imu_ref:
-                    self._process_imu_data(data)
-                elif ref_code == self.ecg_ref:
-                    self._process_ecg_data(data)
-                elif ref_code == self.hr_ref:
-                    self._process_hr_data(data)
+                metrics.ble_notification()
+                if self.down_since is not None:
+                    gap = time.ticks_diff(time.ticks_ms(), self.down_since)
+                    metrics.ble_reconnected(gap)
+                    print("[MS] %s: first sample %d ms after disconnect"
+                          % (self.ms_series, gap))
+                    self.down_since = None
+                if CAPTURE_ENABLED:
+                    capture.log(SRC_BLE, data)
+                if self.raw is not None:
+                    self.raw.put(data, time.ticks_ms())
+                else:
+                    tok = lag.enter(_SEC_DECODE)
+                    self._dispatch(data, time.ticks_ms())
+                    lag.exit(tok)
             except asyncio.TimeoutError:
                 continue
 
+    def _dispatch(self, data, tick):
+        # tick: ticks_ms() the notification arrived at. A malformed data
+        # frame is counted and skipped; it must not end the BLE session.
+        if len(data) < 2:
+            return
+        ref_code = data[1]
+        if ref_code not in (self.imu_ref, self.ecg_ref, self.hr_ref):
+            return
+        try:
+            if len(data) < 6:
+                # cmd, ref, then the u32 timestamp (HR: the f32 average)
+                raise ValueError("%d-byte frame" % len(data))
+            if ref_code == self.imu_ref:
+                self._process_imu_data(data, tick)
+            elif ref_code == self.ecg_ref:
+                self._process_ecg_data(data, tick)
+            else:
+                self._process_hr_data(data, tick)
+        except Exception as e:
+            self.bad_frames += 1
+            self.log("bad frame on ref %d: %r" % (ref_code, e))
 
+    def decode_pending(self, max_frames=DECODE_BATCH):
+        """Decode up to max_frames queued raw notifications; returns count.
 
+        Records are stamped from the tick the notification arrived at, not
+        the time it is decoded.
+        """
+        n = 0
+        while n < max_frames:
+            f = self.raw.get()
+            if f is None:
+                break
+            data, tick = f
+            self._dispatch(data, tick)
+            n += 1
+        return n
 
+    async def decode_worker(self):
+        ev = self.raw.event
+        while True:
+            ev.clear()
+            while True:
+                tok = lag.enter(_SEC_DECODE)
+                n = self.decode_pending()
+                lag.exit(tok)
+                if not n:
+                    break
+                await asyncio.sleep_ms(0)
+            await ev.wait()
 
 
 
 
-        ###Added by Kamal
-    
-    def _process_imu_data(self, data):
-        sensor_count  = 3 if self.imu_sensor == "IMU9" else 2
-        sample_count  = len(data[6:]) // MovesenseDevice.BYTES_PER_ELEMENT
-        unpacked      = list(unpack('<BBI' + 'f'*sample_count, data))
-        ts            = unpacked[2]
-        vals          = unpacked[3:]
-
-        triples = list(zip(vals[::3], vals[1::3], vals[2::3]))
-        n = len(triples) // sensor_count
-
-        A, G, M = [], [], []
-        for i in range(n):
-            ax, ay, az = triples[i]
-            gx, gy, gz = triples[i + n]
-            A.append([round(ax, 3), round(ay, 3), round(az, 3)])
-            G.append([round(gx, 3), round(gy, 3), round(gz, 3)])
-            if self.imu_sensor == "IMU9":
-                mx, my, mz = triples[i + 2*n]
-                M.append([round(mx, 3), round(my, 3), round(mz, 3)])
-
-        # --- ONLY NEW LINES: convert triples -> list of {x,y,z} objects ---
-        A_obj = [{"x": ax, "y": ay, "z": az} for (ax, ay, az) in A]
-        G_obj = [{"x": gx, "y": gy, "z": gz} for (gx, gy, gz) in G]
-        M_obj = [{"x": mx, "y": my, "z": mz} for (mx, my, mz) in M] if M else []
-
-        json_data = {
-            "Pico_ID": self.picoW_id,
-            "Movesense_series": self.ms_series,
-            "Timestamp_UTC": time.time(),
-            "Timestamp_ms": ts,
-            "ArrayAcc": A_obj,
-            "ArrayGyro": G_obj,
-            "ArrayMagn": M_obj
-        }
-        imu_queue.enqueue(json_data)
 
+
+
+
+        ###Added by Kamal
     
-    
-    
-    
-    ###############################################################
-        
-        
-        
-        
+    # ---- IMU / ECG: decode into reusable arrays, serialize from them ----
+    #
+    # JSON records are rendered in one `%` operation from a template cached
+    # per sample count (values keep Movesense order: all acc, then gyro, then
+    # magn triples), so no per-sample lists/dicts are built. The queues then
+    # hold ready-to-send JSON bytes.
+    #
+    # Each record carries the UTC ms of its first sample, the sample period
+    # and the samples lost before it, from the unit's SensorClock
+    # (timebase.py).
+
+    def _decode_imu(self, data):
+        cnt = (len(data) - 6) // MovesenseDevice.BYTES_PER_ELEMENT
+        if self._imu_vals is None or len(self._imu_vals) != cnt:
+            self._imu_vals = array("f", bytes(cnt * 4))
+            self._imu_bytes = _byte_view(self._imu_vals, cnt * 4)
+        self._imu_bytes[:] = memoryview(data)[6:6 + cnt * 4]
+        return unpack_from("<I", data, 2)[0], cnt
+
+    def _imu_template(self, cnt):
+        key = (cnt, self.imu_sensor)
+        if self._imu_key != key:
+            blocks = 3 if self.imu_sensor == "IMU9" else 2
+            n = cnt // (3 * blocks)
+            xyz = ",".join(['{"x":%.3f,"y":%.3f,"z":%.3f}'] * n)
+            self._imu_tmpl = (
+                '{"Pico_ID":"' + self.picoW_id +
+                '","Movesense_series":"' + self.ms_series +
+                '","Timestamp_UTC":%d,"Timestamp_ms":%d,"Timestamp_UTC_ms":%d'
+                ',"Sample_period_us":%d,"Missing_samples":%d'
+                ',"ArrayAcc":[' + xyz + '],"ArrayGyro":[' + xyz +
+                '],"ArrayMagn":[' + (xyz if blocks == 3 else "") + ']}')
+            self._imu_key = key
+        return self._imu_tmpl
+
+    def _process_imu_data(self, data, tick=None):
+        if tick is None:
+            tick = time.ticks_ms()
+        ts, cnt = self._decode_imu(data)
+        imu9 = self.imu_sensor == "IMU9"
+        n = cnt // (9 if imu9 else 6)
+        st = self.clock.stamp("imu", ts, n, tick)
+        if self.features and not self.features.add(self._imu_vals, n, st):
+            return
+        utc = st[0] // 1000
+        if _BINARY:
+            self.imu_q.enqueue(wire.encode_imu(self._imu_vals, n, imu9, ts,
+                                               utc, st))
+            return
+        vals = self._imu_vals
+        if cnt % (9 if imu9 else 6):
+            # drop a trailing partial sample so the template lines up
+            vals = vals[:cnt - cnt % (9 if imu9 else 6)]
+        self.imu_q.enqueue((self._imu_template(cnt) %
+                           ((utc, ts) + st + tuple(vals))).encode())
+
+    def _decode_ecg(self, data):
+        cnt = (len(data) - 6) // MovesenseDevice.BYTES_PER_ELEMENT
+        if self._ecg_vals is None or len(self._ecg_vals) != cnt:
+            self._ecg_vals = array("i", bytes(cnt * 4))
+            self._ecg_bytes = _byte_view(self._ecg_vals, cnt * 4)
+            self._ecg_tmpl = (
+                '{"Movesense_series":"' + self.ms_series +
+                '","Pico_ID":"' + self.picoW_id +
+                '","Timestamp_UTC":%d,"Timestamp_ms":%d,"Timestamp_UTC_ms":%d'
+                ',"Sample_period_us":%d,"Missing_samples":%d,"Samples":[' +
+                ",".join(["%d"] * cnt) + ']}')
+        self._ecg_bytes[:] = memoryview(data)[6:6 + cnt * 4]
+        return unpack_from("<I", data, 2)[0], cnt
 
     # --------- Robust HR (variable RR count) ----------
-    def _process_hr_data(self, data):
+    def _process_hr_data(self, data, tick=None):
+        if tick is None:
+            tick = time.ticks_ms()
+        # HR notifications carry no sensor timestamp: map the arrival tick
+        # onto the sensor clock (0 until IMU/ECG have fed the fit)
+        utc_ms = self.clock.utc_ms(tick)
+        utc = utc_ms // 1000
+        ts = self.clock.sensor_ms(tick) or 0
+        if len(data) < 6:
+            self.log("HR frame too short: %d bytes" % len(data))
+            return
         try:
+            if self.hrv:
+                n = (len(data) - 6) // 2
+                self.hrv.feed(unpack_from("<%dH" % n, data, 6), utc_ms, tick)
+                if HR_RAW == "off":
+                    return
+            if _BINARY:
+                self.hr_q.enqueue(wire.encode_hr(data, utc, ts,
+                                                 (utc_ms, 0, 0)))
+                return
             avg_hr   = unpack('<f', data[2:6])[0]
             rr_bytes = data[6:]
             cnt      = len(rr_bytes) // 2
@@ -175,31 +367,32 @@ class MovesenseDevice:
             json_data = {
                 "Pico_ID": self.picoW_id,
                 "Movesense_series": self.ms_series,
-                "Timestamp_UTC": time.time(),
-                "Timestamp_ms": time.ticks_ms() if 'time' in dir(time) else 0,  # optional: add if you want like sample
+                "Timestamp_UTC": utc,
+                "Timestamp_ms": ts,
+                "Timestamp_UTC_ms": utc_ms,
                 "Average_BPM": avg_hr,
                 "rrData": rr_list
             }
             ###################
             
             
-            hr_queue.enqueue(json_data)
+            self.hr_q.enqueue(json_data)
         except Exception as e:
             self.log("HR parse error: %s" % e)
 
-    def _process_ecg_data(self, data):
-        sample_count = len(data[6:]) // MovesenseDevice.BYTES_PER_ELEMENT
-        unpacked     = list(unpack('<BBI' + 'i'*sample_count, data))
-        ts           = unpacked[2]
-        samples      = unpacked[3:]
-        json_data = {
-            "Movesense_series": self.ms_series,
-            "Pico_ID": self.picoW_id,
-            "Timestamp_UTC": time.time(),
-            "Timestamp_ms": ts,
-            "Samples": samples
-        }
-        ecg_queue.enqueue(json_data)
+    def _process_ecg_data(self, data, tick=None):
+        if tick is None:
+            tick = time.ticks_ms()
+        st = self.clock.stamp("ecg", unpack_from("<I", data, 2)[0],
+                              (len(data) - 6) // 4, tick)
+        utc = st[0] // 1000
+        if _BINARY:
+            # samples are already int32 LE on the wire: no decode needed
+            self.ecg_q.enqueue(wire.encode_ecg(data, utc, st))
+            return
+        ts, cnt = self._decode_ecg(data)
+        self.ecg_q.enqueue((self._ecg_tmpl %
+                           ((utc, ts) + st + tuple(self._ecg_vals))).encode())
 
     async def disconnect_ble(self):
         unsub_cmds = [
@@ -3,10 +3,28 @@
 
 import ujson
 import uasyncio as asyncio
-import gc
-from umqtt.robust import MQTTClient
-from data_queue import ecg_queue, hr_queue, imu_queue, gnss_queue, state
+import gc, time, machine
+import wire
+from umqtt.aio import MQTTClient
+from umqtt.simple import publish_size
+from data_queue import ms_queues, gnss_queue, state, data_event
+from metrics import metrics
+from lagmon import lag
 from password import MQTT_CONFIG
+from config import (MQTT_BATCH, MQTT_BATCH_MAX_RECORDS,
+                    MQTT_BATCH_MAX_BYTES, MQTT_BATCH_MAX_AGE_MS,
+                    MQTT_BATCH_MAX_AGE_SLOW_MS,
+                    WIRE_FORMAT, MQTT_OUT_BUF_BYTES,
+                    MQTT_QOS_HR, MQTT_QOS_GNSS, MQTT_INFLIGHT_WINDOW,
+                    MQTT_INFLIGHT_BYTES, SPOOL_ENABLED,
+                    PUBLISH_MAX_LATENCY_MS, HEARTBEAT_MS, FEATURES_ENABLED,
+                    HRV_ENABLED, SCHED_ENABLED, MQTT_CTL_TOPIC)
+if SPOOL_ENABLED:
+    from spool import spool
+    metrics.spool = spool
+if SCHED_ENABLED:
+    from scheduler import sched
+    metrics.sched = sched
 
 _CLIENT_ID = b'raspberrypi-picow'
 TOP_IMU  = b"sensors/imu"
@@ -14,6 +32,24 @@ TOP_ECG  = b"sensors/ecg"
 TOP_HR   = b"sensors/hr"
 TOP_GNSS = b"sensors/gnss"
 TOP_HB   = b"sensors/hb"
+TOP_FEAT = b"sensors/feat"
+TOP_HRV  = b"sensors/hrv"
+TOP_IMU_BIN  = b"sensors/imu/bin"
+TOP_ECG_BIN  = b"sensors/ecg/bin"
+TOP_HR_BIN   = b"sensors/hr/bin"
+TOP_GNSS_BIN = b"sensors/gnss/bin"
+TOP_FEAT_BIN = b"sensors/feat/bin"
+TOP_HRV_BIN  = b"sensors/hrv/bin"
+
+_BINARY = WIRE_FORMAT == "binary"
+_PICO_ID = machine.unique_id()[:8]
+
+# lag monitor sections (synchronous work only; see lagmon.py)
+_SEC_ENCODE = lag.section("mqtt.encode")
+_SEC_SPOOL_W = lag.section("spool.write")
+_SEC_SPOOL_R = lag.section("spool.read")
+_SEC_HB = lag.section("mqtt.heartbeat")
+_SEC_GC = lag.section("gc.collect")
 
 def _ssl_params():
     base = dict(MQTT_CONFIG.get("ssl_params", {}))
@@ -30,6 +66,212 @@ def _json_bytes(obj):
     # compact JSON (double quotes) -> bytes
     return ujson.dumps(obj, separators=(",", ":")).encode()
 
+class _Batch:
+    """Accumulates serialized records for one topic until size or age flush.
+
+    In binary mode the queue already holds wire.py frames and `series` is the
+    integer Movesense serial written into the packet header. `stream` (IMU,
+    ECG, HR, GNSS, FEAT, HRV) groups the batches of all units in the metrics
+    snapshot. take() moves the records into `held`, one encoded payload that
+    stays there until the client (or spool) accepts it.
+    """
+    def __init__(self, topic, queue, stream, series=0, qos=0,
+                 max_age_ms=MQTT_BATCH_MAX_AGE_MS):
+        self.topic = topic
+        self.queue = queue
+        self.stream = stream
+        self.series = series
+        self.qos = qos
+        self.max_age_ms = max_age_ms
+        self.parts = []
+        self.nbytes = 0
+        self.t0 = 0
+        self.held = None        # taken payload not yet accepted
+        self.held_n = 0
+        self.held_t0 = 0
+        self.sent = 0           # records handed to the client (or spool)
+        self.sent_bytes = 0
+
+    def fill(self):
+        # Stops at the record limit or once the byte budget is reached, so a
+        # payload may exceed MQTT_BATCH_MAX_BYTES by at most one record.
+        q = self.queue
+        while (len(q) and len(self.parts) < MQTT_BATCH_MAX_RECORDS
+               and self.nbytes < MQTT_BATCH_MAX_BYTES):
+            if not self.parts:
+                self.t0 = time.ticks_ms()
+            b = _encode(q.dequeue())
+            self.parts.append(b)
+            self.nbytes += len(b) + 1
+
+    def due(self, now):
+        if not self.parts:
+            return False
+        return (len(self.parts) >= MQTT_BATCH_MAX_RECORDS
+                or self.nbytes >= MQTT_BATCH_MAX_BYTES
+                or time.ticks_diff(now, self.t0) >= self.max_age_ms)
+
+    def wait_ms(self, now):
+        """ms until the age limit makes this batch due (None if empty)."""
+        if self.held is not None:
+            return 0
+        if not self.parts:
+            return None
+        return max(0, self.max_age_ms - time.ticks_diff(now, self.t0))
+
+    def take(self):
+        if _BINARY:
+            payload = wire.encode_packet(_PICO_ID, self.series, self.parts)
+        else:
+            payload = b"[" + b",".join(self.parts) + b"]"
+        self.held = payload
+        self.held_n = len(self.parts)
+        self.held_t0 = self.t0
+        self.parts = []
+        self.nbytes = 0
+        return payload
+
+    def accepted(self):
+        self.sent += self.held_n
+        self.sent_bytes += len(self.held)
+        self.held = None
+
+IMU, ECG, HR, GNSS, FEAT, HRV = 0, 1, 2, 3, 4, 5
+
+if _BINARY:
+    _TOPICS = (TOP_IMU_BIN, TOP_ECG_BIN, TOP_HR_BIN, TOP_GNSS_BIN,
+               TOP_FEAT_BIN, TOP_HRV_BIN)
+else:
+    _TOPICS = (TOP_IMU, TOP_ECG, TOP_HR, TOP_GNSS, TOP_FEAT, TOP_HRV)
+
+# one IMU/ECG/HR(/features/HRV) batch per Movesense unit, then GNSS
+_batches = []
+for _series, _imu_q, _ecg_q, _hr_q, _feat_q, _hrv_q in ms_queues:
+    _ms_id = wire.series_id(_series) if _BINARY else 0
+    _batches += [
+        _Batch(_TOPICS[IMU], _imu_q, IMU, _ms_id),
+        _Batch(_TOPICS[ECG], _ecg_q, ECG, _ms_id),
+        _Batch(_TOPICS[HR],  _hr_q,  HR,  _ms_id, MQTT_QOS_HR,
+               MQTT_BATCH_MAX_AGE_SLOW_MS),
+    ]
+    if FEATURES_ENABLED:
+        _batches.append(_Batch(_TOPICS[FEAT], _feat_q, FEAT, _ms_id, 0,
+                               MQTT_BATCH_MAX_AGE_SLOW_MS))
+    if HRV_ENABLED:
+        _batches.append(_Batch(_TOPICS[HRV], _hrv_q, HRV, _ms_id, MQTT_QOS_HR,
+                               MQTT_BATCH_MAX_AGE_SLOW_MS))
+_batches.append(_Batch(_TOPICS[GNSS], gnss_queue, GNSS, 0, MQTT_QOS_GNSS,
+                       MQTT_BATCH_MAX_AGE_SLOW_MS))
+if SCHED_ENABLED:
+    sched.attach(_batches)
+
+async def _send(cli, topic, payload, qos):
+    # False if the client refused a qos=1 payload (window full): the caller
+    # keeps it. Offline, the payload is parked in the flash spool instead of
+    # the client's RAM buffer, where it would be dropped once that fills up;
+    # a qos=0 refusal (larger than the whole buffer) is counted by the client
+    # and can never succeed, so it is consumed too.
+    if SPOOL_ENABLED and not cli.is_connected():
+        tok = lag.enter(_SEC_SPOOL_W)
+        spool.append(topic, payload, qos)
+        lag.exit(tok)
+        return True
+    return await cli.publish(topic, payload, qos=qos) or not qos
+
+def _qos_blocked(cli, qos, topic, payload):
+    # qos=1 backpressure: hold the payload (and the queue behind it) until
+    # PUBACKs free room in the in-flight window. Without the spool the window
+    # keeps filling while offline too, and only a reconnect drains it.
+    if not qos or (SPOOL_ENABLED and not cli.is_connected()):
+        return False
+    return not cli.inflight_room(publish_size(topic, payload, qos))
+
+def _order():
+    # batches for this cycle: by priority under the scheduler
+    if SCHED_ENABLED:
+        sched.refill()
+        return sched.order()
+    return _batches
+
+def _sched_blocked(cli, b, nbytes):
+    # token buckets only pace the live link; offline payloads go to the spool
+    return (SCHED_ENABLED and cli.is_connected()
+            and not sched.admit(b.stream, nbytes))
+
+async def _publish_batches(cli):
+    now = time.ticks_ms()
+    for b in _order():
+        tok = lag.enter(_SEC_ENCODE)
+        b.fill()
+        lag.exit(tok)
+        n = sched.weight(b.stream) if SCHED_ENABLED else -1
+        # keep flushing while the queue still holds a full batch's worth
+        while n and (b.held is not None or b.due(now)):
+            if b.held is None:
+                tok = lag.enter(_SEC_ENCODE)
+                b.take()
+                lag.exit(tok)
+            if _qos_blocked(cli, b.qos, b.topic, b.held):
+                break
+            if _sched_blocked(cli, b, len(b.held)):
+                break
+            age = time.ticks_diff(time.ticks_ms(), b.held_t0)
+            if not await _send(cli, b.topic, b.held, b.qos):
+                break
+            b.accepted()
+            n -= 1
+            if age > state.publish_latency_ms:
+                state.publish_latency_ms = age
+            tok = lag.enter(_SEC_ENCODE)
+            b.fill()
+            lag.exit(tok)
+
+async def _publish_single(cli):
+    for b in _order():
+        while not b.queue.is_empty():
+            rec = _encode(b.queue.peek())
+            if _BINARY:
+                rec = wire.encode_packet(_PICO_ID, b.series, (rec,))
+            if _qos_blocked(cli, b.qos, b.topic, rec):
+                break
+            if _sched_blocked(cli, b, len(rec)):
+                break
+            if not await _send(cli, b.topic, rec, b.qos):
+                break
+            b.queue.dequeue()
+            b.sent += 1
+            b.sent_bytes += len(rec)
+
+async def _replay_spool(cli):
+    # interleave spooled payloads with live traffic; the spool rate-limits
+    # itself, and we stop early rather than overrun the client's buffers
+    while cli.inflight_room(MQTT_BATCH_MAX_BYTES + 64):
+        room = MQTT_OUT_BUF_BYTES // 2 - cli.pending_bytes()
+        if room <= 0:
+            break
+        tok = lag.enter(_SEC_SPOOL_R)
+        rec = spool.next_record(room)
+        lag.exit(tok)
+        if rec is None:
+            break
+        if (_qos_blocked(cli, rec[2], rec[0], rec[1])
+                or not await _send(cli, rec[0], rec[1], rec[2])):
+            # window full: keep it first in line
+            spool.unread(rec)
+            break
+
+def _encode(rec):
+    # binary frames and pre-rendered JSON (IMU/ECG) are bytes; the rest are
+    # dicts
+    return rec if isinstance(rec, (bytes, bytearray)) else _json_bytes(rec)
+
+def _on_ctl(topic, msg):
+    try:
+        sched.configure(ujson.loads(msg))
+        print("[SCHED] Reconfigured:", bytes(msg).decode())
+    except Exception as e:
+        print("[SCHED] Bad control message:", e)
+
 async def connect_mqtt():
     print("[MQTT] Preparing client...")
     kw = dict(client_id=_CLIENT_ID,
@@ -37,42 +279,93 @@ async def connect_mqtt():
               port=MQTT_CONFIG["port"],
               user=MQTT_CONFIG["username"],
               password=MQTT_CONFIG["password"],
-              keepalive=30)
+              keepalive=30,
+              out_buf_bytes=MQTT_OUT_BUF_BYTES,
+              max_inflight=MQTT_INFLIGHT_WINDOW,
+              inflight_bytes=MQTT_INFLIGHT_BYTES)
     if MQTT_CONFIG.get("ssl", False) or MQTT_CONFIG["port"] in (443, 8883):
         kw.update(ssl=True, ssl_params=_ssl_params())
     try:
         cli = MQTTClient(**kw)
         print("[MQTT] Connecting to {}:{} (TLS:{})..."
               .format(kw["server"], kw["port"], "on" if "ssl" in kw else "off"))
-        cli.connect()
-        print("[MQTT] Connected.")
-        state.network_connection_state = True
+        # the client keeps reconnecting in the background, so hand it out
+        # even if the broker is not reachable yet
+        if await cli.connect():
+            print("[MQTT] Connected.")
+        else:
+            print("[MQTT] Broker unreachable; retrying in background.")
+        if SCHED_ENABLED and MQTT_CTL_TOPIC:
+            # kept across reconnects by the client
+            cli.set_callback(_on_ctl)
+            try:
+                await cli.subscribe(MQTT_CTL_TOPIC)
+            except Exception as e:
+                print("[MQTT] Control subscribe error:", e)
+        state.network_connection_state = cli.is_connected()
         return cli
     except Exception as e:
         print("[MQTT] CONNECT ERROR:", e)
         state.network_connection_state = False
         return None
 
+def _wait_ms(cli, last_hb):
+    # sleep until the next batch ages out (capped at PUBLISH_MAX_LATENCY_MS
+    # while anything is pending) or the heartbeat is due, unless a queue
+    # wakes us first
+    now = time.ticks_ms()
+    t = max(0, HEARTBEAT_MS - time.ticks_diff(now, last_hb))
+    for b in _batches:
+        w = b.wait_ms(now)
+        if w == 0 and b.held is not None and _qos_blocked(
+                cli, b.qos, b.topic, b.held):
+            # waiting for PUBACKs or a reconnect: poll instead of spinning
+            w = PUBLISH_MAX_LATENCY_MS
+        if w == 0 and SCHED_ENABLED:
+            # due, but maybe waiting for tokens
+            w = sched.wait_ms(b.stream)
+        if w is not None and w < t:
+            t = w
+        if len(b.queue) and t > PUBLISH_MAX_LATENCY_MS:
+            t = PUBLISH_MAX_LATENCY_MS
+    if SPOOL_ENABLED and spool.pending() and t > PUBLISH_MAX_LATENCY_MS:
+        t = PUBLISH_MAX_LATENCY_MS
+    return t
+
 async def publish_to_mqtt(cli):
-    hb = 0
+    last_hb = time.ticks_ms()
     while True:
+        # cleared before draining, so data arriving meanwhile re-arms it
+        data_event.clear()
         try:
             if cli:
-                if not imu_queue.is_empty():
-                    cli.publish(TOP_IMU,  _json_bytes(imu_queue.dequeue()))
-                if not ecg_queue.is_empty():
-                    cli.publish(TOP_ECG,  _json_bytes(ecg_queue.dequeue()))
-                if not hr_queue.is_empty():
-                    cli.publish(TOP_HR,   _json_bytes(hr_queue.dequeue()))
-                if not gnss_queue.is_empty():
-                    cli.publish(TOP_GNSS, _json_bytes(gnss_queue.dequeue()))
-                hb += 1
-                if hb >= 50:  # ~5s
-                    cli.publish(TOP_HB, b'{"hb":1}')
+                t0 = time.ticks_us()
+                state.network_connection_state = cli.is_connected()
+                if MQTT_BATCH:
+                    await _publish_batches(cli)
+                else:
+                    await _publish_single(cli)
+                if SPOOL_ENABLED:
+                    if cli.is_connected() and spool.pending():
+                        await _replay_spool(cli)
+                    tok = lag.enter(_SEC_SPOOL_W)
+                    spool.flush()
+                    lag.exit(tok)
+                metrics.loop_time(time.ticks_diff(time.ticks_us(), t0))
+                now = time.ticks_ms()
+                if time.ticks_diff(now, last_hb) >= HEARTBEAT_MS:
+                    # metrics snapshot doubles as the heartbeat
+                    tok = lag.enter(_SEC_HB)
+                    snap = metrics.snapshot(_batches, cli)
+                    lag.exit(tok)
+                    await cli.publish(TOP_HB, snap)
+                    tok = lag.enter(_SEC_GC)
                     gc.collect()          # periodic GC to reduce fragmentation
-                    hb = 0
+                    lag.exit(tok)
+                    last_hb = now
         except Exception as e:
             print("[MQTT] Publish error:", e)
-        await asyncio.sleep_ms(100)
-
-
+        try:
+            await asyncio.wait_for_ms(data_event.wait(), _wait_ms(cli, last_hb))
+        except asyncio.TimeoutError:
+            pass
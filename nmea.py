@@ -0,0 +1,248 @@
+# nmea.py -- incremental NMEA 0183 framer working on raw UART bytes.
+#
+# Bytes are read straight into the framer's receive buffer (uart.readinto /
+# StreamReader.readinto on space()), scanned once, and complete sentences are
+# checksum-validated and parsed in place: numbers are read digit by digit from
+# the buffer, so no str/bytes objects are created per sentence. Any talker
+# (GP, GN, GL, GA, GB, ...) is accepted for GGA, RMC and VTG.
+from array import array
+from micropython import const
+from config import NMEA_BUF_BYTES
+
+GGA = const(1)
+RMC = const(2)
+VTG = const(3)
+
+_MAX_FIELDS = const(24)
+_MAX_LEN = const(96)        # spec says 82 incl. CRLF; some receivers exceed it
+
+_DOLLAR = const(0x24)
+_STAR   = const(0x2A)
+_COMMA  = const(0x2C)
+_LF     = const(0x0A)
+_CR     = const(0x0D)
+
+def _hex(c):
+    if 48 <= c <= 57:
+        return c - 48
+    c |= 0x20
+    if 97 <= c <= 102:
+        return c - 87
+    return -1
+
+def _num(buf, s, e):
+    # unsigned decimal field -> float, None if empty or malformed
+    if s >= e:
+        return None
+    v = 0
+    scale = 1
+    frac = False
+    for i in range(s, e):
+        c = buf[i]
+        if c == 46:
+            frac = True
+            continue
+        c -= 48
+        if c < 0 or c > 9:
+            return None
+        v = v * 10 + c
+        if frac:
+            scale *= 10
+    return v / scale if frac else v
+
+class NmeaFramer:
+    """Splits a UART byte stream into validated NMEA sentences.
+
+    Usage: readinto(space()), commit(n), then call next() until it returns 0;
+    after each non-zero return the gga()/rmc()/vtg() accessors parse the
+    current sentence. Counters: sentences (valid, any type), bad_checksum,
+    overruns (sentences cut short by lost bytes or longer than _MAX_LEN),
+    ignored (valid sentences of other types).
+    """
+    def __init__(self, size=NMEA_BUF_BYTES):
+        self.buf = bytearray(size)
+        self._mv = memoryview(self.buf)
+        self._n = 0             # bytes held
+        self._i = 0             # scan position
+        self._start = -1        # offset of the current '$', -1 while hunting
+        self._star = -1
+        self._ck = 0
+        self._f = array("H", bytes(2 * _MAX_FIELDS))   # field start offsets
+        self._nf = 0
+        self._end = 0           # end of the last sentence's fields ('*')
+        self.sentences = 0
+        self.bad_checksum = 0
+        self.overruns = 0
+        self.ignored = 0
+        self.nbytes = 0
+
+    def space(self):
+        """Free tail of the receive buffer to read new bytes into."""
+        if self._i >= self._n:
+            self._compact()
+        return self._mv[self._n:]
+
+    def commit(self, n):
+        self._n += n
+        self.nbytes += n
+
+    def next(self):
+        """Kind (GGA/RMC/VTG) of the next complete valid sentence, or 0."""
+        buf = self.buf
+        f = self._f
+        i = self._i
+        n = self._n
+        start = self._start
+        star = self._star
+        ck = self._ck
+        nf = self._nf
+        kind = 0
+        while i < n:
+            c = buf[i]
+            if start < 0:
+                if c == _DOLLAR:
+                    start = i
+                    star = -1
+                    ck = 0
+                    f[0] = i + 1
+                    nf = 1
+                i += 1
+                continue
+            if c == _LF:
+                i += 1
+                kind = self._finish(buf, start, star, ck, i - 1)
+                start = -1
+                if kind:
+                    self._nf = nf
+                    break
+                continue
+            if c == _DOLLAR:
+                # new sentence before the end of this one: bytes were lost
+                self.overruns += 1
+                start = i
+                star = -1
+                ck = 0
+                f[0] = i + 1
+                nf = 1
+            elif i - start >= _MAX_LEN:
+                self.overruns += 1
+                start = -1
+            elif star < 0:
+                if c == _STAR:
+                    star = i
+                else:
+                    ck ^= c
+                    if c == _COMMA and nf < _MAX_FIELDS:
+                        f[nf] = i + 1
+                        nf += 1
+            i += 1
+        self._i = i
+        self._start = start
+        self._star = star
+        self._ck = ck
+        self._nf = nf
+        return kind
+
+    def stats(self):
+        return (self.sentences, self.bad_checksum, self.overruns, self.ignored)
+
+    def sentence(self):
+        """Copy of the current sentence, checksum included, without CRLF."""
+        return bytes(self._mv[self._f[0] - 1:self._end + 3])
+
+    # ---- field access (current sentence) ----
+
+    def _field(self, k):
+        if k >= self._nf:
+            return 0, 0
+        s = self._f[k]
+        e = self._f[k + 1] - 1 if k + 1 < self._nf else self._end
+        return s, e
+
+    def _number(self, k):
+        s, e = self._field(k)
+        return _num(self.buf, s, e)
+
+    def _coord(self, k, deg_digits):
+        # ddmm.mmmm / dddmm.mmmm plus hemisphere in field k + 1
+        s, e = self._field(k)
+        if e - s <= deg_digits:
+            return None
+        buf = self.buf
+        deg = _num(buf, s, s + deg_digits)
+        mins = _num(buf, s + deg_digits, e)
+        if deg is None or mins is None:
+            return None
+        v = deg + mins / 60.0
+        h, _ = self._field(k + 1)
+        if h and buf[h] in (83, 87):        # 'S', 'W'
+            v = -v
+        return v
+
+    def _char(self, k):
+        s, e = self._field(k)
+        return self.buf[s] if e > s else 0
+
+    def gga(self):
+        """(fixq, lat, lon, nsat, hdop, alt_m); lat/lon None without a fix."""
+        q = self._number(6)
+        return (int(q) if q is not None else 0,
+                self._coord(2, 2), self._coord(4, 3),
+                self._number(7), self._number(8), self._number(9))
+
+    def rmc(self):
+        """(valid, lat, lon, speed_knots, course_deg)."""
+        return (self._char(2) == 65,                # 'A'
+                self._coord(3, 2), self._coord(5, 3),
+                self._number(7), self._number(8))
+
+    def vtg(self):
+        """(course_deg, speed_kmh)."""
+        return self._number(1), self._number(7)
+
+    # ---- internals ----
+
+    def _finish(self, buf, start, star, ck, lf):
+        end = lf - 1 if lf > start and buf[lf - 1] == _CR else lf
+        if star < 0 or end - star != 3:
+            self.bad_checksum += 1
+            return 0
+        hi = _hex(buf[star + 1])
+        lo = _hex(buf[star + 2])
+        if hi < 0 or lo < 0 or (hi << 4 | lo) != ck:
+            self.bad_checksum += 1
+            return 0
+        self.sentences += 1
+        self._end = star
+        if star - start < 7:
+            self.ignored += 1
+            return 0
+        a = buf[start + 3]
+        b = buf[start + 4]
+        c = buf[start + 5]
+        if a == 71 and b == 71 and c == 65:         # GGA
+            return GGA
+        if a == 82 and b == 77 and c == 67:         # RMC
+            return RMC
+        if a == 86 and b == 84 and c == 71:         # VTG
+            return VTG
+        self.ignored += 1
+        return 0
+
+    def _compact(self):
+        # everything before the partial sentence (if any) has been consumed
+        s = self._start
+        if s < 0:
+            self._n = self._i = 0
+            return
+        if s == 0 or len(self.buf) - self._n >= _MAX_LEN:
+            return
+        keep = self._n - s
+        self.buf[0:keep] = bytes(self._mv[s:self._n])
+        f = self._f
+        for k in range(self._nf):
+            f[k] -= s
+        if self._star >= 0:
+            self._star -= s
+        self._start = 0
+        self._n = self._i = keep
@@ -0,0 +1,188 @@
+# ntrip.py -- non-blocking NTRIP v1/v2 client on uasyncio streams.
+#
+# run() owns the caster connection: it waits for a first GGA (VRS mountpoints
+# need a position), connects, validates the response status ("ICY 200 OK" for
+# v1, "HTTP/1.x 200" for v2), follows chunked transfer encoding, and hands RTCM
+# to `sink` as soon as it arrives. A separate task sends the latest GGA every
+# NTRIP_GGA_INTERVAL_MS. Failures reconnect with exponential backoff and
+# jitter; a caster that goes quiet for RX_TIMEOUT_MS counts as a failure.
+import uasyncio as asyncio
+import ubinascii, random
+from config import NTRIP_GGA_INTERVAL_MS
+
+class NtripError(Exception):
+    pass
+
+class NtripClient:
+    BACKOFF_MIN_MS = 1000
+    BACKOFF_MAX_MS = 60000
+    CONNECT_TIMEOUT_MS = 10000
+    RX_TIMEOUT_MS = 30000
+    BUF_SIZE = 512
+
+    def __init__(self, host, port, mountpoint, user=None, password=None,
+                 version=2, gga_interval_ms=NTRIP_GGA_INTERVAL_MS):
+        self.host = host
+        self.port = port
+        self.mountpoint = mountpoint
+        self.version = version
+        self.gga_interval_ms = gga_interval_ms
+        self._auth = None
+        if user:
+            self._auth = ubinascii.b2a_base64(
+                ("%s:%s" % (user, password)).encode()).decode().strip()
+        self._gga = None
+        self._ev_gga = asyncio.Event()
+        self._buf = bytearray(self.BUF_SIZE)
+        self._mv = memoryview(self._buf)
+        self.connected = False
+        self.status = None          # last status line from the caster
+        # counters
+        self.connects = 0
+        self.failures = 0
+        self.rx_bytes = 0
+        self.gga_sent = 0
+
+    def set_gga(self, gga):
+        """Latest GGA sentence (bytes, without CRLF); sent on the next tick."""
+        self._gga = gga
+        self._ev_gga.set()
+
+    def stats(self):
+        return (self.connects, self.failures, self.rx_bytes, self.gga_sent)
+
+    async def run(self, sink):
+        """Stream RTCM into `sink(mv)` forever, reconnecting with backoff."""
+        delay = self.BACKOFF_MIN_MS
+        while True:
+            await self._ev_gga.wait()
+            w = None
+            try:
+                r, w = await asyncio.wait_for_ms(
+                    asyncio.open_connection(self.host, self.port),
+                    self.CONNECT_TIMEOUT_MS)
+                chunked = await self._handshake(r, w)
+                self.connected = True
+                self.connects += 1
+                delay = self.BACKOFF_MIN_MS
+                print("[NTRIP] Connected (%s); streaming RTCM." % self.status)
+                gga = asyncio.create_task(self._gga_loop(w))
+                try:
+                    if chunked:
+                        await self._pump_chunked(r, sink)
+                    else:
+                        await self._pump(r, sink)
+                finally:
+                    gga.cancel()
+                print("[NTRIP] Caster closed the stream.")
+            except asyncio.CancelledError:
+                self._close(w)
+                raise
+            except Exception as e:
+                print("[NTRIP] Error:", repr(e))
+            self._close(w)
+            self.failures += 1
+            # exponential backoff with jitter: sleep in [delay/2, delay)
+            half = delay // 2
+            await asyncio.sleep_ms(half + random.getrandbits(16) % (half + 1))
+            delay = min(delay * 2, self.BACKOFF_MAX_MS)
+
+    # ---- internals ----
+
+    def _request(self):
+        if self.version >= 2:
+            req = ("GET /%s HTTP/1.1\r\n"
+                   "Host: %s:%d\r\n"
+                   "Ntrip-Version: Ntrip/2.0\r\n"
+                   % (self.mountpoint, self.host, self.port))
+            if self._gga:
+                req += "Ntrip-GGA: %s\r\n" % self._gga.decode()
+        else:
+            req = "GET /%s HTTP/1.0\r\n" % self.mountpoint
+        req += "User-Agent: NTRIP 5GSport/1.0\r\n"
+        if self._auth:
+            req += "Authorization: Basic %s\r\n" % self._auth
+        return (req + "\r\n").encode()
+
+    async def _readline(self, r):
+        line = await asyncio.wait_for_ms(r.readline(), self.CONNECT_TIMEOUT_MS)
+        if not line:
+            raise NtripError("connection closed")
+        return line
+
+    async def _handshake(self, r, w):
+        """Send the request and validate the reply; True if chunked."""
+        w.write(self._request())
+        if self.version < 2 and self._gga:
+            w.write(self._gga + b"\r\n")
+        await w.drain()
+        status = (await self._readline(r)).strip()
+        self.status = status.decode()
+        if status.startswith(b"ICY 200"):
+            return False            # v1: RTCM follows directly, no headers
+        if status.startswith(b"SOURCETABLE"):
+            raise NtripError("mountpoint not found: " + self.mountpoint)
+        parts = status.split()
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or parts[1] != b"200":
+            raise NtripError(self.status)
+        chunked = False
+        while True:
+            line = await self._readline(r)
+            if line in (b"\r\n", b"\n"):
+                return chunked
+            k, _, v = line.partition(b":")
+            k = k.strip().lower()
+            v = v.strip().lower()
+            if k == b"transfer-encoding" and v == b"chunked":
+                chunked = True
+            elif k == b"content-type" and v.startswith(b"gnss/sourcetable"):
+                raise NtripError("mountpoint not found: " + self.mountpoint)
+
+    async def _read_some(self, r, n):
+        k = await asyncio.wait_for_ms(r.readinto(self._mv[:n]), self.RX_TIMEOUT_MS)
+        if not k:
+            raise NtripError("connection closed")
+        self.rx_bytes += k
+        return k
+
+    async def _pump(self, r, sink):
+        mv = self._mv
+        while True:
+            k = await self._read_some(r, self.BUF_SIZE)
+            sink(mv[:k])
+
+    async def _pump_chunked(self, r, sink):
+        mv = self._mv
+        while True:
+            line = await asyncio.wait_for_ms(r.readline(), self.RX_TIMEOUT_MS)
+            if not line:
+                raise NtripError("connection closed")
+            size = line.split(b";")[0].strip()
+            if not size:
+                continue            # CRLF that terminates the previous chunk
+            left = int(size, 16)
+            if left == 0:
+                return              # last chunk
+            while left:
+                k = await self._read_some(r, min(left, self.BUF_SIZE))
+                sink(mv[:k])
+                left -= k
+
+    async def _gga_loop(self, w):
+        while True:
+            await asyncio.sleep_ms(self.gga_interval_ms)
+            if self._gga:
+                try:
+                    w.write(self._gga + b"\r\n")
+                    await w.drain()
+                except OSError:
+                    return          # the RTCM reader sees the failure too
+                self.gga_sent += 1
+
+    def _close(self, w):
+        self.connected = False
+        if w:
+            try:
+                w.close()
+            except Exception:
+                pass
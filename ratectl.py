@@ -0,0 +1,122 @@
+# ratectl.py -- adaptive Movesense subscription rates.
+#
+# Every RATE_CHECK_MS the controller looks at the IMU/ECG queues of all units
+# (fill level, new drops, raw BLE frames dropped when decoding is deferred)
+# and at the publish latency mqtt.py reports. The uplink is shared, so one
+# level applies to every connected unit. Pressure that lasts RATE_DOWN_MS
+# moves one step down RATE_LEVELS; the link has to stay healthy (below the
+# low watermarks, no drops) for RATE_UP_MS before stepping back up. Readings
+# between the watermarks leave both timers alone; with the longer up-delay
+# that is the hysteresis. Changing level unsubscribes and resubscribes
+# Meas/IMU*/<rate> and Meas/ECG/<rate> on each attached MovesenseDevice.
+import uasyncio as asyncio
+from data_queue import ms_queues, state
+from metrics import metrics
+from config import (RATE_LEVELS, RATE_CHECK_MS, RATE_DOWN_MS, RATE_UP_MS,
+                    RATE_FILL_HIGH, RATE_FILL_LOW, RATE_LATENCY_HIGH_MS,
+                    RATE_LATENCY_LOW_MS)
+
+class RateController:
+    def __init__(self, levels=RATE_LEVELS):
+        self.levels = levels
+        self.level = 0
+        self.changes = 0
+        self._queues = [q for u in ms_queues for q in u[1:3]]
+        self.devices = []
+        self._dropped = 0
+        self._bad_ms = 0
+        self._good_ms = 0
+
+    def rates(self):
+        """(imu_hz, ecg_hz) for the current level."""
+        return self.levels[self.level]
+
+    def streams(self, ms):
+        """(sensor_type, rate) subscriptions for IMU and ECG at this level."""
+        imu, ecg = self.rates()
+        subs = [(ms.imu_sensor, imu)]
+        if ecg:
+            subs.append(("ECG", ecg))
+        return subs
+
+    def attach(self, ms):
+        """Follow level changes on a connected, subscribed device."""
+        self.devices.append(ms)
+        self._dropped = self._drops()
+
+    def detach(self, ms):
+        if ms in self.devices:
+            self.devices.remove(ms)
+        self._dropped = self._drops()
+
+    async def run(self):
+        self._dropped = self._drops()
+        self._bad_ms = self._good_ms = 0
+        state.publish_latency_ms = 0
+        while True:
+            await asyncio.sleep_ms(RATE_CHECK_MS)
+            step = self.check()
+            if step:
+                await self._apply(self.level + step)
+
+    def check(self):
+        """+1 to step down, -1 to step up, 0 to stay."""
+        drops = self._drops()
+        new_drops = drops - self._dropped
+        self._dropped = drops
+        fill = 0
+        for q in self._queues:
+            f = len(q) * 100 // q.capacity
+            if f > fill:
+                fill = f
+        lat = state.publish_latency_ms
+        state.publish_latency_ms = 0
+        if new_drops or fill >= RATE_FILL_HIGH or lat >= RATE_LATENCY_HIGH_MS:
+            self._good_ms = 0
+            self._bad_ms += RATE_CHECK_MS
+            if self._bad_ms >= RATE_DOWN_MS and self.level + 1 < len(self.levels):
+                return 1
+        elif fill <= RATE_FILL_LOW and lat <= RATE_LATENCY_LOW_MS:
+            self._bad_ms = 0
+            self._good_ms += RATE_CHECK_MS
+            if self._good_ms >= RATE_UP_MS and self.level > 0:
+                return -1
+        return 0
+
+    def _drops(self):
+        n = 0
+        for q in self._queues:
+            n += q.dropped
+        for ms in self.devices:
+            if ms.raw is not None:
+                n += ms.raw.dropped
+        return n
+
+    async def _apply(self, level):
+        old_imu, old_ecg = self.rates()
+        imu, ecg = self.levels[level]
+        print("[RATE] Level %d -> %d: IMU %d Hz, ECG %s" % (
+            self.level, level, imu, ("%d Hz" % ecg) if ecg else "off"))
+        self.level = level
+        self.changes += 1
+        self._bad_ms = self._good_ms = 0
+        for ms in list(self.devices):
+            try:
+                if imu != old_imu:
+                    await ms.unsubscribe_sensor(ms.imu_sensor)
+                    await ms.subscribe_sensor(ms.imu_sensor, imu)
+                if ecg != old_ecg:
+                    if old_ecg:
+                        await ms.unsubscribe_sensor("ECG")
+                    if ecg:
+                        await ms.subscribe_sensor("ECG", ecg)
+            except Exception as e:
+                # that link is going down; its reconnect subscribes at the
+                # new level
+                print("[RATE] Resubscribe error (%s):" % ms.ms_series, e)
+        # queued records are from the old rate; count drops from here on
+        self._dropped = self._drops()
+        state.publish_latency_ms = 0
+
+rate_ctl = RateController()
+metrics.rate = rate_ctl
@@ -0,0 +1,95 @@
+# replay.py -- feed a capture.py log back through the live input paths.
+#
+# BLE notifications go through MovesenseDevice._dispatch (stamped against a
+# UTC clock anchored at the capture's start), GSP subscribe commands restore
+# the IMU6/IMU9 choice, UART bytes go through the NMEA framer and fix
+# handling of bynav_GNSS, and RTCM chunks through an Rtcm3Framer (counted, not written
+# anywhere). Whatever ends up in the sensor queues is published by
+# publish_to_mqtt if that task is running.
+#
+# speed=1.0 keeps the recorded timing, 2.0 runs twice as fast, and 0 replays
+# as fast as possible, yielding to other tasks every `yield_every` records.
+import time
+import uasyncio as asyncio
+from struct import unpack_from
+from capture import (MAGIC, VERSION, FILE_HDR, FILE_HDR_SIZE, REC_HDR,
+                     REC_HDR_SIZE, SRC_BLE, SRC_CMD, SRC_UART, SRC_RTCM)
+import bynav_GNSS
+from movesense_device import MovesenseDevice
+from timebase import SensorClock, UtcClock
+from rtcm import Rtcm3Framer
+
+class Replayer:
+    def __init__(self, path, ms_series="replay", pico_id="replay",
+                 speed=1.0, yield_every=32):
+        self.path = path
+        self.speed = speed
+        self.yield_every = yield_every
+        self.pico_id = pico_id
+        self.ms = MovesenseDevice(ms_series, pico_id)
+        self.link = bynav_GNSS.Link()
+        self.rtcm = Rtcm3Framer(lambda mv: None)
+        self.counts = {SRC_BLE: 0, SRC_CMD: 0, SRC_UART: 0, SRC_RTCM: 0}
+        self.nbytes = 0
+        self.elapsed_ms = 0
+
+    async def run(self):
+        """Replay the whole log; returns the number of records."""
+        hdr = bytearray(REC_HDR_SIZE)
+        t_start = time.ticks_ms()
+        n = 0
+        with open(self.path, "rb") as f:
+            fh = f.read(FILE_HDR_SIZE)
+            if len(fh) != FILE_HDR_SIZE:
+                raise ValueError("not a capture file")
+            magic, ver, utc0, tick0 = unpack_from(FILE_HDR, fh)
+            if magic != MAGIC or ver != VERSION:
+                raise ValueError("not a capture file")
+            # recorded ticks map to UTC through the capture's own anchor
+            self.ms.clock = SensorClock(UtcClock((tick0, utc0 * 1000)))
+            first = None
+            while f.readinto(hdr) == REC_HDR_SIZE:
+                src, ln, tick = unpack_from(REC_HDR, hdr)
+                data = f.read(ln)
+                if len(data) != ln:
+                    break               # torn final record
+                if first is None:
+                    first = tick
+                if self.speed:
+                    due = int(time.ticks_diff(tick, first) / self.speed)
+                    wait = due - time.ticks_diff(time.ticks_ms(), t_start)
+                    if wait > 0:
+                        await asyncio.sleep_ms(wait)
+                elif n % self.yield_every == 0:
+                    await asyncio.sleep_ms(0)
+                self._feed(src, data, tick,
+                           utc0 + time.ticks_diff(tick, tick0) // 1000)
+                n += 1
+                self.nbytes += ln
+        self.elapsed_ms = time.ticks_diff(time.ticks_ms(), t_start)
+        return n
+
+    def _feed(self, src, data, tick, utc):
+        # tick / utc: recorded receive tick and its wall-clock second
+        if src in self.counts:
+            self.counts[src] += 1
+        if src == SRC_BLE:
+            self.ms._dispatch(data, tick)
+        elif src == SRC_CMD:
+            path = data[2:]
+            if path.startswith(b"Meas/IMU6"):
+                self.ms.imu_sensor = "IMU6"
+            elif path.startswith(b"Meas/IMU9"):
+                self.ms.imu_sensor = "IMU9"
+        elif src == SRC_UART:
+            fr = bynav_GNSS.framer
+            i = 0
+            while i < len(data):
+                space = fr.space()
+                k = min(len(space), len(data) - i)
+                space[:k] = data[i:i + k]
+                fr.commit(k)
+                i += k
+                bynav_GNSS.handle_nmea(self.pico_id, self.link, None, utc)
+        elif src == SRC_RTCM:
+            self.rtcm.feed(data)
@@ -0,0 +1,131 @@
+# rtcm.py -- RTCM3 framer between the NTRIP stream and the GNSS UART.
+#
+# Frame: 0xD3, 6 reserved bits + 10-bit payload length, payload (the first
+# 12 bits are the message type), CRC-24Q over everything before it. Only
+# complete frames with a valid CRC are passed on, optionally restricted to
+# the message types in RTCM_ALLOW; anything else is skipped byte by byte
+# until the next preamble.
+import time
+from array import array
+from micropython import const
+from config import RTCM_ALLOW, RTCM_BUF_BYTES
+
+_PREAMBLE = const(0xD3)
+_MAX_FRAME = const(1029)    # 3 header + 1023 payload + 3 CRC
+
+def _make_table():
+    t = array("I", bytes(4 * 256))
+    for i in range(256):
+        c = i << 16
+        for _ in range(8):
+            c <<= 1
+            if c & 0x1000000:
+                c ^= 0x1864CFB
+        t[i] = c & 0xFFFFFF
+    return t
+
+_CRC_TABLE = _make_table()
+
+def crc24q(buf, s, e):
+    t = _CRC_TABLE
+    crc = 0
+    for i in range(s, e):
+        # mask before shifting so the value stays a small int
+        crc = ((crc & 0xFFFF) << 8) ^ t[(crc >> 16) ^ buf[i]]
+    return crc
+
+class Rtcm3Framer:
+    """Reassembles RTCM3 frames from arbitrary chunks and forwards them.
+
+    feed(data) is the NTRIP client's sink; valid frames go to `sink(mv)`.
+    Counters: frames (forwarded), filtered (valid but not allowed), bad_crc,
+    skipped (bytes discarded while resynchronising), per-type counts in
+    `types`, and `bps` (received bytes/s over the last second).
+    """
+    def __init__(self, sink, allow=RTCM_ALLOW, size=RTCM_BUF_BYTES):
+        self.sink = sink
+        self.allow = allow
+        self.buf = bytearray(max(size, 2 * _MAX_FRAME))
+        self._mv = memoryview(self.buf)
+        self._n = 0
+        self.frames = 0
+        self.filtered = 0
+        self.bad_crc = 0
+        self.skipped = 0
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.types = {}
+        self.bps = 0
+        self._win = 0
+        self._win_t0 = time.ticks_ms()
+        self._last_frame = None
+
+    def feed(self, data):
+        now = time.ticks_ms()
+        n = len(data)
+        self.rx_bytes += n
+        self._win += n
+        dt = time.ticks_diff(now, self._win_t0)
+        if dt >= 1000:
+            self.bps = self._win * 1000 // dt
+            self._win = 0
+            self._win_t0 = now
+        i = 0
+        while i < n:
+            k = min(n - i, len(self.buf) - self._n)
+            self._mv[self._n:self._n + k] = data[i:i + k]
+            self._n += k
+            i += k
+            self._parse(now)
+
+    def age_ms(self):
+        """Correction age: ms since the last forwarded frame (None if never)."""
+        if self._last_frame is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self._last_frame)
+
+    def stats(self):
+        return (self.frames, self.filtered, self.bad_crc, self.skipped, self.bps)
+
+    # ---- internals ----
+
+    def _parse(self, now):
+        buf = self.buf
+        n = self._n
+        p = 0
+        while p < n:
+            if buf[p] != _PREAMBLE:
+                p += 1
+                self.skipped += 1
+                continue
+            if n - p < 3:
+                break
+            if buf[p + 1] & 0xFC:       # reserved bits must be zero
+                p += 1
+                self.skipped += 1
+                continue
+            ln = (buf[p + 1] & 0x03) << 8 | buf[p + 2]
+            end = p + 3 + ln
+            if n - p < ln + 6:
+                break                   # incomplete; wait for more bytes
+            crc = buf[end] << 16 | buf[end + 1] << 8 | buf[end + 2]
+            if crc24q(buf, p, end) != crc:
+                self.bad_crc += 1
+                p += 1
+                self.skipped += 1
+                continue
+            mt = (buf[p + 3] << 4 | buf[p + 4] >> 4) if ln >= 2 else 0
+            self.types[mt] = self.types.get(mt, 0) + 1
+            if self.allow is None or mt in self.allow:
+                self.sink(self._mv[p:end + 3])
+                self.frames += 1
+                self.tx_bytes += ln + 6
+                self._last_frame = now
+            else:
+                self.filtered += 1
+            p = end + 3
+        if p:
+            # keep the unparsed tail (at most one partial frame)
+            if p < n:
+                self.buf[0:n - p] = bytes(self._mv[p:n])
+            self._n = n - p
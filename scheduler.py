@@ -0,0 +1,175 @@
+# scheduler.py -- which batches mqtt.py publishes, in what order, how fast.
+#
+# Every stream (imu, ecg, hr, gnss, feat, hrv) has a priority, a weight and
+# a token bucket (rate in bytes/s, burst in bytes); one more bucket holds the
+# global SCHED_BUDGET_BPS. Each publisher cycle walks the batches by
+# priority, lowest number first. Same-priority batches (one per Movesense
+# unit) take turns being first. A batch sends at most `weight` payloads per
+# cycle, and only while its stream's bucket and the global one are positive.
+# A payload is charged after the check, so one bigger than the burst still
+# goes out; the bucket then stays negative until it has paid for it.
+# Held records stay in their queue; once it fills, the queue drops its
+# oldest and ratectl.py sees the pressure.
+#
+# Rate 0 means no limit. Limits only apply while the client is connected.
+# Offline payloads go to the spool, which paces its own replay.
+#
+# configure() takes the same dict as the control topic (MQTT_CTL_TOPIC):
+#   {"budget": 20000, "imu": {"rate": 8000, "burst": 4096}, "hr": {"prio": 0}}
+import time
+from config import SCHED_STREAMS, SCHED_BUDGET_BPS
+
+# stream index -> name; same order as the stream constants in mqtt.py
+NAMES = ("imu", "ecg", "hr", "gnss", "feat", "hrv")
+_FIELDS = ("prio", "weight", "rate", "burst")
+
+class _Bucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.frac = 0           # byte-ms not yet worth a whole token
+
+    def refill(self, dt_ms):
+        if self.rate:
+            m = self.rate * dt_ms + self.frac
+            t = self.tokens + m // 1000
+            if t < self.burst:
+                self.tokens = t
+                self.frac = m % 1000
+            else:
+                self.tokens = self.burst
+                self.frac = 0
+
+    def wait_ms(self):
+        # ms until the bucket is positive again
+        if not self.rate or self.tokens > 0:
+            return 0
+        return (1 - self.tokens) * 1000 // self.rate + 1
+
+class _Stream(_Bucket):
+    def __init__(self, prio, weight, rate, burst):
+        super().__init__(rate, burst)
+        self.prio = prio
+        self.weight = weight
+        self.sent = 0           # bytes since the last rates() call
+        self.held = 0           # cycles a due batch was held back
+
+class Scheduler:
+    def __init__(self, streams=SCHED_STREAMS, budget=SCHED_BUDGET_BPS):
+        self.streams = [_Stream(*streams[n]) for n in NAMES]
+        self.budget = _Bucket(budget, max(budget, 1))
+        self.batches = []
+        self._groups = []
+        self._t = time.ticks_ms()
+        self._t_rates = self._t
+        self.changes = 0
+
+    def attach(self, batches):
+        """Take over the publisher's batches (mqtt._Batch, by `stream`)."""
+        self.batches = list(batches)
+        self._regroup()
+
+    def _regroup(self):
+        prios = sorted(set(self.streams[b.stream].prio for b in self.batches))
+        self._groups = [[b for b in self.batches
+                         if self.streams[b.stream].prio == p] for p in prios]
+
+    def order(self):
+        """Batches for this cycle, by priority; rotates within a priority."""
+        out = []
+        for g in self._groups:
+            out += g
+            if len(g) > 1:
+                g.append(g.pop(0))
+        return out
+
+    def refill(self):
+        now = time.ticks_ms()
+        dt = time.ticks_diff(now, self._t)
+        if dt <= 0:
+            return
+        self._t = now
+        self.budget.refill(dt)
+        for s in self.streams:
+            s.refill(dt)
+
+    def weight(self, stream):
+        return self.streams[stream].weight
+
+    def admit(self, stream, nbytes):
+        """Charge nbytes to the stream and the budget if both are positive."""
+        s = self.streams[stream]
+        g = self.budget
+        if (s.rate and s.tokens <= 0) or (g.rate and g.tokens <= 0):
+            s.held += 1
+            return False
+        if s.rate:
+            s.tokens -= nbytes
+        if g.rate:
+            g.tokens -= nbytes
+        s.sent += nbytes
+        return True
+
+    def wait_ms(self, stream):
+        """ms until admit() can pass for this stream."""
+        a = self.streams[stream].wait_ms()
+        b = self.budget.wait_ms()
+        return a if a > b else b
+
+    def rates(self):
+        """Achieved bytes/s per stream since the last call."""
+        now = time.ticks_ms()
+        dt = time.ticks_diff(now, self._t_rates) or 1
+        self._t_rates = now
+        out = []
+        for s in self.streams:
+            out.append(s.sent * 1000 // dt)
+            s.sent = 0
+        return out
+
+    def held(self):
+        n = 0
+        for s in self.streams:
+            n += s.held
+        return n
+
+    def configure(self, cfg):
+        """Apply {"budget": bps, "<stream>": {"prio", "weight", "rate",
+        "burst"}}; a bad key or value raises ValueError (or TypeError) before
+        anything changes."""
+        budget = None
+        new = {}
+        for k, v in cfg.items():
+            if k == "budget":
+                budget = int(v)
+                if budget < 0:
+                    raise ValueError("bad budget %d" % budget)
+                continue
+            if k not in NAMES or not isinstance(v, dict):
+                raise ValueError("unknown stream %s" % k)
+            s = self.streams[NAMES.index(k)]
+            vals = [s.prio, s.weight, s.rate, s.burst]
+            for f, x in v.items():
+                if f not in _FIELDS:
+                    raise ValueError("unknown field %s.%s" % (k, f))
+                vals[_FIELDS.index(f)] = int(x)
+            if vals[2] < 0 or vals[3] < 0:
+                raise ValueError("bad rate/burst for %s" % k)
+            vals[1] = max(1, vals[1])
+            new[s] = vals
+        # everything parsed: apply in one go
+        if budget is not None:
+            g = self.budget
+            g.rate = budget
+            g.burst = max(budget, 1)
+            g.tokens = g.burst
+            g.frac = 0
+        for s, vals in new.items():
+            s.prio, s.weight, s.rate, s.burst = vals
+            s.tokens = s.burst
+            s.frac = 0
+        self.changes += 1
+        self._regroup()
+
+sched = Scheduler()
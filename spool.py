@@ -0,0 +1,314 @@
+# spool.py -- store-and-forward of publish payloads on flash while the
+# broker or Wi-Fi is down.
+#
+# Records are appended to rotating segment files <SPOOL_DIR>/seg<seq>.bin:
+#   segment header  <4sBI   magic b"5GSP", version, sequence number
+#   record          <BBHI   qos, topic length, payload length,
+#                           crc32(topic + payload); then topic, payload
+# A new segment is started on every boot and whenever the current one reaches
+# SPOOL_SEGMENT_BYTES, so a torn write can only damage the tail of one
+# segment; replay stops at the first short or bad-CRC record in a segment and
+# moves on. Once SPOOL_MAX_SEGMENTS exist the oldest segment is deleted.
+#
+# Appends are collected in RAM and written as one block. A block that is
+# (nearly) full is always written: it is the cheapest write per byte, and
+# holding it back would only drop records. Flash wear is bounded in bytes:
+# every write is charged to a SPOOL_WRITE_BPS token bucket, and a partly
+# filled block (written once it is SPOOL_FLUSH_MAX_MS old) waits until the
+# bucket is positive, so a trickle of records is not one write each. Records
+# that still find no room are dropped and counted. Replay is token-bucket
+# limited to SPOOL_REPLAY_BPS.
+import os, time
+import ubinascii
+from struct import pack_into, unpack_from
+from config import (SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_SEGMENTS,
+                    SPOOL_BLOCK_BYTES, SPOOL_WRITE_BPS, SPOOL_FLUSH_MAX_MS,
+                    SPOOL_REPLAY_BPS)
+
+_MAGIC = b"5GSP"
+_VERSION = 1
+_SEG_HDR = "<4sBI"
+_SEG_HDR_SIZE = 9
+_REC_HDR = "<BBHI"
+_REC_HDR_SIZE = 8
+
+def _seg_name(root, seq):
+    return "%s/seg%08d.bin" % (root, seq)
+
+def _crc(topic, payload):
+    return ubinascii.crc32(payload, ubinascii.crc32(topic)) & 0xFFFFFFFF
+
+def _refill(tokens, frac, rate, dt_ms, cap):
+    # token bucket refill; `frac` carries the sub-byte remainder (in
+    # byte-ms) so frequent short calls add up to the full rate
+    frac += rate * dt_ms
+    tokens += frac // 1000
+    frac %= 1000
+    if tokens >= cap:
+        return cap, 0
+    return tokens, frac
+
+class Spool:
+    def __init__(self, root=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 max_segments=SPOOL_MAX_SEGMENTS, block_bytes=SPOOL_BLOCK_BYTES,
+                 write_bps=SPOOL_WRITE_BPS, flush_max_ms=SPOOL_FLUSH_MAX_MS,
+                 replay_bps=SPOOL_REPLAY_BPS):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.write_bps = write_bps
+        self.flush_max_ms = flush_max_ms
+        self.replay_bps = replay_bps
+        # RAM write block: records not yet on flash
+        self._ram = bytearray(block_bytes)
+        self._ram_len = 0
+        self._ram_rd = 0            # replay may consume the RAM block directly
+        self._ram_t0 = 0
+        # flash write budget (bytes), may go negative after a full block
+        self._wr_tokens = block_bytes
+        self._wr_frac = 0
+        self._wr_t = time.ticks_ms()
+        # segments on flash, oldest first
+        self._segs = []
+        self._wr_seq = None         # segment currently appended to
+        self._wr_size = 0
+        self._rd_file = None
+        self._rd_seq = None
+        self._hdr = bytearray(_REC_HDR_SIZE)
+        self._back = None           # record handed back by unread()
+        # replay token bucket
+        self._tokens = 0
+        self._tok_frac = 0
+        self._tok_t = time.ticks_ms()
+        # counters
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.corrupt = 0
+        self.lost_segments = 0
+        self.flash_writes = 0
+        self._scan()
+
+    # ---- public API ----
+
+    def append(self, topic, payload, qos=0):
+        """Spool one publish; returns False if it was dropped."""
+        n = _REC_HDR_SIZE + len(topic) + len(payload)
+        if self._ram_len + n > len(self._ram):
+            self.flush(full=True)
+            if self._ram_len + n > len(self._ram):
+                self.dropped += 1
+                return False
+        if not self._ram_len:
+            self._ram_t0 = time.ticks_ms()
+        i = self._ram_len
+        pack_into(_REC_HDR, self._ram, i, qos, len(topic), len(payload),
+                  _crc(topic, payload))
+        i += _REC_HDR_SIZE
+        self._ram[i:i + len(topic)] = topic
+        i += len(topic)
+        self._ram[i:i + len(payload)] = payload
+        self._ram_len = i + len(payload)
+        self.spooled += 1
+        return True
+
+    def flush(self, force=False, full=False):
+        """Write the RAM block to flash if it is full, or if it is old enough
+        and the write budget allows it.
+
+        Call periodically; `force` ignores both (e.g. before reset).
+        """
+        pending = self._ram_len - self._ram_rd
+        if not pending:
+            self._ram_len = self._ram_rd = 0
+            return
+        now = time.ticks_ms()
+        dt = time.ticks_diff(now, self._wr_t)
+        if dt > 0:
+            self._wr_t = now
+            self._wr_tokens, self._wr_frac = _refill(
+                self._wr_tokens, self._wr_frac, self.write_bps, dt,
+                len(self._ram))
+        if not (force or full or self._ram_len >= len(self._ram) * 3 // 4):
+            if (time.ticks_diff(now, self._ram_t0) < self.flush_max_ms
+                    or self._wr_tokens <= 0):
+                return
+        try:
+            if self._wr_seq is None or self._wr_size + pending > self.segment_bytes:
+                self._new_segment()
+            with open(_seg_name(self.root, self._wr_seq), "ab") as f:
+                f.write(memoryview(self._ram)[self._ram_rd:self._ram_len])
+            self._wr_size += pending
+            self.flash_writes += 1
+            self._wr_tokens -= pending
+        except OSError as e:
+            print("[SPOOL] write error:", e)
+            self.dropped += 1
+        self._ram_len = self._ram_rd = 0
+
+    def pending(self):
+        return (self._back is not None or bool(self._segs)
+                or self._ram_len > self._ram_rd)
+
+    def unread(self, rec):
+        """Hand back a record next_record() returned but the client did not
+        take; it is the next one out, and its replay budget is refunded."""
+        self._back = rec
+        self._tokens += len(rec[0]) + len(rec[1]) + _REC_HDR_SIZE
+        self.replayed -= 1
+
+    def next_record(self, max_bytes=None):
+        """Oldest spooled record as (topic, payload, qos), or None if the
+        spool is empty, the replay rate budget is used up, or the record is
+        larger than max_bytes (it is then left in place)."""
+        now = time.ticks_ms()
+        dt = time.ticks_diff(now, self._tok_t)
+        if dt > 0:
+            self._tok_t = now
+            self._tokens, self._tok_frac = _refill(
+                self._tokens, self._tok_frac, self.replay_bps, dt,
+                self.replay_bps)
+        if self._tokens <= 0:
+            return None
+        rec = self._back
+        if rec is not None:
+            if max_bytes is not None and len(rec[0]) + len(rec[1]) > max_bytes:
+                return None
+            self._back = None
+            return self._charge(rec)
+        while self._segs:
+            rec = self._read_file_record(max_bytes)
+            if rec is not None:
+                return self._charge(rec)
+            if self._rd_file is not None:
+                return None         # oversized for now; keep position
+        if self._ram_len > self._ram_rd:
+            rec = self._read_ram_record(max_bytes)
+            if rec is not None:
+                return self._charge(rec)
+        return None
+
+    def stats(self):
+        return (self.spooled, self.replayed, self.dropped, len(self._segs),
+                self.lost_segments)
+
+    # ---- internals ----
+
+    def _charge(self, rec):
+        self._tokens -= len(rec[0]) + len(rec[1]) + _REC_HDR_SIZE
+        self.replayed += 1
+        return rec
+
+    def _scan(self):
+        try:
+            os.mkdir(self.root)
+        except OSError:
+            pass
+        seqs = []
+        for name in os.listdir(self.root):
+            if name.startswith("seg") and name.endswith(".bin"):
+                try:
+                    seqs.append(int(name[3:-4]))
+                except ValueError:
+                    pass
+        seqs.sort()
+        hdr = bytearray(_SEG_HDR_SIZE)
+        for seq in seqs:
+            path = _seg_name(self.root, seq)
+            ok = False
+            try:
+                with open(path, "rb") as f:
+                    ok = (f.readinto(hdr) == _SEG_HDR_SIZE
+                          and unpack_from(_SEG_HDR, hdr)[:2] == (_MAGIC, _VERSION))
+            except OSError:
+                pass
+            if ok:
+                self._segs.append(seq)
+            else:
+                self._remove(seq)
+        if self._segs:
+            print("[SPOOL] %d segment(s) pending replay" % len(self._segs))
+        # never append to a segment written before a reset; the next flush
+        # starts a fresh one
+
+    def _new_segment(self):
+        seq = (self._segs[-1] + 1) if self._segs else 0
+        while len(self._segs) >= self.max_segments:
+            # out of flash budget: lose the oldest data
+            old = self._segs[0]
+            if old == self._rd_seq:
+                self._close_reader()
+            self._remove(old)
+            self._segs.pop(0)
+            self.lost_segments += 1
+        hdr = bytearray(_SEG_HDR_SIZE)
+        pack_into(_SEG_HDR, hdr, 0, _MAGIC, _VERSION, seq)
+        with open(_seg_name(self.root, seq), "wb") as f:
+            f.write(hdr)
+        if hasattr(os, "sync"):
+            os.sync()
+        self._segs.append(seq)
+        self._wr_seq = seq
+        self._wr_size = _SEG_HDR_SIZE
+
+    def _remove(self, seq):
+        try:
+            os.remove(_seg_name(self.root, seq))
+        except OSError:
+            pass
+
+    def _close_reader(self):
+        if self._rd_file:
+            self._rd_file.close()
+        self._rd_file = None
+        self._rd_seq = None
+
+    def _finish_segment(self):
+        # fully replayed (or damaged past this point): delete it
+        seq = self._segs.pop(0)
+        self._close_reader()
+        self._remove(seq)
+        if seq == self._wr_seq:
+            self._wr_seq = None
+
+    def _read_file_record(self, max_bytes):
+        seq = self._segs[0]
+        if self._rd_file is None:
+            try:
+                self._rd_file = open(_seg_name(self.root, seq), "rb")
+                self._rd_file.seek(_SEG_HDR_SIZE)
+                self._rd_seq = seq
+            except OSError:
+                self._finish_segment()
+                return None
+        f = self._rd_file
+        pos = f.tell()
+        if f.readinto(self._hdr) != _REC_HDR_SIZE:
+            self._finish_segment()
+            return None
+        qos, tl, pl, crc = unpack_from(_REC_HDR, self._hdr)
+        if max_bytes is not None and tl + pl > max_bytes:
+            f.seek(pos)
+            return None
+        topic = f.read(tl)
+        payload = f.read(pl)
+        if len(topic) != tl or len(payload) != pl or _crc(topic, payload) != crc:
+            self.corrupt += 1
+            self._finish_segment()
+            return None
+        return topic, payload, qos
+
+    def _read_ram_record(self, max_bytes):
+        i = self._ram_rd
+        qos, tl, pl, crc = unpack_from(_REC_HDR, self._ram, i)
+        if max_bytes is not None and tl + pl > max_bytes:
+            return None
+        i += _REC_HDR_SIZE
+        topic = bytes(self._ram[i:i + tl])
+        payload = bytes(self._ram[i + tl:i + tl + pl])
+        self._ram_rd = i + tl + pl
+        if self._ram_rd == self._ram_len:
+            self._ram_len = self._ram_rd = 0
+        return topic, payload, qos
+
+spool = Spool()
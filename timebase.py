@@ -0,0 +1,284 @@
+# timebase.py -- Movesense, Pico and UTC clocks on one time base.
+#
+# Three clocks meet here: the Movesense's millisecond counter (Timestamp_ms of
+# IMU/ECG notifications), the Pico's ticks_ms(), and UTC from the RTC, which
+# run() keeps NTP-synced with a non-blocking SNTP exchange.
+#
+# UtcClock maps ticks to UTC ms. time.time() has whole seconds on the Pico,
+# so every reading is a lower bound of the true UTC; the anchor follows the
+# highest one, and a reading taken just after a second boundary pins it to a
+# few ms. A reading more than a second below the anchor (NTP stepped the
+# clock back) re-anchors.
+#
+# SensorClock (one per Movesense unit) fits arrival tick against sensor
+# timestamp with exponentially weighted least squares, as offset + drift, so a
+# packet's first sample maps to UTC ms without the BLE jitter of its arrival.
+# Per stream it measures the sample period from consecutive packets and
+# counts gaps: timestamps that jump past the expected one by over half a
+# period. stamp() returns (utc_ms, period_us, missing_samples) for a packet;
+# consumers rebuild sample k as utc_ms + k * period_us / 1000.
+import time
+import machine
+import usocket as socket
+import uasyncio as asyncio
+from struct import unpack_from
+from data_queue import state
+from lagmon import lag
+from config import (NTP_HOST, NTP_SYNC_MS, NTP_RETRY_MS, TIMEBASE_ALPHA,
+                    TIMEBASE_REBASE_MS)
+
+_WARMUP = 8                 # packets before the drift term is used
+_MAX_DRIFT = 0.001          # |drift| above this is treated as noise
+_RESET_MS = 5000            # residual / timestamp jump that restarts a fit
+_REANCHOR_MS = 3600000      # keep tick differences far from wrapping
+
+_NTP_TIMEOUT_MS = 1000
+_NTP_RERESOLVE = 4          # failed exchanges before resolving NTP_HOST again
+# NTP counts from 1900; the port's time.gmtime(0) year says which epoch it uses
+_NTP_DELTA = 3155673600 if time.gmtime(0)[0] == 2000 else 2208988800
+
+_SEC_NTP = lag.section("ntp.dns")
+
+class UtcClock:
+    def __init__(self, anchor=None):
+        # anchor: (tick, utc_ms); a fixed anchor (replay) is never adjusted
+        self.fixed = anchor is not None
+        if anchor:
+            self._tick, self._utc = anchor
+        else:
+            self._tick = time.ticks_ms()
+            self._utc = int(time.time() * 1000)
+        self.steps = 0
+
+    def observe(self):
+        """Compare with time.time(); cheap enough to call per packet."""
+        if self.fixed:
+            return
+        now = time.ticks_ms()
+        obs = int(time.time() * 1000)
+        dt = time.ticks_diff(now, self._tick)
+        err = obs - (self._utc + dt)
+        if err > 0 or err < -1000:
+            if err > 1000 or err < -1000:
+                self.steps += 1
+            self._tick = now
+            self._utc = obs
+        elif dt > _REANCHOR_MS:
+            self._tick = now
+            self._utc += dt
+
+    def utc_ms(self, tick):
+        return self._utc + time.ticks_diff(tick, self._tick)
+
+utc_clock = UtcClock()
+
+def _delta(ts, ref):
+    # signed difference of two u32 sensor timestamps
+    d = (ts - ref) & 0xFFFFFFFF
+    return d - 0x100000000 if d >= 0x80000000 else d
+
+_clocks = {}
+
+def sensor_clock(series):
+    """The SensorClock of a unit; it outlives reconnects, as the sensor's
+    counter does."""
+    c = _clocks.get(series)
+    if c is None:
+        c = _clocks[series] = SensorClock()
+    return c
+
+class _Stream:
+    def __init__(self, rate):
+        self.period = 1000 / rate if rate else 0.0     # sensor ms
+        self.last_ts = None
+        self.last_n = 0
+        self.gaps = 0
+        self.missing = 0
+
+class SensorClock:
+    """Sensor timestamp <-> Pico tick fit for one Movesense unit."""
+    def __init__(self, utc=utc_clock, alpha=TIMEBASE_ALPHA):
+        self.utc = utc
+        self.alpha = alpha
+        self.streams = {}
+        self.resets = 0
+        self._reset()
+
+    def _reset(self):
+        self.n = 0
+        self._ts = 0            # reference sensor timestamp
+        self._tick = 0          # reference tick
+        # EW means and (co)variances of x = ts - _ts, y = tick delta - x
+        self._mx = self._my = 0.0
+        self._cxx = self._cxy = 0.0
+
+    def stream(self, key, rate):
+        """Set the nominal rate (Hz) of a stream; keeps its history."""
+        s = self.streams.get(key)
+        if s is None:
+            s = self.streams[key] = _Stream(rate)
+        elif rate:
+            s.period = 1000 / rate
+            s.last_ts = None
+        return s
+
+    def drift(self):
+        if self.n < _WARMUP or self._cxx <= 0:
+            return 0.0
+        b = self._cxy / self._cxx
+        return b if -_MAX_DRIFT < b < _MAX_DRIFT else 0.0
+
+    def stamp(self, key, ts, n, tick):
+        """(utc_ms, period_us, missing) for a packet of n samples whose first
+        sample has sensor time ts and which arrived at `tick`."""
+        self.utc.observe()
+        s = self.streams.get(key) or self.stream(key, 0)
+        missing = 0
+        if s.last_ts is not None:
+            dt = (ts - s.last_ts) & 0xFFFFFFFF
+            if dt >= 0x80000000:
+                # sensor clock restarted: start over on every stream
+                self.resets += 1
+                self._reset()
+                for o in self.streams.values():
+                    o.last_ts = None
+            elif s.last_n:
+                if s.period:
+                    exp = s.last_n * s.period
+                    if dt > exp + s.period / 2:
+                        missing = int(dt / s.period + 0.5) - s.last_n
+                        s.gaps += 1
+                        s.missing += missing
+                    else:
+                        # measured period, smoothed
+                        s.period += (dt / s.last_n - s.period) / 16
+                else:
+                    s.period = dt / s.last_n
+        s.last_ts = ts
+        s.last_n = n
+        self._fit(ts, tick)
+        b = self.drift()
+        return (self._utc_at(ts, b), int(s.period * 1000 * (1 + b)), missing)
+
+    def utc_ms(self, tick):
+        """UTC ms of a tick, for records without a sensor timestamp."""
+        self.utc.observe()
+        return self.utc.utc_ms(tick)
+
+    def sensor_ms(self, tick):
+        """Sensor timestamp at a tick (HR carries none), None before a fit."""
+        if not self.n:
+            return None
+        b = self.drift()
+        d = time.ticks_diff(tick, self._tick) - self._a(b)
+        return (self._ts + int(d / (1 + b))) & 0xFFFFFFFF
+
+    def _a(self, b):
+        # offset (ms) at x = 0
+        return self._my - b * self._mx
+
+    def _utc_at(self, ts, b):
+        x = _delta(ts, self._ts)
+        return self.utc.utc_ms(self._tick) + x + int(self._a(b) + b * x)
+
+    def _fit(self, ts, tick):
+        if not self.n:
+            self._ts = ts
+            self._tick = tick
+        x = _delta(ts, self._ts)
+        y = time.ticks_diff(tick, self._tick) - x
+        if self.n >= _WARMUP:
+            b = self.drift()
+            r = y - (self._a(b) + b * x)
+            if r > _RESET_MS or r < -_RESET_MS:
+                self.resets += 1
+                self._reset()
+                self._fit(ts, tick)
+                return
+        if x > TIMEBASE_REBASE_MS:
+            # move the reference to keep x small (float32 on the Pico)
+            b = self.drift()
+            d = int(self._a(b) + b * x)
+            self._ts = ts
+            self._tick = time.ticks_add(self._tick, x + d)
+            self._mx -= x
+            self._my -= d
+            x = 0
+            y -= d
+        self.n += 1
+        a = 1.0 / self.n if self.n < 1 / self.alpha else self.alpha
+        dx = x - self._mx
+        dy = y - self._my
+        self._mx += a * dx
+        self._my += a * dy
+        self._cxx = (1 - a) * (self._cxx + a * dx * dx)
+        self._cxy = (1 - a) * (self._cxy + a * dx * dy)
+
+async def _sntp(addr, timeout_ms=_NTP_TIMEOUT_MS):
+    # one SNTP exchange on a non-blocking socket; returns UTC seconds
+    q = bytearray(48)
+    q[0] = 0x1B                 # LI 0, version 3, client
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.setblocking(False)
+        s.sendto(q, addr)
+        t0 = time.ticks_ms()
+        while True:
+            try:
+                msg = s.recv(48)
+                break
+            except OSError:     # EAGAIN: no reply yet
+                pass
+            if time.ticks_diff(time.ticks_ms(), t0) >= timeout_ms:
+                raise OSError("NTP timeout")
+            await asyncio.sleep_ms(20)
+    finally:
+        s.close()
+    if len(msg) < 48:
+        raise OSError("short NTP reply")
+    return unpack_from("!I", msg, 40)[0] - _NTP_DELTA
+
+def _set_rtc(t):
+    tm = time.gmtime(t)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1,
+                            tm[3], tm[4], tm[5], 0))
+
+async def run():
+    """Keep the RTC on NTP time: once online, then every NTP_SYNC_MS.
+    Failed attempts back off from NTP_RETRY_MS up to NTP_SYNC_MS."""
+    addr = None
+    fails = 0
+    retry = NTP_RETRY_MS
+    while True:
+        synced = False
+        if state.network_connection_state:
+            try:
+                if addr is None:
+                    # DNS blocks; done once, and again only after repeated
+                    # failures (pool.ntp.org rotates its servers)
+                    tok = lag.enter(_SEC_NTP)
+                    try:
+                        addr = socket.getaddrinfo(
+                            NTP_HOST, 123, socket.AF_INET,
+                            socket.SOCK_DGRAM)[0][-1]
+                    finally:
+                        lag.exit(tok)
+                _set_rtc(await _sntp(addr))
+                synced = True
+            except Exception as e:
+                print("[TIME] NTP sync failed:", e)
+                fails += 1
+                if fails % _NTP_RERESOLVE == 0:
+                    addr = None
+            utc_clock.observe()
+            if synced:
+                print("[TIME] NTP sync ok; RTC steps seen:", utc_clock.steps)
+        if synced:
+            fails = 0
+            retry = NTP_RETRY_MS
+            await asyncio.sleep_ms(NTP_SYNC_MS)
+        elif state.network_connection_state:
+            await asyncio.sleep_ms(retry)
+            retry = min(retry * 2, NTP_SYNC_MS)
+        else:
+            await asyncio.sleep_ms(NTP_RETRY_MS)
@@ -0,0 +1,440 @@
+import uasyncio as asyncio
+import struct
+import time
+import random
+from collections import OrderedDict
+from .simple import (MQTTException, publish_size, encode_publish,
+                     encode_subscribe, _write_len, _write_str, _len_size)
+
+
+# Non-blocking MQTT 3.1.1 client on uasyncio streams.
+#
+# connect() starts a background task that owns the socket and reconnects with
+# exponential backoff and jitter; publish() only encodes the packet into a
+# bounded outgoing buffer and returns, so callers never wait on the network.
+# While the broker is unreachable the buffer keeps the newest packets and
+# drops the oldest once `out_buf_bytes` is exceeded.
+#
+# qos=1 publishes are pipelined: up to `max_inflight` packets (and at most
+# `inflight_bytes` of them) may await PUBACK at once. Unacked packets are kept
+# out of the drop-oldest path and are retransmitted with DUP after reconnect.
+class MQTTClient:
+    BACKOFF_MIN_MS = 500
+    BACKOFF_MAX_MS = 30000
+    CONNECT_TIMEOUT_MS = 10000
+    DEBUG = False
+
+    def __init__(
+        self,
+        client_id,
+        server,
+        port=0,
+        user=None,
+        password=None,
+        keepalive=0,
+        ssl=None,
+        ssl_params={},
+        out_buf_bytes=16384,
+        max_inflight=8,
+        inflight_bytes=8192,
+    ):
+        if port == 0:
+            port = 8883 if ssl else 1883
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.ssl = ssl
+        self.ssl_params = ssl_params
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.cb = None
+        self.pid = 0
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 0
+        self.lw_retain = False
+        # outgoing buffer
+        self._out = []
+        self._out_bytes = 0
+        self._out_max = out_buf_bytes
+        self._ev_out = asyncio.Event()
+        self._wbuf = bytearray(1024)
+        # qos=1 packets awaiting PUBACK: pid -> encoded PUBLISH
+        self._inflight = OrderedDict()
+        self._inflight_bytes = 0
+        self._inflight_max = inflight_bytes
+        self.max_inflight = max_inflight
+        self._ev_slot = asyncio.Event()
+        # connection state
+        self._reader = None
+        self._writer = None
+        self._connected = False
+        self._ev_up = asyncio.Event()
+        self._ev_down = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self._last_rx = 0
+        self._subs = {}
+        self._suback = {}
+        # counters
+        self.dropped = 0
+        self.reconnects = 0
+        self.acked = 0
+        self.retransmits = 0
+
+    def log(self, msg):
+        if self.DEBUG:
+            print("[MQTT-aio] %s" % msg)
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    def is_connected(self):
+        return self._connected
+
+    def pending_bytes(self):
+        return self._out_bytes
+
+    def inflight(self):
+        return len(self._inflight)
+
+    def inflight_room(self, nbytes=0):
+        """True if a qos=1 message of about nbytes fits the in-flight window."""
+        n = len(self._inflight)
+        if n >= self.max_inflight:
+            return False
+        # an oversized message is still accepted when nothing is in flight
+        return not n or self._inflight_bytes + nbytes <= self._inflight_max
+
+    async def connect(self, timeout_ms=None):
+        """Start the background connection task; wait up to timeout_ms for the
+        first CONNACK. Returns True when connected. Never raises for network
+        errors: the background task keeps retrying."""
+        self._closing = False
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if timeout_ms is None:
+            timeout_ms = self.CONNECT_TIMEOUT_MS
+        try:
+            await asyncio.wait_for_ms(self._ev_up.wait(), timeout_ms)
+        except asyncio.TimeoutError:
+            pass
+        return self._connected
+
+    async def disconnect(self):
+        self._closing = True
+        if self._connected:
+            try:
+                self._writer.write(b"\xe0\0")
+                await self._writer.drain()
+            except Exception:
+                pass
+        self._close()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, topic, msg, retain=False, qos=0, timeout_ms=0):
+        """Queue a PUBLISH; returns False if it was not accepted.
+
+        qos=0 fails only if the packet is larger than the outgoing buffer.
+        qos=1 waits up to timeout_ms for room in the in-flight window
+        (0 = don't wait) and is sent once the connection is up.
+        """
+        if qos == 0:
+            pkt = bytearray(publish_size(topic, msg))
+            encode_publish(pkt, 0, topic, msg, retain)
+            return self._queue(pkt)
+        if qos != 1:
+            raise ValueError("qos=2 not supported")
+        size = publish_size(topic, msg, 1)
+        if not self.inflight_room(size):
+            if not timeout_ms:
+                return False
+            t0 = time.ticks_ms()
+            while not self.inflight_room(size):
+                left = timeout_ms - time.ticks_diff(time.ticks_ms(), t0)
+                if left <= 0:
+                    return False
+                self._ev_slot.clear()
+                try:
+                    await asyncio.wait_for_ms(self._ev_slot.wait(), left)
+                except asyncio.TimeoutError:
+                    return False
+        pid = self._next_pid()
+        pkt = bytearray(size)
+        encode_publish(pkt, 0, topic, msg, retain, 1, pid)
+        self._inflight[pid] = pkt
+        self._inflight_bytes += size
+        if self._connected:
+            self._queue(pkt)
+        return True
+
+    async def subscribe(self, topic, qos=0, timeout_ms=5000):
+        assert self.cb is not None, "Subscribe callback is not set"
+        self._subs[topic] = qos
+        if self._connected:
+            await self._send_subscribe(topic, qos, timeout_ms)
+
+    # ---- internals ----
+
+    def _next_pid(self):
+        while True:
+            self.pid = self.pid % 65535 + 1
+            if self.pid not in self._inflight and self.pid not in self._suback:
+                return self.pid
+
+    def _queue(self, pkt):
+        n = len(pkt)
+        if n > self._out_max:
+            self.dropped += 1
+            return False
+        i = 0
+        while i < len(self._out) and self._out_bytes + n > self._out_max:
+            if self._out[i][0] & 0xF6 == 0x32:
+                # qos=1 PUBLISH: owned by the in-flight window, never dropped
+                i += 1
+                continue
+            self._out_bytes -= len(self._out.pop(i))
+            self.dropped += 1
+        self._out.append(pkt)
+        self._out_bytes += n
+        self._ev_out.set()
+        return True
+
+    def _subscribe_packet(self, topic, qos, pid):
+        sz = 2 + 2 + len(topic) + 1
+        pkt = bytearray(1 + _len_size(sz) + sz)
+        encode_subscribe(pkt, 0, topic, qos, pid)
+        return pkt
+
+    async def _send_subscribe(self, topic, qos, timeout_ms):
+        pid = self._next_pid()
+        ev = asyncio.Event()
+        self._suback[pid] = ev
+        try:
+            self._queue(self._subscribe_packet(topic, qos, pid))
+            await asyncio.wait_for_ms(ev.wait(), timeout_ms)
+        finally:
+            self._suback.pop(pid, None)
+
+    def _ssl_context(self):
+        if self.ssl is not True:
+            return self.ssl
+        import ssl
+
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        cadata = self.ssl_params.get("cadata")
+        if cadata:
+            ctx.load_verify_locations(cadata=cadata)
+            ctx.verify_mode = ssl.CERT_REQUIRED
+        else:
+            if hasattr(ctx, "check_hostname"):
+                ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        return ctx
+
+    def _connect_packet(self):
+        msg = bytearray(b"\0\x04MQTT\x04\x02\0\0")
+        sz = 10 + 2 + len(self.client_id)
+        if self.user:
+            sz += 2 + len(self.user) + 2 + len(self.pswd)
+            msg[7] |= 0xC0
+        if self.keepalive:
+            assert self.keepalive < 65536
+            msg[8] |= self.keepalive >> 8
+            msg[9] |= self.keepalive & 0x00FF
+        if self.lw_topic:
+            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
+            msg[7] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            msg[7] |= self.lw_retain << 5
+        pkt = bytearray(1 + _len_size(sz) + sz)
+        pkt[0] = 0x10
+        i = _write_len(pkt, 1, sz)
+        pkt[i : i + 10] = msg
+        i = _write_str(pkt, i + 10, self.client_id)
+        if self.lw_topic:
+            i = _write_str(pkt, i, self.lw_topic)
+            i = _write_str(pkt, i, self.lw_msg)
+        if self.user:
+            i = _write_str(pkt, i, self.user)
+            i = _write_str(pkt, i, self.pswd)
+        return pkt
+
+    async def _open(self):
+        ctx = self._ssl_context() if self.ssl else None
+        # bounded like the CONNACK read: an unanswered SYN or TLS handshake
+        # must fail so _run() can back off and retry
+        if ctx:
+            conn = asyncio.open_connection(self.server, self.port, ssl=ctx)
+        else:
+            conn = asyncio.open_connection(self.server, self.port)
+        r, w = await asyncio.wait_for_ms(conn, self.CONNECT_TIMEOUT_MS)
+        self._reader, self._writer = r, w
+        w.write(self._connect_packet())
+        await w.drain()
+        resp = await asyncio.wait_for_ms(r.readexactly(4), self.CONNECT_TIMEOUT_MS)
+        if resp[0] != 0x20 or resp[1] != 0x02:
+            raise MQTTException(-1)
+        if resp[3] != 0:
+            raise MQTTException(resp[3])
+        self._last_rx = time.ticks_ms()
+
+    def _close(self):
+        self._connected = False
+        self._ev_up.clear()
+        w = self._writer
+        self._reader = self._writer = None
+        if w:
+            try:
+                w.close()
+            except Exception:
+                pass
+
+    async def _run(self):
+        delay = self.BACKOFF_MIN_MS
+        while not self._closing:
+            try:
+                await self._open()
+                self._connected = True
+                self._ev_up.set()
+                delay = self.BACKOFF_MIN_MS
+                self.log("connected")
+                await self._session()
+            except asyncio.CancelledError:
+                self._close()
+                raise
+            except Exception as e:
+                self.log("connection lost: %r" % e)
+            self._close()
+            if self._closing:
+                break
+            self.reconnects += 1
+            # exponential backoff with jitter: sleep in [delay/2, delay)
+            half = delay // 2
+            await asyncio.sleep_ms(half + random.getrandbits(16) % (half + 1))
+            delay = min(delay * 2, self.BACKOFF_MAX_MS)
+
+    async def _session(self):
+        self._ev_down.clear()
+        tasks = [asyncio.create_task(self._guard(self._read_loop())),
+                 asyncio.create_task(self._guard(self._write_loop()))]
+        if self.keepalive:
+            tasks.append(asyncio.create_task(self._guard(self._keepalive_loop())))
+        try:
+            # re-send everything unacked, flagged DUP (it may have reached the
+            # broker before the link dropped); drop queued copies first so
+            # nothing goes out twice
+            self._out = [p for p in self._out if p[0] & 0xF6 != 0x32]
+            self._out_bytes = 0
+            for p in self._out:
+                self._out_bytes += len(p)
+            for pkt in self._inflight.values():
+                pkt[0] |= 0x08
+                self._queue(pkt)
+                self.retransmits += 1
+            for topic, qos in self._subs.items():
+                pid = self._next_pid()
+                self._queue(self._subscribe_packet(topic, qos, pid))
+            await self._ev_down.wait()
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def _guard(self, coro):
+        # any loop ending (error, EOF, keepalive timeout) ends the session
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log("session error: %r" % e)
+        self._ev_down.set()
+
+    async def _write_loop(self):
+        while True:
+            if not self._out:
+                self._ev_out.clear()
+                await self._ev_out.wait()
+            # coalesce everything queued so far into one write (one TLS
+            # record) using a reusable buffer
+            pkts = self._out
+            n = self._out_bytes
+            self._out = []
+            self._out_bytes = 0
+            if len(self._wbuf) < n:
+                self._wbuf = bytearray(n)
+            buf = self._wbuf
+            i = 0
+            for p in pkts:
+                buf[i : i + len(p)] = p
+                i += len(p)
+            self._writer.write(memoryview(buf)[:n])
+            await self._writer.drain()
+
+    async def _keepalive_loop(self):
+        period = self.keepalive * 1000 // 2
+        while True:
+            await asyncio.sleep_ms(period)
+            if time.ticks_diff(time.ticks_ms(), self._last_rx) > 3 * period:
+                self.log("keepalive timeout")
+                return
+            self._queue(b"\xc0\0")
+
+    async def _read_loop(self):
+        while True:
+            r = self._reader
+            if r is None:
+                raise OSError(-1)
+            op = await r.read(1)
+            if not op:
+                raise OSError(-1)
+            n = 0
+            sh = 0
+            while True:
+                b = (await r.readexactly(1))[0]
+                n |= (b & 0x7F) << sh
+                if not b & 0x80:
+                    break
+                sh += 7
+            body = await r.readexactly(n) if n else b""
+            self._last_rx = time.ticks_ms()
+            self._dispatch(op[0], body)
+
+    def _dispatch(self, op, body):
+        t = op & 0xF0
+        if t == 0x30:
+            tl = body[0] << 8 | body[1]
+            topic = body[2:2 + tl]
+            i = 2 + tl
+            if op & 6:
+                pid = body[i] << 8 | body[i + 1]
+                i += 2
+                if op & 6 == 2:
+                    self._queue(struct.pack("!BBH", 0x40, 2, pid))
+            if self.cb:
+                self.cb(topic, body[i:])
+        elif t == 0x40:
+            pid = body[0] << 8 | body[1]
+            pkt = self._inflight.pop(pid, None)
+            if pkt is not None:
+                self._inflight_bytes -= len(pkt)
+                self.acked += 1
+                self._ev_slot.set()
+        elif t == 0x90:
+            pid = body[0] << 8 | body[1]
+            ev = self._suback.get(pid)
+            if ev:
+                if body[2] == 0x80:
+                    self.log("subscribe %d refused" % pid)
+                ev.set()
+        # PINGRESP (0xD0) only refreshes _last_rx
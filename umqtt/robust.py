@@ -34,6 +34,14 @@ class MQTTClient(simple.MQTTClient):
                 self.log(False, e)
             self.reconnect()
 
+    def publish_many(self, msgs, retain=False):
+        while 1:
+            try:
+                return super().publish_many(msgs, retain)
+            except OSError as e:
+                self.log(False, e)
+            self.reconnect()
+
     def wait_msg(self):
         while 1:
             try:
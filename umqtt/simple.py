@@ -7,7 +7,67 @@ class MQTTException(Exception):
     pass
 
 
+# Packet encoders write straight into a caller-supplied bytearray at offset
+# `i` and return the offset just past what they wrote, so a whole packet (or
+# several) can be sent with a single write() / TLS record.
+def _write_len(buf, i, sz):
+    while sz > 0x7F:
+        buf[i] = (sz & 0x7F) | 0x80
+        sz >>= 7
+        i += 1
+    buf[i] = sz
+    return i + 1
+
+
+def _write_str(buf, i, s):
+    n = len(s)
+    buf[i] = n >> 8
+    buf[i + 1] = n & 0xFF
+    buf[i + 2 : i + 2 + n] = s
+    return i + 2 + n
+
+
+def _len_size(sz):
+    return 1 if sz < 0x80 else 2 if sz < 0x4000 else 3 if sz < 0x200000 else 4
+
+
+def publish_size(topic, msg, qos=0):
+    sz = 2 + len(topic) + len(msg)
+    if qos > 0:
+        sz += 2
+    return 1 + _len_size(sz) + sz
+
+
+def encode_publish(buf, i, topic, msg, retain=False, qos=0, pid=0, dup=False):
+    sz = 2 + len(topic) + len(msg)
+    if qos > 0:
+        sz += 2
+    assert sz < 2097152
+    buf[i] = 0x30 | dup << 3 | qos << 1 | retain
+    i = _write_len(buf, i + 1, sz)
+    i = _write_str(buf, i, topic)
+    if qos > 0:
+        buf[i] = pid >> 8
+        buf[i + 1] = pid & 0xFF
+        i += 2
+    n = len(msg)
+    buf[i : i + n] = msg
+    return i + n
+
+
+def encode_subscribe(buf, i, topic, qos, pid):
+    buf[i] = 0x82
+    i = _write_len(buf, i + 1, 2 + 2 + len(topic) + 1)
+    buf[i] = pid >> 8
+    buf[i + 1] = pid & 0xFF
+    i = _write_str(buf, i + 2, topic)
+    buf[i] = qos
+    return i + 1
+
+
 class MQTTClient:
+    BUF_SIZE = 512
+
     def __init__(
         self,
         client_id,
@@ -36,10 +96,13 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # reusable packet buffer, grown on demand
+        self._buf = bytearray(self.BUF_SIZE)
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    def _ensure(self, n):
+        if len(self._buf) < n:
+            self._buf = bytearray(n)
+        return self._buf
 
     def _recv_len(self):
         n = 0
@@ -74,40 +137,35 @@ class MQTTClient:
             self.sock = ssl.wrap_socket(self.sock, **self.ssl_params)
         elif self.ssl:
             self.sock = self.ssl.wrap_socket(self.sock, server_hostname=self.server)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
+        msg = bytearray(b"\0\x04MQTT\x04\x02\0\0")
 
         sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
+        msg[7] = clean_session << 1
         if self.user:
             sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
+            msg[7] |= 0xC0
         if self.keepalive:
             assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
+            msg[8] |= self.keepalive >> 8
+            msg[9] |= self.keepalive & 0x00FF
         if self.lw_topic:
             sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
-
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
+            msg[7] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            msg[7] |= self.lw_retain << 5
+
+        buf = self._ensure(1 + _len_size(sz) + sz)
+        buf[0] = 0x10
+        i = _write_len(buf, 1, sz)
+        buf[i : i + 10] = msg
+        i = _write_str(buf, i + 10, self.client_id)
         if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
+            i = _write_str(buf, i, self.lw_topic)
+            i = _write_str(buf, i, self.lw_msg)
         if self.user:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
+            i = _write_str(buf, i, self.user)
+            i = _write_str(buf, i, self.pswd)
+        # print(hex(i), hexlify(buf[:i], ":"))
+        self.sock.write(buf, i)
         resp = self.sock.read(4)
         assert resp[0] == 0x20 and resp[1] == 0x02
         if resp[3] != 0:
@@ -122,27 +180,14 @@ class MQTTClient:
         self.sock.write(b"\xc0\0")
 
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
-        if qos > 0:
-            sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        pid = 0
         if qos > 0:
-            self.pid += 1
+            self.pid = self.pid % 65535 + 1
             pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
+        buf = self._ensure(publish_size(topic, msg, qos))
+        n = encode_publish(buf, 0, topic, msg, retain, qos, pid)
+        # print(hex(n), hexlify(buf[:n], ":"))
+        self.sock.write(buf, n)
         if qos == 1:
             while 1:
                 op = self.wait_msg()
@@ -156,21 +201,34 @@ class MQTTClient:
         elif qos == 2:
             assert 0
 
+    # Send several qos=0 messages, given as (topic, msg) pairs, with a single
+    # write so that over TLS they share one record.
+    def publish_many(self, msgs, retain=False):
+        size = 0
+        for topic, msg in msgs:
+            size += publish_size(topic, msg)
+        buf = self._ensure(size)
+        n = 0
+        for topic, msg in msgs:
+            n = encode_publish(buf, n, topic, msg, retain)
+        if n:
+            self.sock.write(buf, n)
+
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        self.pid = self.pid % 65535 + 1
+        pid = self.pid
+        sz = 2 + 2 + len(topic) + 1
+        buf = self._ensure(1 + _len_size(sz) + sz)
+        n = encode_subscribe(buf, 0, topic, qos, pid)
+        # print(hex(n), hexlify(buf[:n], ":"))
+        self.sock.write(buf, n)
         while 1:
             op = self.wait_msg()
             if op == 0x90:
                 resp = self.sock.read(4)
                 # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                assert resp[1] == pid >> 8 and resp[2] == pid & 0xFF
                 if resp[3] == 0x80:
                     raise MQTTException(resp[3])
                 return
@@ -25,3 +25,11 @@ async def connect_wifi(max_wait_s=20):
     state.network_connection_state = False
     return False
 
+async def wifi_watchdog(check_ms=5000):
+    """Re-join the AP whenever the link drops; MQTT reconnects on its own."""
+    wlan = network.WLAN(network.STA_IF)
+    while True:
+        await asyncio.sleep_ms(check_ms)
+        if not wlan.isconnected():
+            state.network_connection_state = False
+            await connect_wifi()
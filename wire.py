@@ -0,0 +1,165 @@
+# wire.py -- compact binary encoding for sensor records (opt-in, see
+# config.WIRE_FORMAT). Decoding lives in wire_decode.py, which runs on CPython.
+#
+# One MQTT payload ("packet") is a packet header followed by frame_count frames:
+#   packet header  <2sBB8sQ  magic b"5G", version, frame_count,
+#                            Pico unique id (8 bytes), Movesense serial (0 = none)
+#   frame header   <BBHII    schema, flags, count, sensor timestamp ms, UTC s
+#   time extension <QIH      (flags & FLAG_TIME) UTC ms of the first sample,
+#                            sample period us, samples missing before this
+#                            frame -- see timebase.py
+#   frame body     depends on schema (little-endian, fixed point):
+#     IMU6/IMU9  count*3 int16 per sensor block (acc, gyro[, magn]) in the
+#                same order the Movesense sends them
+#     ECG        count int32 raw samples
+#     HR         uint16 average bpm * HR_SCALE, then count uint16 RR intervals
+#     GNSS       int32 lat, int32 lon (deg * GNSS_SCALE), uint8 fix quality
+#     FEAT       features.py window summary, count = samples in the window:
+#                uint16 acc RMS x3, |acc| mean/std/min/max (ACC_SCALE),
+#                gyro RMS x3 (GYRO_SCALE), jerk RMS/max (JERK_SCALE),
+#                cadence (CADENCE_SCALE), then uint8 steps, uint8 events
+#     HRV        hrv.py window metrics, count = RR intervals in the window:
+#                uint16 mean RR ms, RMSSD, SDNN (HRV_SCALE), pNN50 %
+#                (HRV_SCALE), artifacts since the last record, uint8 flags
+from struct import pack_into, unpack_from
+
+MAGIC = b"5G"
+WIRE_VERSION = 2     # 2: time extension
+
+SCHEMA_IMU6 = 1
+SCHEMA_IMU9 = 2
+SCHEMA_ECG  = 3
+SCHEMA_HR   = 4
+SCHEMA_GNSS = 5
+SCHEMA_FEAT = 6
+SCHEMA_HRV  = 7
+
+PKT_HDR = "<2sBB8sQ"
+PKT_HDR_SIZE = 20
+FRAME_HDR = "<BBHII"
+FRAME_HDR_SIZE = 12
+TIME_EXT = "<QIH"
+TIME_EXT_SIZE = 14
+FLAG_TIME = 0x01
+FEAT_BODY = "<13H2B"
+FEAT_BODY_SIZE = 28
+HRV_BODY = "<5HB"
+HRV_BODY_SIZE = 11
+
+# fixed-point scales (value * scale -> integer on the wire)
+ACC_SCALE  = 100        # m/s^2  -> 0.01
+GYRO_SCALE = 10         # deg/s  -> 0.1
+MAGN_SCALE = 10         # uT     -> 0.1
+HR_SCALE   = 100        # bpm    -> 0.01
+GNSS_SCALE = 10000000   # deg    -> 1e-7
+JERK_SCALE = 10         # m/s^3  -> 0.1
+CADENCE_SCALE = 10      # 1/min  -> 0.1
+HRV_SCALE  = 10         # ms, %  -> 0.1
+
+MAX_FRAMES = 255
+_IMU_SCALES = (ACC_SCALE, GYRO_SCALE, MAGN_SCALE)
+
+def _q16(v):
+    # round half away from zero and saturate to int16
+    v = int(v + 0.5) if v >= 0 else int(v - 0.5)
+    if v > 32767:
+        return 32767
+    if v < -32768:
+        return -32768
+    return v
+
+def _frame(schema, n, ts_ms, utc, body, st):
+    # header (+ time extension if st = (utc_ms, period_us, missing)) and
+    # room for `body` bytes; returns (frame, body offset)
+    ext = TIME_EXT_SIZE if st else 0
+    out = bytearray(FRAME_HDR_SIZE + ext + body)
+    pack_into(FRAME_HDR, out, 0, schema, FLAG_TIME if st else 0, n,
+              ts_ms & 0xFFFFFFFF, int(utc))
+    if st:
+        pack_into(TIME_EXT, out, FRAME_HDR_SIZE, st[0], st[1],
+                  min(st[2], 65535))
+    return out, FRAME_HDR_SIZE + ext
+
+def encode_imu(vals, n, imu9, ts_ms, utc, st=None):
+    """Decoded IMU values (Movesense order, n samples per sensor) -> frame."""
+    cnt = n * (9 if imu9 else 6)
+    out, off = _frame(SCHEMA_IMU9 if imu9 else SCHEMA_IMU6, n, ts_ms, utc,
+                      cnt * 2, st)
+    per = n * 3
+    for i in range(cnt):
+        pack_into("<h", out, off, _q16(vals[i] * _IMU_SCALES[i // per]))
+        off += 2
+    return out
+
+def encode_ecg(data, utc, st=None):
+    """Raw GSP ECG notification -> ECG frame (samples copied as-is)."""
+    n = (len(data) - 6) // 4
+    out, off = _frame(SCHEMA_ECG, n, unpack_from("<I", data, 2)[0], utc,
+                      n * 4, st)
+    out[off:] = memoryview(data)[6:6 + n * 4]
+    return out
+
+def encode_hr(data, utc, ts_ms=0, st=None):
+    """Raw GSP HR notification -> HR frame (RR intervals copied as-is)."""
+    n = (len(data) - 6) // 2
+    out, off = _frame(SCHEMA_HR, n, ts_ms, utc, 2 + n * 2, st)
+    bpm = int(unpack_from("<f", data, 2)[0] * HR_SCALE + 0.5)
+    pack_into("<H", out, off, min(max(bpm, 0), 65535))
+    out[off + 2:] = memoryview(data)[6:6 + n * 2]
+    return out
+
+def encode_gnss(lat, lon, fixq, utc, ts_ms=0):
+    out = bytearray(FRAME_HDR_SIZE + 9)
+    pack_into(FRAME_HDR, out, 0, SCHEMA_GNSS, 0, 1, ts_ms & 0xFFFFFFFF, int(utc))
+    pack_into("<iiB", out, FRAME_HDR_SIZE,
+              int(lat * GNSS_SCALE), int(lon * GNSS_SCALE), fixq)
+    return out
+
+_FEAT_SCALES = (ACC_SCALE,) * 7 + (GYRO_SCALE,) * 3 + (JERK_SCALE,) * 2
+
+def _u16(v):
+    v = int(v + 0.5)
+    return 65535 if v > 65535 else v
+
+def encode_features(vals, n, st):
+    """features.ImuFeatures.summary() of an n-sample window -> frame."""
+    out, off = _frame(SCHEMA_FEAT, n, 0, st[0] // 1000, FEAT_BODY_SIZE, st)
+    q = [_u16(vals[i] * _FEAT_SCALES[i]) for i in range(12)]
+    pack_into(FEAT_BODY, out, off, *q, _u16(vals[13] * CADENCE_SCALE),
+              min(vals[12], 255), min(vals[14], 255))
+    return out
+
+def encode_hrv(vals, n, artifacts, flags, utc_ms):
+    """hrv.Hrv.metrics() of an n-interval window -> frame."""
+    out, off = _frame(SCHEMA_HRV, n, 0, utc_ms // 1000, HRV_BODY_SIZE,
+                      (utc_ms, 0, 0))
+    pack_into(HRV_BODY, out, off, _u16(vals[0]), _u16(vals[1] * HRV_SCALE),
+              _u16(vals[2] * HRV_SCALE), _u16(vals[3] * HRV_SCALE),
+              min(artifacts, 65535), flags)
+    return out
+
+def encode_packet(pico_id, series, frames):
+    """Prefix up to MAX_FRAMES frames with a packet header.
+
+    pico_id: 8 raw bytes (machine.unique_id()); series: int serial or 0.
+    """
+    n = len(frames)
+    if n > MAX_FRAMES:
+        raise ValueError("too many frames")
+    size = PKT_HDR_SIZE
+    for f in frames:
+        size += len(f)
+    out = bytearray(size)
+    pack_into(PKT_HDR, out, 0, MAGIC, WIRE_VERSION, n, pico_id, series)
+    off = PKT_HDR_SIZE
+    for f in frames:
+        out[off:off + len(f)] = f
+        off += len(f)
+    return out
+
+def series_id(series):
+    """Movesense serial string -> integer for the packet header (0 if unknown)."""
+    try:
+        return int(series)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,120 @@
+# wire_decode.py -- CPython decoder for the binary payloads built by wire.py.
+#
+#   python wire_decode.py payload.bin [...]     # prints one JSON object per packet
+from struct import unpack_from
+
+from wire import (MAGIC, WIRE_VERSION, PKT_HDR, PKT_HDR_SIZE, FRAME_HDR,
+                  FRAME_HDR_SIZE, TIME_EXT, TIME_EXT_SIZE, FLAG_TIME,
+                  SCHEMA_IMU6, SCHEMA_IMU9, SCHEMA_ECG, SCHEMA_HR,
+                  SCHEMA_GNSS, SCHEMA_FEAT, SCHEMA_HRV, FEAT_BODY,
+                  FEAT_BODY_SIZE, HRV_BODY, HRV_BODY_SIZE, ACC_SCALE,
+                  GYRO_SCALE, MAGN_SCALE, HR_SCALE, GNSS_SCALE, JERK_SCALE,
+                  CADENCE_SCALE, HRV_SCALE)
+
+class WireError(ValueError):
+    pass
+
+def _xyz(vals, off, n, scale):
+    return [{"x": vals[off + 3 * i] / scale,
+             "y": vals[off + 3 * i + 1] / scale,
+             "z": vals[off + 3 * i + 2] / scale} for i in range(n)]
+
+def decode_frame(buf, off=0):
+    """Decode one frame at `off`; returns (record dict, next offset).
+
+    Records use the same field names as the JSON wire format.
+    """
+    if len(buf) - off < FRAME_HDR_SIZE:
+        raise WireError("truncated frame header")
+    schema, flags, n, ts, utc = unpack_from(FRAME_HDR, buf, off)
+    off += FRAME_HDR_SIZE
+    rec = {"Timestamp_UTC": utc, "Timestamp_ms": ts}
+    if flags & FLAG_TIME:
+        _need(buf, off, TIME_EXT_SIZE)
+        utc_ms, period, missing = unpack_from(TIME_EXT, buf, off)
+        off += TIME_EXT_SIZE
+        rec["Timestamp_UTC_ms"] = utc_ms
+        if schema not in (SCHEMA_HR, SCHEMA_HRV):
+            rec["Sample_period_us"] = period
+            rec["Missing_samples"] = missing
+    if schema in (SCHEMA_IMU6, SCHEMA_IMU9):
+        blocks = 3 if schema == SCHEMA_IMU9 else 2
+        cnt = n * 3 * blocks
+        _need(buf, off, cnt * 2)
+        vals = unpack_from("<%dh" % cnt, buf, off)
+        off += cnt * 2
+        rec["ArrayAcc"] = _xyz(vals, 0, n, ACC_SCALE)
+        rec["ArrayGyro"] = _xyz(vals, 3 * n, n, GYRO_SCALE)
+        rec["ArrayMagn"] = _xyz(vals, 6 * n, n, MAGN_SCALE) if blocks == 3 else []
+    elif schema == SCHEMA_ECG:
+        _need(buf, off, n * 4)
+        rec["Samples"] = list(unpack_from("<%di" % n, buf, off))
+        off += n * 4
+    elif schema == SCHEMA_HR:
+        _need(buf, off, 2 + n * 2)
+        rec["Average_BPM"] = unpack_from("<H", buf, off)[0] / HR_SCALE
+        rec["rrData"] = list(unpack_from("<%dH" % n, buf, off + 2))
+        off += 2 + n * 2
+    elif schema == SCHEMA_GNSS:
+        _need(buf, off, 9)
+        lat, lon, fixq = unpack_from("<iiB", buf, off)
+        rec["Latitude"] = lat / GNSS_SCALE
+        rec["Longitude"] = lon / GNSS_SCALE
+        rec["FixQ"] = fixq
+        off += 9
+    elif schema == SCHEMA_FEAT:
+        _need(buf, off, FEAT_BODY_SIZE)
+        v = unpack_from(FEAT_BODY, buf, off)
+        rec["Window_ms"] = n * rec.get("Sample_period_us", 0) // 1000
+        rec["Samples"] = n
+        rec["AccRms"] = [x / ACC_SCALE for x in v[0:3]]
+        rec["AccMag"] = [x / ACC_SCALE for x in v[3:7]]
+        rec["GyroRms"] = [x / GYRO_SCALE for x in v[7:10]]
+        rec["Jerk"] = [x / JERK_SCALE for x in v[10:12]]
+        rec["Cadence"] = v[12] / CADENCE_SCALE
+        rec["Steps"] = v[13]
+        rec["Events"] = v[14]
+        off += FEAT_BODY_SIZE
+    elif schema == SCHEMA_HRV:
+        _need(buf, off, HRV_BODY_SIZE)
+        v = unpack_from(HRV_BODY, buf, off)
+        rec["Beats"] = n
+        rec["Mean_RR"] = v[0]
+        rec["RMSSD"] = v[1] / HRV_SCALE
+        rec["SDNN"] = v[2] / HRV_SCALE
+        rec["pNN50"] = v[3] / HRV_SCALE
+        rec["Artifacts"] = v[4]
+        rec["Flags"] = v[5]
+        off += HRV_BODY_SIZE
+    else:
+        raise WireError("unknown schema %d" % schema)
+    rec["schema"] = schema
+    return rec, off
+
+def _need(buf, off, size):
+    if len(buf) - off < size:
+        raise WireError("truncated frame body")
+
+def decode_packet(buf):
+    """Decode one MQTT payload into {"Pico_ID", "Movesense_series", "frames"}."""
+    if len(buf) < PKT_HDR_SIZE:
+        raise WireError("truncated packet header")
+    magic, version, count, pico, series = unpack_from(PKT_HDR, buf, 0)
+    if magic != MAGIC:
+        raise WireError("bad magic")
+    if not 1 <= version <= WIRE_VERSION:
+        raise WireError("unsupported version %d" % version)
+    frames = []
+    off = PKT_HDR_SIZE
+    for _ in range(count):
+        rec, off = decode_frame(buf, off)
+        frames.append(rec)
+    return {"Pico_ID": pico.hex(),
+            "Movesense_series": str(series) if series else None,
+            "frames": frames}
+
+if __name__ == "__main__":
+    import json, sys
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            print(json.dumps(decode_packet(f.read()), separators=(",", ":")))